@@ -0,0 +1,102 @@
+"""
+Memory check of the streaming export (`flask export`): exports the ratings table with --small and with --rows synthetic rows,
+each in a fresh process, and reports the peak RSS of that process. Memory use should not depend on the number of rows,
+so the export of the large table has to stay under --max-rss megabytes.
+
+Usage:
+    python benchmarks/bench_export.py --rows 1000000 --max-rss 120
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.models import Rating
+import sqlalchemy as sa
+
+# Runs `flask` in the child process and reports its own peak RSS (in KiB) on the last line of stderr.
+# On Linux ru_maxrss includes the peak of the parent before the exec, so VmHWM (reset on exec) is used where it is available.
+CHILD = '''
+import resource, sys
+from flask.cli import main
+sys.argv = ['flask'] + sys.argv[1:]
+try:
+    main()
+except SystemExit as e:
+    if e.code:
+        raise
+try:
+    with open('/proc/self/status') as f:
+        peak = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(peak, file=sys.stderr)
+'''
+
+def add_synthetic_ratings(num_rows, user_ids, chunk_size=50000):
+    """Add num_rows random ratings, without matches (so they are quick to generate)."""
+    rng = random.Random(7)
+    since = datetime(2024, 1, 1)
+    for start in range(0, num_rows, chunk_size):
+        rows = []
+        for _ in range(min(chunk_size, num_rows - start)):
+            since += timedelta(seconds=rng.randint(1, 600))
+            rating = rng.randint(1200, 1800)
+            rows.append({'user_id': rng.choice(user_ids), 'since': since, 'season': 2,
+                         'previous_rating': rating, 'rating': rating + rng.randint(-20, 20),
+                         'previous_rating_season': rating, 'rating_season': rating + rng.randint(-20, 20)})
+        db.session.execute(sa.insert(Rating), rows)
+    db.session.commit()
+
+def export(database_path, output_path, *options):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database_path, SECRET_KEY='benchmark', FLASK_APP='app.py')
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', CHILD, 'export', 'ratings', '-o', output_path, *options],
+                             cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr[-2000:])
+    return int(process.stderr.strip().splitlines()[-1]) / 1024, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--small', type=int, default=10000)
+    parser.add_argument('--max-rss', type=float, default=120, help='Maximum peak RSS of the large export, in MiB.')
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for num_rows in [args.small, args.rows]:
+            database_path = os.path.join(tmp, f'export_{num_rows}.sqlite')
+            app = create_app(config_for(database_path))
+            with app.app_context():
+                db.create_all()
+                user_ids = generate_league(db, 40, 1)
+                add_synthetic_ratings(num_rows, user_ids)
+                db.session.remove()
+                db.engine.dispose()
+
+            output_path = os.path.join(tmp, f'ratings_{num_rows}.{args.format}')
+            results[num_rows] = export(database_path, output_path, '--format', args.format) + (os.path.getsize(output_path),)
+
+    for num_rows, (rss, elapsed, size) in results.items():
+        print(f'{num_rows:8} rows: peak RSS {rss:6.1f} MiB, {elapsed:6.2f} s, output {size / 2**20:6.1f} MiB')
+
+    rss = results[args.rows][0]
+    if rss > args.max_rss:
+        sys.exit(f'Peak RSS of {rss:.1f} MiB is over the bound of {args.max_rss:.0f} MiB.')
+    print(f'peak RSS within {args.max_rss:.0f} MiB (difference with {args.small} rows: {rss - results[args.small][0]:+.1f} MiB)')
+
+if __name__ == '__main__':
+    main()
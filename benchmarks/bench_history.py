@@ -0,0 +1,84 @@
+"""
+Benchmark of the rating history endpoint (/api/user/<id>/ratings) for the most active player of a synthetic league
+of about ten years. Reports the response time (with the series cached in the process, and without) and the payload size
+with and without downsampling, checks that SQLite reads the series from the covering index only,
+and that an unchanged series is answered with 304 Not Modified.
+
+Usage:
+    python benchmarks/bench_history.py --matches 20000 --points 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import history, rating
+from foosbam.models import Match, Rating, User
+import sqlalchemy as sa
+
+def timed_get(client, url, repeat=20, cached=True, **kwargs):
+    client.get(url, **kwargs)
+    elapsed = 0
+    for _ in range(repeat):
+        if not cached:
+            history.cache.series.clear()
+        start = time.perf_counter()
+        response = client.get(url, **kwargs)
+        elapsed += time.perf_counter() - start
+    return response, elapsed / repeat
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--matches', type=int, default=20000)
+    parser.add_argument('--points', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(config_for(os.path.join(tmp, 'bench.sqlite')))
+        with app.app_context():
+            db.create_all()
+            generate_league(db, args.users, args.matches)
+            db.session.commit()
+            rating.fill_database(db)
+
+            user_id, count = db.session.query(Rating.user_id, sa.func.count()).group_by(Rating.user_id).order_by(sa.func.count().desc()).first()
+            first, last = db.session.query(sa.func.min(Match.played_at), sa.func.max(Match.played_at)).one()
+            user = db.session.get(User, user_id)
+            user.set_password('benchmark')
+            username = user.username
+            db.session.commit()
+
+            plan = ' '.join(str(row[-1]) for row in db.session.execute(
+                sa.text('EXPLAIN QUERY PLAN ' + str(history.query_history(user_id).compile(db.engine, compile_kwargs={'literal_binds': True})))
+            ))
+
+        client = app.test_client()
+        client.post('/auth/login', data={'username': username, 'password': 'benchmark'})
+        url = f'/api/user/{user_id}/ratings'
+
+        full, full_time = timed_get(client, f'{url}?points={history.MAX_POINTS}')
+        sampled, sampled_time = timed_get(client, f'{url}?points={args.points}')
+        _, uncached_time = timed_get(client, f'{url}?points={args.points}', cached=False)
+        daily, daily_time = timed_get(client, f'{url}?points={args.points}&downsampling=day')
+        not_modified, not_modified_time = timed_get(client, f'{url}?points={args.points}', headers={'If-None-Match': sampled.headers['ETag']})
+
+    assert sampled.status_code == 200 and not_modified.status_code == 304
+    assert 'COVERING INDEX' in plan, plan
+    assert len(sampled.json['since']) == min(args.points, count - 1)
+
+    print(f'player {user_id}: {sampled.json["total"]} ratings from {first:%Y-%m-%d} to {last:%Y-%m-%d}')
+    print(f'query plan: {plan}')
+    print(f'up to {history.MAX_POINTS} points: {full_time * 1000:6.2f} ms, {len(full.data) / 1024:7.1f} KiB ({len(full.json["since"])} points)')
+    print(f'lttb, {args.points} points:   {sampled_time * 1000:6.2f} ms, {len(sampled.data) / 1024:7.1f} KiB')
+    print(f'  not cached:        {uncached_time * 1000:6.2f} ms')
+    print(f'day, {args.points} points:    {daily_time * 1000:6.2f} ms, {len(daily.data) / 1024:7.1f} KiB')
+    print(f'304 Not Modified:    {not_modified_time * 1000:6.2f} ms, {len(not_modified.data)} bytes')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark of the bulk match import (importer.import_csv) against adding the same matches one by one through the add result form,
+on a synthetic league. Every result of the form is confirmed by a player of the other team through /check_results, which
+rates it in the request (no rating worker), so both legs end with rated matches. The matches are exported from a league rated with rating.fill_database, so the ratings of both
+imports are also compared with the ratings of the original league.
+
+Usage:
+    python benchmarks/bench_import.py --matches 5000 --form-matches 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import confirmation, export, importer, misc, rating
+from foosbam.core.results import PENDING
+from foosbam.models import Rating, Result, User
+import sqlalchemy as sa
+
+def create_league_csv(path, num_users, num_matches):
+    """Rate a synthetic league and export its matches as CSV (in UTC)."""
+    app = create_app(config_for(path))
+    with app.app_context():
+        db.create_all()
+        generate_league(db, num_users, num_matches)
+        db.session.commit()
+        rating.fill_database(db)
+        lines = b''.join(export.export('matches', compress=False)).decode().splitlines(keepends=True)
+        ratings = get_ratings()
+    return lines, ratings
+
+def create_empty_league(path, num_users):
+    app = create_app(config_for(path))
+    with app.app_context():
+        db.create_all()
+        db.session.execute(sa.insert(User), [
+            {'username': f'player{i}', 'email': f'player{i}@foosbam.nl', 'password_hash': '-'}
+            for i in range(num_users)
+        ])
+        db.session.commit()
+        rating.add_initial_ratings(db)
+    return app
+
+def get_ratings():
+    return sorted(
+        (str(r.since), r.user_id, r.rating, r.rating_season)
+        for r in db.session.query(Rating).filter(Rating.match_id.is_not(None))
+    )
+
+def add_with_form(app, clients, matches, submitter=1):
+    """Add every match as the submitter and confirm it as a player of the other team, and return the seconds of the requests."""
+    elapsed = 0.0
+    for match in matches:
+        played_at = misc.change_timezone(match.played_at, 'Etc/UTC', 'Europe/Amsterdam')
+        start = time.perf_counter()
+        response = clients[submitter].post('/add_result', data={
+            'date': played_at.date().isoformat(),
+            'time': played_at.strftime('%H:%M'),
+            **{column: getattr(match, column) for column in importer.ROLES + importer.SCORES + importer.EXTRAS},
+        })
+        elapsed += time.perf_counter() - start
+        assert response.status_code == 302, response.data[:1000]
+
+        with app.app_context():
+            match_id = db.session.scalar(sa.select(Result.match_id).where(Result.status == PENDING))
+        checker = confirmation.get_checkers(match.players, submitter)[0]
+        start = time.perf_counter()
+        response = clients[checker].post('/check_results', data={'results': [match_id], 'confirm': 'Confirm'})
+        elapsed += time.perf_counter() - start
+        assert response.status_code == 302, response.data[:1000]
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--matches', type=int, default=5000)
+    parser.add_argument('--form-matches', type=int, default=500, help='Number of matches added through the form.')
+    parser.add_argument('--chunk-size', type=int, default=importer.CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lines, expected = create_league_csv(os.path.join(tmp, 'league.sqlite'), args.users, args.matches)
+
+        # Bulk import
+        app = create_empty_league(os.path.join(tmp, 'import.sqlite'), args.users)
+        with app.app_context():
+            start = time.perf_counter()
+            report = importer.import_csv(lines, created_by=1, utc=True, chunk_size=args.chunk_size)
+            import_time = time.perf_counter() - start
+            assert not report.errors, report.errors[:5]
+            assert get_ratings() == expected, 'imported ratings differ from the rated league'
+
+        # One by one, through the add result form (the form only has minutes, which the synthetic league also uses)
+        app = create_empty_league(os.path.join(tmp, 'form.sqlite'), args.users)
+        app.config['WTF_CSRF_ENABLED'] = False
+        with app.app_context():
+            user = db.session.get(User, 1)
+            user.set_password('benchmark')
+            db.session.execute(sa.update(User).values(password_hash=user.password_hash))
+            db.session.commit()
+            usernames = dict(db.session.execute(sa.select(User.id, User.username)).all())
+            matches = importer.read_matches(lines[:args.form_matches + 1], utc=True).matches
+
+        clients = {}
+        for user_id, username in usernames.items():
+            clients[user_id] = app.test_client()
+            response = clients[user_id].post('/auth/login', data={'username': username, 'password': 'benchmark'})
+            assert response.status_code == 302, 'login failed'
+        form_time = add_with_form(app, clients, matches)
+        with app.app_context():
+            assert get_ratings() == expected[:4 * len(matches)], 'ratings of the form differ from the rated league'
+
+    per_import = import_time / args.matches * 1000
+    per_form = form_time / len(matches) * 1000
+    print(f'bulk import: {import_time:7.2f} s for {args.matches} matches ({per_import:.3f} ms per match)')
+    print(f'add result:  {form_time:7.2f} s for {len(matches)} matches ({per_form:.3f} ms per match, {per_form / per_import:.0f}x, '
+          f'adding and confirming)')
+
+if __name__ == '__main__':
+    main()
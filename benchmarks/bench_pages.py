@@ -0,0 +1,75 @@
+"""
+Benchmark of the page cache (foosbam/core/page_cache.py) on the ranking and results pages of a synthetic league.
+Reports the response time when the page is rendered, served from the page store, and answered with 304 Not Modified,
+and the number of queries of each.
+
+Usage:
+    python benchmarks/bench_pages.py --matches 5000 --store memory
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import rating
+from foosbam.models import User
+import sqlalchemy as sa
+
+def timed_get(client, url, queries, repeat=20, store=None, **kwargs):
+    client.get(url, **kwargs)
+    elapsed = 0
+    for _ in range(repeat):
+        if store is not None:
+            store.clear()
+        queries.clear()
+        start = time.perf_counter()
+        response = client.get(url, **kwargs)
+        elapsed += time.perf_counter() - start
+    return response, elapsed / repeat, len(queries)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--matches', type=int, default=5000)
+    parser.add_argument('--store', choices=['memory', 'file', 'redis'], default='memory')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = type('Config', (config_for(os.path.join(tmp, 'bench.sqlite')),), {
+            'PAGE_CACHE': args.store,
+            'PAGE_CACHE_DIR': os.path.join(tmp, 'pages'),
+        })
+        app = create_app(config)
+        queries = []
+        with app.app_context():
+            db.create_all()
+            generate_league(db, args.users, args.matches)
+            db.session.commit()
+            rating.fill_database(db)
+            user = db.session.get(User, 1)
+            user.set_password('benchmark')
+            username = user.username
+            db.session.commit()
+            sa.event.listen(db.engine, 'before_cursor_execute', lambda *a: queries.append(a[2]))
+
+        client = app.test_client()
+        client.post('/auth/login', data={'username': username, 'password': 'benchmark'})
+
+        for url in ['/show_ranking', '/show_results']:
+            rendered, rendered_time, rendered_queries = timed_get(client, url, queries, store=app.extensions['page_cache'])
+            stored, stored_time, stored_queries = timed_get(client, url, queries)
+            not_modified, not_modified_time, not_modified_queries = timed_get(client, url, queries, headers={'If-None-Match': rendered.headers['ETag']})
+            assert rendered.status_code == 200 and stored.data == rendered.data and not_modified.status_code == 304
+
+            print(f'{url} ({len(rendered.data) / 1024:.1f} KiB)')
+            print(f'  rendered:         {rendered_time * 1000:6.2f} ms, {rendered_queries} queries')
+            print(f'  from page store:  {stored_time * 1000:6.2f} ms, {stored_queries} queries')
+            print(f'  304 Not Modified: {not_modified_time * 1000:6.2f} ms, {not_modified_queries} queries')
+
+if __name__ == '__main__':
+    main()
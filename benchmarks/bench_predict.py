@@ -0,0 +1,81 @@
+"""
+Benchmark of elo.predict_batch against calculating the win probability of every lineup one by one, with
+details.create_prediction_details (as on the match page), on a synthetic league.
+Also checks that predict_batch gives the same probabilities as the unrounded per-lineup formula.
+
+Usage:
+    python benchmarks/bench_predict.py --lineups 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import details, elo, player_state, rating
+import numpy as np
+
+def predict_match_page(lineup):
+    players = [details.PlayerView(user_id, '', player_state.store.get(user_id).rating, None) for user_id in lineup]
+    prediction = details.create_prediction_details(players)
+    return prediction['black'], prediction['white']
+
+def predict_scalar(lineup):
+    ratings = [player_state.store.get(user_id).rating for user_id in lineup]
+    black = sum(elo.calculate_expected_score(ratings[b], ratings[w]) for b in [0, 1] for w in [2, 3]) / 4
+    return black, 1 - black
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--matches', type=int, default=2000)
+    parser.add_argument('--lineups', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(config_for(os.path.join(tmp, 'bench.sqlite')))
+        with app.app_context():
+            db.create_all()
+            user_ids = generate_league(db, args.users, args.matches)
+            rating.fill_database(db)
+
+            rng = random.Random(1)
+            lineups = [rng.sample(user_ids, 4) for _ in range(args.lineups)]
+
+            # First call builds the matrix, later calls reuse it as long as the ratings do not change
+            start = time.perf_counter()
+            elo.predict_batch(lineups[:1])
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            batch = elo.predict_batch(lineups)
+            batch_time = time.perf_counter() - start
+
+            lineup_array = np.array(lineups)
+            start = time.perf_counter()
+            elo.predict_batch(lineup_array)
+            array_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for lineup in lineups:
+                predict_match_page(lineup)
+            scalar_time = time.perf_counter() - start
+
+            scalar = [predict_scalar(lineup) for lineup in lineups]
+
+            difference = max(abs(b - s) for (b, _), (s, _) in zip(batch.tolist(), scalar))
+            assert difference < 1e-9, f'predict_batch differs by {difference}'
+
+    print(f'matrix build ({args.users} players): {build * 1000:.2f} ms')
+    print(f'per lineup (match page):     {scalar_time * 1000:8.2f} ms for {args.lineups} lineups')
+    print(f'predict_batch (lists):       {batch_time * 1000:8.2f} ms ({scalar_time / batch_time:.0f}x)')
+    print(f'predict_batch (numpy array): {array_time * 1000:8.2f} ms ({scalar_time / array_time:.0f}x)')
+    print(f'max difference with the unrounded formula: {difference:.1e}')
+
+if __name__ == '__main__':
+    main()
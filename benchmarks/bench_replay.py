@@ -0,0 +1,99 @@
+"""
+Benchmark of the batch rating replay (rating.create_existing_ratings) against the original per-match replay, on a
+synthetic league. The original replay reads the latest ratings and match counts of the players from the ratings and
+matches tables (elo.get_most_recent_rating, elo.get_match_count_before) and calculates the new ratings with the DataFrame
+based elo.calculate_rating, for every match.
+
+The per-match replay is only timed on the first --legacy-matches matches, because it takes minutes on larger histories.
+The ratings of both replays are compared for these matches.
+
+Usage:
+    python benchmarks/bench_replay.py --matches 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import elo, rating, replay, seasons
+from foosbam.models import Match, Rating
+import pandas as pd
+import sqlalchemy as sa
+
+RATING_COLUMNS = ['match_id', 'user_id', 'previous_rating', 'rating', 'previous_rating_season', 'rating_season']
+
+def time_legacy(num_matches):
+    """Replay the first matches one by one as before the batch replay, and return the seconds and the ratings."""
+    start = time.perf_counter()
+    for match in replay.load_matches(db).limit(num_matches).all():
+        players = [match.att_black, match.def_black, match.att_white, match.def_white]
+        season = seasons.get_season_from_date(match.played_at)
+        df = pd.DataFrame({
+            'user_id': players,
+            'team': ['black', 'black', 'white', 'white'],
+            'rating': [elo.get_most_recent_rating(user_id, None) for user_id in players],
+            'rating_season': [elo.get_most_recent_rating(user_id, season) for user_id in players],
+            'num_games': [elo.get_match_count_before(user_id, match.played_at) for user_id in players],
+        })
+        df = elo.calculate_rating(df, match.score_black, match.score_white)
+        db.session.add_all([
+            Rating(
+                user_id=row.user_id, match_id=match.id, since=match.played_at, season=season,
+                previous_rating=row.rating, rating=row.new_rating,
+                previous_rating_season=row.rating_season, rating_season=row.new_rating_season
+            )
+            for row in df.itertuples()
+        ])
+        db.session.flush()
+    elapsed = time.perf_counter() - start
+    ratings = get_ratings(num_matches)
+    db.session.rollback()
+    return elapsed, ratings
+
+def get_ratings(num_matches):
+    """The ratings of the first matches (in order of played_at) as tuples of RATING_COLUMNS."""
+    match_ids = replay.load_matches(db).limit(num_matches).with_entities(Match.id).subquery()
+    return db.session.execute(
+        sa.select(*[getattr(Rating, column) for column in RATING_COLUMNS])
+        .where(Rating.match_id.in_(sa.select(match_ids.c.id)))
+        .order_by(Rating.match_id, Rating.user_id)
+    ).all()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--matches', type=int, default=50000)
+    parser.add_argument('--legacy-matches', type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(config_for(os.path.join(tmp, 'bench.sqlite')))
+        with app.app_context():
+            db.create_all()
+            generate_league(db, args.users, args.matches)
+            rating.add_initial_ratings(db)
+
+            legacy, legacy_ratings = time_legacy(args.legacy_matches)
+            legacy /= args.legacy_matches
+
+            start = time.perf_counter()
+            rating.create_existing_ratings(db)
+            batch = (time.perf_counter() - start) / args.matches
+
+            assert db.session.query(Rating).filter(Rating.match_id.is_not(None)).count() == 4 * args.matches
+            batch_ratings = get_ratings(args.legacy_matches)
+            assert len(batch_ratings) == len(legacy_ratings) == 4 * args.legacy_matches
+            for legacy_row, batch_row in zip(legacy_ratings, batch_ratings):
+                assert tuple(legacy_row) == tuple(batch_row), f'{RATING_COLUMNS}: per-match {legacy_row}, batch {batch_row}'
+
+    print(f'per-match replay: {legacy * 1000:.3f} ms/match (first {args.legacy_matches} matches)')
+    print(f'batch replay:     {batch * 1000:.3f} ms/match ({args.matches} matches, {batch * args.matches:.2f} s)')
+    print(f'speedup:          {legacy / batch:.0f}x')
+
+if __name__ == '__main__':
+    main()
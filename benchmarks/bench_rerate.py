@@ -0,0 +1,63 @@
+"""
+Benchmark of re-rating after a backdated match (rating.rerate_from), on a synthetic league.
+A match is inserted before the last --backdate matches, after which those matches are rated again.
+
+Usage:
+    python benchmarks/bench_rerate.py --matches 20000 --backdate 500
+"""
+import argparse
+from datetime import timedelta
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import rating
+from foosbam.models import Match, MatchParticipant, Result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--matches', type=int, default=20000)
+    parser.add_argument('--backdate', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(config_for(os.path.join(tmp, 'bench.sqlite')))
+        with app.app_context():
+            db.create_all()
+            user_ids = generate_league(db, args.users, args.matches)
+            rating.fill_database(db)
+
+            # Insert a match just before the last args.backdate matches
+            later = db.session.query(Match).order_by(Match.played_at.desc()).offset(args.backdate - 1).first()
+            match = Match(
+                played_at=later.played_at - timedelta(seconds=1),
+                season=later.season,
+                att_black=user_ids[0],
+                def_black=user_ids[1],
+                att_white=user_ids[2],
+                def_white=user_ids[3]
+            )
+            db.session.add(match)
+            db.session.flush()
+            db.session.add_all(MatchParticipant.from_match(match))
+            result = Result(match_id=match.id, created_by=user_ids[0], status='Confirmed', score_black=10, score_white=3,
+                            klinker_att_black=0, klinker_att_white=0, klinker_def_black=0, klinker_def_white=0,
+                            keeper_black=0, keeper_white=0)
+            db.session.add(result)
+            db.session.flush()
+
+            start = time.perf_counter()
+            rating.add_match_ratings(db, match, result)
+            db.session.commit()
+            elapsed = time.perf_counter() - start
+
+    print(f'backdated insert before {args.backdate} of {args.matches} matches: {elapsed * 1000:.1f} ms')
+
+if __name__ == '__main__':
+    main()
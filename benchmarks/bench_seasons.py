@@ -0,0 +1,94 @@
+"""
+Benchmark and check of seasons.get_season_from_date and seasons.get_seasons_for_dates against the original
+pandas based calculation, for every day from 2023-11-30 up to and including --until.
+
+Usage:
+    python benchmarks/bench_seasons.py --until 2030-12-31
+"""
+import argparse
+from datetime import date, datetime, time as dtime, timedelta, timezone
+import os
+import sys
+import time
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from foosbam.core import seasons
+import numpy as np
+import pandas as pd
+
+def legacy_get_season_from_date(date_arg):
+    date_arg = pd.to_datetime(date_arg, utc=True)
+    first_game_date = pd.to_datetime('2023-11-30', utc=True)
+    second_season_start_date = pd.to_datetime('2024-04-01', utc=True)
+
+    if date_arg < first_game_date:
+        raise ValueError("No dates before the first game date are allowed.")
+    elif date_arg < second_season_start_date:
+        return 1
+    else:
+        q = (date_arg.year  * 4 + date_arg.quarter) - (second_season_start_date.year  * 4 + second_season_start_date.quarter)
+        return q + 2
+
+def season_or_error(func, value):
+    try:
+        return func(value)
+    except ValueError:
+        return 'ValueError'
+
+def per_call(func, args):
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) / len(args)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--until', default='2030-12-31')
+    args = parser.parse_args()
+
+    first = seasons.FIRST_GAME_DATE
+    days = [first + timedelta(days=i) for i in range((date.fromisoformat(args.until) - first).days + 1)]
+
+    # The values the app passes in: strings, dates, naive datetimes (UTC) and aware datetimes (e.g. from the add result form)
+    amsterdam = ZoneInfo('Europe/Amsterdam')
+    values = []
+    for day in days:
+        values += [
+            day.isoformat(),
+            day,
+            datetime.combine(day, dtime(23, 59)),
+            datetime.combine(day, dtime(0, 30), tzinfo=amsterdam),
+            datetime.combine(day, dtime(12, 0), tzinfo=timezone.utc),
+        ]
+
+    expected = [season_or_error(legacy_get_season_from_date, value) for value in values]
+    actual = [season_or_error(seasons.get_season_from_date, value) for value in values]
+    mismatches = [(value, e, a) for value, e, a in zip(values, expected, actual) if e != a]
+    assert not mismatches, f'get_season_from_date differs: {mismatches[:5]}'
+
+    timestamps = np.array([datetime.combine(day, dtime(23, 59)) for day in days], dtype='datetime64[s]')
+    vectorized = seasons.get_seasons_for_dates(timestamps)
+    assert vectorized.tolist() == [legacy_get_season_from_date(day) for day in days], 'get_seasons_for_dates differs'
+
+    print(f'checked {len(values)} values ({len(days)} days, {days[0]} - {days[-1]}): identical')
+
+    # Time every day once (a cold cache), then the typical repeated calls with aware datetimes of recent days
+    recent = [v for v in values if isinstance(v, datetime) and v.tzinfo is not None][-2000:]
+    seasons.get_season_from_utc_date.cache_clear()
+    legacy = per_call(legacy_get_season_from_date, recent)
+    cold = per_call(seasons.get_season_from_date, recent)
+    warm = per_call(seasons.get_season_from_date, recent)
+
+    start = time.perf_counter()
+    seasons.get_seasons_for_dates(timestamps)
+    bulk = (time.perf_counter() - start) / len(timestamps)
+
+    print(f'pandas:                 {legacy * 1e6:8.2f} us/call')
+    print(f'get_season_from_date:   {cold * 1e6:8.2f} us/call (cold cache, {legacy / cold:.0f}x)')
+    print(f'get_season_from_date:   {warm * 1e6:8.2f} us/call (warm cache, {legacy / warm:.0f}x)')
+    print(f'get_seasons_for_dates:  {bulk * 1e6:8.2f} us/date ({legacy / bulk:.0f}x)')
+
+if __name__ == '__main__':
+    main()
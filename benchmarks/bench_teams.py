@@ -0,0 +1,64 @@
+"""
+Benchmark of teams.make_teams for pools of 4 to 16 players, on a synthetic league.
+The proposals are checked against a brute force search over every order of four players, with the scalar
+elo.calculate_expected_score (as on the match page).
+
+Usage:
+    python benchmarks/bench_teams.py --repeat 20
+"""
+import argparse
+from itertools import permutations
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import elo, player_state, rating, teams
+
+def brute_force(user_ids):
+    """Balance of the best lineup, over every ordered choice of four players."""
+    best = None
+    for lineup in permutations(user_ids, 4):
+        ratings = [player_state.store.get(user_id).rating for user_id in lineup]
+        black = sum(elo.calculate_expected_score(ratings[b], ratings[w]) for b in [0, 1] for w in [2, 3]) / 4
+        if best is None or abs(black - 0.5) < best:
+            best = abs(black - 0.5)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--matches', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(config_for(os.path.join(tmp, 'bench.sqlite')))
+        with app.app_context():
+            db.create_all()
+            user_ids = generate_league(db, args.users, args.matches)
+            rating.fill_database(db)
+            elo.expected_score_matrix.refresh()
+
+            rng = random.Random(1)
+            for pool_size in [4, 8, 12, 16]:
+                pool = rng.sample(user_ids, pool_size)
+
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    proposals = teams.make_teams(pool)
+                elapsed = (time.perf_counter() - start) / args.repeat
+
+                if pool_size <= 12:
+                    assert abs(abs(proposals[0].chance_black - 0.5) - brute_force(pool)) < 1e-12, 'make_teams misses the most balanced lineup'
+
+                print(f'{pool_size:2} players: {len(teams.create_lineups(pool)):5} lineups, {elapsed * 1000:6.2f} ms, '
+                      f'best {proposals[0].chance_black:.3f} - {proposals[0].chance_white:.3f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Microbenchmark of turning query rows into page rows: the original DataFrame based conversion (build a DataFrame,
+convert timestamps with .apply, .str.title, iterate with iterrows) against the structs in core/views.py.
+Measures CPU time and peak memory (tracemalloc) for the results page and the ranking, on --rows rows.
+
+Usage:
+    python benchmarks/bench_views.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import misc, rating, results, views
+from foosbam.models import Match, Rating, User
+import pandas as pd
+
+RESULT_COLUMNS = ['id', 'played_at', 'att_black', 'def_black', 'att_white', 'def_white', 'score_black', 'score_white', 'status']
+RANKING_COLUMNS = ['since', 'user_id', 'player', 'rating']
+
+def legacy_results(rows):
+    df = pd.DataFrame.from_records([dict(zip(RESULT_COLUMNS, row)) for row in rows])
+    df['played_at'] = df['played_at'].apply(lambda x : misc.change_timezone(x, 'Etc/UTC', 'Europe/Amsterdam'))
+    df['played_at'] = df['played_at'].dt.strftime('%Y-%m-%d %H:%M')
+    for column in ['att_black', 'def_black', 'att_white', 'def_white']:
+        df[column] = df[column].str.title()
+    return [(row['id'], row['played_at'], row['att_black'], row['score_black']) for _, row in df.iterrows()]
+
+def new_results(rows):
+    return [(r.id, r.played_at, r.att_black, r.score_black) for r in map(views.ResultView, rows)]
+
+def legacy_ranking(rows):
+    df = pd.DataFrame.from_records([dict(zip(RANKING_COLUMNS, row)) for row in rows])
+    df['rank'] = df['rating'].rank(method='min', ascending=False).astype(int)
+    df['since'] = df['since'].apply(lambda x : misc.change_timezone(x, 'Etc/UTC', 'Europe/Amsterdam'))
+    df['since'] = df['since'].dt.strftime('%Y-%m-%d %H:%M')
+    df['player'] = df['player'].str.title()
+    return [(row['rank'], row['user_id'], row['player'], row['rating'], row['since']) for _, row in df.iterrows()]
+
+def new_ranking(rows):
+    return [(r.rank, r.user_id, r.player, r.rating, r.since) for r in views.create_ranking(rows)]
+
+def measure(func, rows, repeat):
+    """Return the output, the CPU time per call and the peak memory of a single call."""
+    output = func(rows)
+
+    start = time.process_time()
+    for _ in range(repeat):
+        func(rows)
+    cpu = (time.process_time() - start) / repeat
+
+    tracemalloc.start()
+    func(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return output, cpu, peak
+
+def report(name, legacy, new, rows, repeat):
+    legacy_output, legacy_cpu, legacy_peak = measure(legacy, rows, repeat)
+    new_output, new_cpu, new_peak = measure(new, rows, repeat)
+    assert [tuple(map(str, r)) for r in legacy_output] == [tuple(map(str, r)) for r in new_output], f'{name}: output differs'
+
+    print(f'{name} ({len(rows)} rows)')
+    print(f'  DataFrame: {legacy_cpu * 1000:8.1f} ms CPU, {legacy_peak / 2**20:6.1f} MiB peak')
+    print(f'  views:     {new_cpu * 1000:8.1f} ms CPU, {new_peak / 2**20:6.1f} MiB peak')
+    print(f'  speedup:   {legacy_cpu / new_cpu:8.1f}x CPU, {legacy_peak / new_peak:6.1f}x memory')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(config_for(os.path.join(tmp, 'bench.sqlite')))
+        with app.app_context():
+            db.create_all()
+            generate_league(db, args.users, args.rows)
+            rating.fill_database(db)
+
+            result_rows = results.query_results().order_by(Match.played_at.desc()).limit(args.rows).all()
+
+            # Ranking-shaped rows (since, user_id, username, rating) taken from the ratings, sorted like a ranking
+            ranking_rows = db.session.query(
+                Rating.since,
+                User.id,
+                User.username,
+                Rating.rating
+            ).join(
+                User,
+                Rating.user_id == User.id
+            ).order_by(
+                Rating.rating.desc(),
+                Rating.since
+            ).limit(args.rows).all()
+
+    report('results', legacy_results, new_results, result_rows, args.repeat)
+    report('ranking', legacy_ranking, new_ranking, ranking_rows, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Check with EXPLAIN QUERY PLAN on SQLite that the hot per-player and per-match queries use their indexes, on a synthetic league:
+- elo.get_match_count_before: the covering (user_id, since, ...) index of ratings
+- the results of /user/<id> (results.get_results_page for a player): the (user_id, played_at) index of match_participants,
+  which also gives the order, so no temporary B-tree is used for sorting
+- the match-rating lookup of /match/<id> (details.query_match_view): the (user_id, match_id) index of ratings
+
+The statements are captured while the functions run and explained with their parameters.
+Prints the plans, and exits with code 1 if a query does not use its index or scans a table.
+
+Usage:
+    python benchmarks/check_query_plans.py --matches 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import details, elo, rating, results
+from foosbam.models import Match
+import sqlalchemy as sa
+
+def explain(function) -> list:
+    """Run function and return (statement, plan lines) for every statement it executed."""
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    sa.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        function()
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', capture)
+
+    connection = db.session.connection()
+    return [
+        (statement, [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)])
+        for statement, parameters in statements
+    ]
+
+def check_plan(plan: list, index: str, sorted_by_index: bool = False) -> list:
+    """The problems of a plan: its index is not used, a table is scanned, or (if sorted_by_index) a temporary B-tree is used."""
+    problems = []
+    if not any(f'INDEX {index} ' in line for line in plan):
+        problems.append(f'{index} is not used')
+    problems += [f'full scan: {line}' for line in plan if line.startswith('SCAN')]
+    if sorted_by_index:
+        problems += [f'sorted without the index: {line}' for line in plan if 'TEMP B-TREE' in line]
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--matches', type=int, default=2000)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(config_for(os.path.join(tmp, 'plans.sqlite')))
+        with app.app_context():
+            db.create_all()
+            user_ids = generate_league(db, args.users, args.matches)
+            db.session.commit()
+            rating.fill_database(db)
+
+            user_id = user_ids[0]
+            match = db.session.scalar(sa.select(Match).order_by(Match.played_at).offset(args.matches // 2).limit(1))
+            checks = [
+                ('get_match_count_before', lambda: elo.get_match_count_before(user_id, match.played_at),
+                 'ix_ratings_user_id_since_history', False),
+                ('/user/<id> results', lambda: results.get_results_page(user_id=user_id),
+                 'ix_match_participants_user_id_played_at', True),
+                ('match ratings (query_match_view)', lambda: details.query_match_view(match.id),
+                 'ix_ratings_user_id_match_id', False),
+            ]
+            for name, function, index, sorted_by_index in checks:
+                explained = explain(function)
+                assert len(explained) == 1, f'{name}: expected one statement, got {len(explained)}'
+                statement, plan = explained[0]
+                problems = check_plan(plan, index, sorted_by_index)
+                failed = failed or bool(problems)
+
+                print(f'{name}: {"FAILED" if problems else "ok"}')
+                for line in plan:
+                    print(f'    {line}')
+                for problem in problems:
+                    print(f'  problem: {problem}')
+
+            db.engine.dispose()
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Deterministic synthetic league, used by the benchmarks.
+
+Creates users and matches (with results) in the database of the current app context.
+"""
+from datetime import datetime, timedelta
+import numpy as np
+import random
+import sqlalchemy as sa
+
+from config import Config
+from foosbam.core import seasons
+from foosbam.models import Match, MatchParticipant, Result, User
+
+FIRST_MATCH = datetime(2023, 12, 1, 12, 0)
+
+class BenchmarkConfig(Config):
+    SECRET_KEY = 'benchmark'
+    WTF_CSRF_ENABLED = False
+
+def config_for(database_path):
+    """Create a config class that uses a SQLite database at database_path."""
+    class _Config(BenchmarkConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + database_path
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    return _Config
+
+def generate_league(db, num_users, num_matches, seed=42):
+    """
+    Add num_users users and num_matches matches with results to the database, without ratings.
+    Matches are played at increasing timestamps, a few per evening.
+    """
+    rng = random.Random(seed)
+
+    users = [
+        {'username': f'player{i}', 'email': f'player{i}@foosbam.nl', 'password_hash': '-'}
+        for i in range(num_users)
+    ]
+    db.session.execute(sa.insert(User), users)
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+
+    # Some players are much more active than others
+    weights = [rng.paretovariate(1.5) for _ in user_ids]
+
+    matches = []
+    played_at = FIRST_MATCH
+    for _ in range(num_matches):
+        played_at += timedelta(minutes=rng.choice([10, 15, 20, 30, 60, 24 * 60]))
+        players = set()
+        while len(players) < 4:
+            players.add(rng.choices(user_ids, weights)[0])
+        att_black, def_black, att_white, def_white = rng.sample(sorted(players), 4)
+        matches.append({
+            'played_at': played_at,
+            'att_black': att_black,
+            'def_black': def_black,
+            'att_white': att_white,
+            'def_white': def_white,
+        })
+    season_numbers = seasons.get_seasons_for_dates(np.array([match['played_at'] for match in matches], dtype='datetime64[s]'))
+    for match, season in zip(matches, season_numbers.tolist()):
+        match['season'] = season
+    db.session.execute(sa.insert(Match), matches)
+    match_ids = [match_id for (match_id,) in db.session.query(Match.id).order_by(Match.played_at)]
+
+    participants = [
+        {'match_id': match_id, 'user_id': match[f'{role}_{team}'], 'role': role, 'team': team, 'played_at': match['played_at']}
+        for match_id, match in zip(match_ids, matches)
+        for team in ['black', 'white']
+        for role in ['att', 'def']
+    ]
+    db.session.execute(sa.insert(MatchParticipant), participants)
+
+    results = []
+    for match_id, match in zip(match_ids, matches):
+        loser_score = min(int(rng.expovariate(0.25)), 9)
+        black_won = rng.random() < 0.5
+        results.append({
+            'match_id': match_id,
+            'created_at': match['played_at'],
+            'created_by': match['att_black'],
+            'status': 'Confirmed',
+            'score_black': 10 if black_won else loser_score,
+            'score_white': loser_score if black_won else 10,
+            'klinker_att_black': int(rng.random() < 0.15),
+            'klinker_att_white': int(rng.random() < 0.15),
+            'klinker_def_black': int(rng.random() < 0.05),
+            'klinker_def_white': int(rng.random() < 0.05),
+            'keeper_black': int(rng.random() < 0.1),
+            'keeper_white': int(rng.random() < 0.1),
+        })
+    db.session.execute(sa.insert(Result), results)
+    db.session.commit()
+    return user_ids
@@ -0,0 +1,182 @@
+"""
+Load test of the database engine profiles (see foosbam/engine.py) on a local SQLite file, like a league night:
+several processes (e.g. gunicorn workers) with several threads each add results (/add_result) and look at the
+ranking (/show_ranking) at the same time. Reports the p50/p99 latency per page and the failed requests
+(e.g. "database is locked") for every profile.
+
+Every profile starts from a copy of the same synthetic league. The journal mode is stored in the database file,
+so the league is created without WAL and only the sqlite profile switches the copy to WAL.
+
+Usage:
+    python benchmarks/load_test.py --processes 4 --threads 4 --requests 50 --profiles sqlite default
+    python benchmarks/load_test.py --profiles sqlite --synchronous FULL --busy-timeout 1000
+"""
+import argparse
+from collections import Counter
+from datetime import timedelta
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from flask import got_request_exception
+from foosbam import create_app, db
+from foosbam.core import misc, rating
+from foosbam.models import Match, User
+import numpy as np
+import sqlalchemy as sa
+
+PASSWORD = 'benchmark'
+
+def profile_config(path, profile, args):
+    return type('Config', (config_for(path),), {
+        'DB_PROFILE': profile,
+        'SQLITE_JOURNAL_MODE': args.journal_mode,
+        'SQLITE_BUSY_TIMEOUT': args.busy_timeout,
+        'SQLITE_SYNCHRONOUS': args.synchronous,
+        'PAGE_CACHE': 'none',
+    })
+
+def create_league(path, args):
+    """Create the league (without WAL) and return the usernames and the first free timestamp (local time) for new results."""
+    app = create_app(profile_config(path, 'default', args))
+    with app.app_context():
+        db.create_all()
+        generate_league(db, args.users, args.matches)
+        db.session.commit()
+        rating.fill_database(db)
+
+        user = db.session.get(User, 1)
+        user.set_password(PASSWORD)
+        db.session.execute(sa.update(User).values(password_hash=user.password_hash))
+        db.session.commit()
+
+        usernames = [username for (username,) in db.session.query(User.username).order_by(User.id)]
+        last = db.session.scalar(sa.select(sa.func.max(Match.played_at)))
+        db.engine.dispose()
+    return usernames, misc.change_timezone(last, 'Etc/UTC', 'Europe/Amsterdam') + timedelta(days=1)
+
+def run_client(app, username, user_ids, start, counter, args, barrier, results, seed):
+    """Send requests from one thread, as one logged in user."""
+    rng = random.Random(seed)
+    client = app.test_client()
+    client.post('/auth/login', data={'username': username, 'password': PASSWORD})
+    barrier.wait()
+
+    for _ in range(args.requests):
+        if rng.random() < args.write_ratio:
+            # A shared counter gives every result its own minute, in roughly the order they are sent
+            with counter.get_lock():
+                counter.value += 1
+                played_at = start + timedelta(minutes=counter.value)
+            players = rng.sample(user_ids, 4)
+            score = rng.randint(0, 9)
+            data = {
+                'date': played_at.date().isoformat(), 'time': played_at.strftime('%H:%M'),
+                'att_black': players[0], 'def_black': players[1], 'att_white': players[2], 'def_white': players[3],
+                'score_black': 10, 'score_white': score,
+                'klinker_att_black': 0, 'klinker_def_black': 0, 'klinker_att_white': 0, 'klinker_def_white': 0,
+                'keeper_black': 0, 'keeper_white': 0,
+            }
+            began = time.perf_counter()
+            response = client.post('/add_result', data=data)
+            results.append(('add_result', time.perf_counter() - began, response.status_code == 302))
+        else:
+            began = time.perf_counter()
+            response = client.get('/show_ranking')
+            results.append(('show_ranking', time.perf_counter() - began, response.status_code == 200))
+
+def run_worker(path, profile, args, usernames, start, counter, barrier, queue, worker):
+    """One process with args.threads clients, like a gunicorn worker with threads."""
+    app = create_app(profile_config(path, profile, args))
+    with app.app_context():
+        user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+
+    errors = Counter()
+    def record_exception(sender, exception, **extra):
+        errors[str(exception).splitlines()[0][:100]] += 1
+    got_request_exception.connect(record_exception, app)
+    app.logger.disabled = True
+
+    results = []
+    threads = [
+        threading.Thread(target=run_client, args=(
+            app, usernames[(worker * args.threads + i) % len(usernames)], user_ids, start, counter, args, barrier, results,
+            worker * 1000 + i
+        ))
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put((results, errors))
+
+def run_profile(league_path, profile, args, usernames, start):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'load.sqlite')
+        shutil.copy(league_path, path)
+
+        context = multiprocessing.get_context('spawn')
+        counter = context.Value('i', 0)
+        barrier = context.Barrier(args.processes * args.threads)
+        queue = context.Queue()
+        workers = [
+            context.Process(target=run_worker, args=(path, profile, args, usernames, start, counter, barrier, queue, worker))
+            for worker in range(args.processes)
+        ]
+        began = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        outcomes = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - began
+
+        app = create_app(profile_config(path, profile, args))
+        with app.app_context():
+            journal_mode = db.session.execute(sa.text('PRAGMA journal_mode')).scalar()
+            db.engine.dispose()
+
+    results = [result for worker_results, _ in outcomes for result in worker_results]
+    errors = sum((worker_errors for _, worker_errors in outcomes), Counter())
+
+    print(f'profile {profile} (journal mode {journal_mode}): {len(results)} requests in {elapsed:.1f} s')
+    for page in ['add_result', 'show_ranking']:
+        latencies = np.array([latency for name, latency, _ in results if name == page]) * 1000
+        failed = sum(not ok for name, _, ok in results if name == page)
+        if len(latencies):
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f'  {page:13} {len(latencies):5} requests, p50 {p50:7.1f} ms, p99 {p99:7.1f} ms, max {latencies.max():7.1f} ms, {failed} failed')
+    for error, count in errors.most_common():
+        print(f'  {count:5}x {error}')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--matches', type=int, default=2000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4, help='Threads (clients) per process.')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per client.')
+    parser.add_argument('--write-ratio', type=float, default=0.3, help='Fraction of the requests that add a result.')
+    parser.add_argument('--profiles', nargs='+', default=['sqlite', 'default'], choices=['sqlite', 'default'])
+    parser.add_argument('--journal-mode', default='WAL')
+    parser.add_argument('--busy-timeout', type=int, default=5000, help='Milliseconds.')
+    parser.add_argument('--synchronous', default='NORMAL')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        league_path = os.path.join(tmp, 'league.sqlite')
+        usernames, start = create_league(league_path, args)
+        for profile in args.profiles:
+            run_profile(league_path, profile, args, usernames, start)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Benchmark suite of the key operations on synthetic leagues (see league.py) of several sizes, with the results in JSON
+and a compare mode that flags regressions against a stored baseline.
+
+For every size, a new SQLite league is generated and the following operations are timed (median of --repeat runs,
+with the number of SQL statements of a run):
+- create_existing_ratings: rate all matches (--rating-runs runs, it is the slowest)
+- add_result: submit a result through /add_result (it is pending afterwards)
+- check_results: confirm that result through /check_results, which rates it in the request (no rating worker)
+- get_current_ranking, get_season_ranking (latest season)
+- /show_results, /user/<id>, /match/<id>: rendered without the page cache; /match/<id> also without the match view cache
+
+Usage:
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --sizes 1000 10000 --output current.json --compare baseline.json
+    python benchmarks/suite.py --compare baseline.json --current current.json      (compare without running)
+
+A result is a regression if its median is more than --tolerance (fraction) slower than the baseline and more than
+--min-delta milliseconds slower (to ignore noise on fast operations), or if it runs more SQL statements.
+With regressions, the exit code is 1. Timings on a busy or shared machine can vary by more than the tolerance,
+the numbers of statements are exact.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.league import config_for, generate_league
+from foosbam import create_app, db
+from foosbam.core import details, misc, ranking, rating, seasons
+from foosbam.models import Match, Rating, User
+import sqlalchemy as sa
+
+PASSWORD = 'benchmark'
+OPERATIONS = [
+    'create_existing_ratings', 'add_result', 'check_results', 'get_current_ranking', 'get_season_ranking',
+    '/show_results', '/user/<id>', '/match/<id>',
+]
+
+class Timer:
+    """Times runs of an operation and counts the SQL statements of the last run."""
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.times = []
+        self.statements = 0
+
+    def run(self, function, *args, **kwargs):
+        self.queries.clear()
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.times.append(time.perf_counter() - start)
+        self.statements = len(self.queries)
+        return result
+
+    def to_dict(self):
+        return {
+            'median_ms': round(statistics.median(self.times) * 1000, 3),
+            'min_ms': round(min(self.times) * 1000, 3),
+            'max_ms': round(max(self.times) * 1000, 3),
+            'runs': len(self.times),
+            'queries': self.statements,
+        }
+
+def result_data(played_at, players):
+    local = misc.change_timezone(played_at, 'Etc/UTC', 'Europe/Amsterdam')
+    return {
+        'date': local.date().isoformat(), 'time': local.strftime('%H:%M'),
+        'att_black': players[0], 'def_black': players[1], 'att_white': players[2], 'def_white': players[3],
+        'score_black': 10, 'score_white': 7,
+        'klinker_att_black': 0, 'klinker_def_black': 0, 'klinker_att_white': 0, 'klinker_def_white': 0,
+        'keeper_black': 0, 'keeper_white': 1,
+    }
+
+def login(app, username):
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': username, 'password': PASSWORD})
+    assert response.status_code == 302, 'login failed'
+    return client
+
+def check_response(response, status=200):
+    assert response.status_code == status, f'{response.request.path}: {response.status_code}'
+    return response
+
+def run_size(args, size: int) -> dict:
+    timers = {operation: None for operation in OPERATIONS}
+    with tempfile.TemporaryDirectory() as tmp:
+        config = type('Config', (config_for(os.path.join(tmp, 'suite.sqlite')),), {'PAGE_CACHE': 'none'})
+        app = create_app(config)
+        queries = []
+        with app.app_context():
+            db.create_all()
+            user_ids = generate_league(db, args.users, size)
+            rating.add_initial_ratings(db)
+            sa.event.listen(db.engine, 'before_cursor_execute', lambda *a: queries.append(a[2]))
+
+            timers['create_existing_ratings'] = Timer(queries)
+            for run in range(args.rating_runs):
+                if run:
+                    db.session.execute(sa.delete(Rating).where(Rating.match_id.is_not(None)))
+                    db.session.commit()
+                timers['create_existing_ratings'].run(rating.create_existing_ratings, db)
+
+            # The submitter plays for black, the checker for white
+            submitter, partner, checker, opponent = user_ids[:4]
+            hashed = db.session.get(User, submitter)
+            hashed.set_password(PASSWORD)
+            db.session.execute(sa.update(User).where(User.id.in_(user_ids[:4])).values(password_hash=hashed.password_hash))
+            db.session.commit()
+            usernames = dict(db.session.execute(sa.select(User.id, User.username)).all())
+            last_played = db.session.scalar(sa.select(sa.func.max(Match.played_at)))
+            match_id = db.session.scalar(sa.select(Match.id).order_by(Match.played_at.desc()).offset(size // 2).limit(1))
+            season = seasons.get_season_from_date(last_played)
+
+        submitting, checking = login(app, usernames[submitter]), login(app, usernames[checker])
+        timers['add_result'], timers['check_results'] = Timer(queries), Timer(queries)
+        for i in range(args.repeat):
+            played_at = last_played + timedelta(hours=i + 1)
+            check_response(timers['add_result'].run(
+                submitting.post, '/add_result', data=result_data(played_at, [submitter, partner, checker, opponent])
+            ), 302)
+            with app.app_context():
+                new_match = db.session.scalar(sa.select(Match.id).order_by(Match.played_at.desc()).limit(1))
+            check_response(timers['check_results'].run(
+                checking.post, '/check_results', data={'results': [new_match], 'confirm': 'Confirm'}
+            ), 302)
+
+        with app.app_context():
+            for operation, function, function_args in [
+                ('get_current_ranking', ranking.get_current_ranking, ()),
+                ('get_season_ranking', ranking.get_season_ranking, (season,)),
+            ]:
+                timers[operation] = Timer(queries)
+                for _ in range(args.repeat):
+                    timers[operation].run(function, *function_args)
+                    db.session.rollback()
+
+        for operation, url in [
+            ('/show_results', '/show_results'),
+            ('/user/<id>', f'/user/{submitter}'),
+            ('/match/<id>', f'/match/{match_id}'),
+        ]:
+            timers[operation] = Timer(queries)
+            check_response(submitting.get(url))
+            for _ in range(args.repeat):
+                details.cache.views.clear()
+                check_response(timers[operation].run(submitting.get, url))
+
+        with app.app_context():
+            db.engine.dispose()
+    return {operation: timer.to_dict() for operation, timer in timers.items()}
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args) -> dict:
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'users': args.users,
+        'repeat': args.repeat,
+        'rating_runs': args.rating_runs,
+        'sizes': {},
+    }
+    for size in args.sizes:
+        start = time.perf_counter()
+        report['sizes'][str(size)] = results = run_size(args, size)
+        print(f'{size} matches ({time.perf_counter() - start:.0f} s)')
+        for operation, result in results.items():
+            print(f'  {operation:24} {result["median_ms"]:10.2f} ms  {result["queries"]:4} queries')
+    return report
+
+def compare(baseline: dict, current: dict, tolerance: float, min_delta: float) -> list:
+    """Print the changes of every operation in both reports and return the regressions as (size, operation, reason)."""
+    regressions = []
+    print(f'{"size":>7} {"operation":24} {"baseline":>10} {"current":>10} {"change":>8}  queries')
+    for size, results in current['sizes'].items():
+        for operation, result in results.items():
+            old = baseline['sizes'].get(size, {}).get(operation)
+            if old is None:
+                continue
+            change = result['median_ms'] / old['median_ms'] - 1 if old['median_ms'] else 0.0
+            reasons = []
+            if change > tolerance and result['median_ms'] - old['median_ms'] > min_delta:
+                reasons.append(f'{change:+.0%} slower')
+            if result['queries'] > old['queries']:
+                reasons.append(f'{result["queries"] - old["queries"]} more queries')
+            regressions += [(size, operation, reason) for reason in reasons]
+            print(f'{size:>7} {operation:24} {old["median_ms"]:10.2f} {result["median_ms"]:10.2f} {change:+8.1%}  '
+                  f'{old["queries"]} -> {result["queries"]}{"  REGRESSION" if reasons else ""}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of matches.')
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per operation.')
+    parser.add_argument('--rating-runs', type=int, default=3, help='Runs of create_existing_ratings.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Baseline JSON file to compare the results with.')
+    parser.add_argument('--current', help='Compare this JSON file with the baseline instead of running the suite.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Fraction a median may be slower than the baseline.')
+    parser.add_argument('--min-delta', type=float, default=1.0, help='Milliseconds a median may be slower regardless of the tolerance.')
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as f:
+            report = json.load(f)
+    else:
+        report = run(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f'\ncompared with {args.compare} (commit {baseline.get("commit")}, {baseline.get("created_at")})')
+        regressions = compare(baseline, report, args.tolerance, args.min_delta)
+        for size, operation, reason in regressions:
+            print(f'regression: {operation} at {size} matches, {reason}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,47 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get(quote_plus('DATABASE_URL')) or 'sqlite:///' + os.path.join(basedir, 'app.sqlite')
-    SQLALCHEMY_ENGINE_OPTIONS = {'pool_recycle' : 280}
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    # Database engine profile (see foosbam/engine.py): 'auto' (from the database URL), 'mysql', 'sqlite' or 'default'
+    DB_PROFILE = os.environ.get('DB_PROFILE', 'auto')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ['1', 'true', 'yes']
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 280))
+    DB_ISOLATION_LEVEL = os.environ.get('DB_ISOLATION_LEVEL', 'READ COMMITTED')
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+    # Rating of confirmed results (see foosbam/core/rating_jobs.py): a worker polls the queue every RATING_WORKER_POLL seconds,
+    # and rates the queued results once none was added for RATING_BATCH_DELAY seconds (at the latest after RATING_BATCH_MAX_WAIT);
+    # if no worker has been seen for RATING_WORKER_TIMEOUT seconds, results are rated in the request that confirms them
+    RATING_WORKER_POLL = float(os.environ.get('RATING_WORKER_POLL', 1))
+    RATING_WORKER_TIMEOUT = int(os.environ.get('RATING_WORKER_TIMEOUT', 15))
+    RATING_BATCH_DELAY = float(os.environ.get('RATING_BATCH_DELAY', 5))
+    RATING_BATCH_MAX_WAIT = float(os.environ.get('RATING_BATCH_MAX_WAIT', 60))
+
+    # Request instrumentation (see foosbam/instrumentation.py): SQL and template timings per request, in a Server-Timing header,
+    # the foosbam.requests log and a buffer of the last INSTRUMENTATION_BUFFER requests per process, shown at /debug/requests to ADMINS
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', 'false').lower() in ['1', 'true', 'yes']
+    INSTRUMENTATION_BUFFER = int(os.environ.get('INSTRUMENTATION_BUFFER', 200))
+    INSTRUMENTATION_SLOWEST = int(os.environ.get('INSTRUMENTATION_SLOWEST', 5))
+    # ADMINS (usernames) may also import matches at /import_matches; their results are confirmed without the other team
+    ADMINS = [username.strip().lower() for username in os.environ.get('ADMINS', '').split(',') if username.strip()]
+
+    # Prometheus metrics at /metrics (see foosbam/metrics.py), shared by the processes through files in METRICS_DIR;
+    # with METRICS_TOKEN set, scrapes need the header "Authorization: Bearer <token>"
+    METRICS = os.environ.get('METRICS', 'false').lower() in ['1', 'true', 'yes']
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(basedir, 'instance', 'metrics')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Store of rendered pages (see foosbam/core/page_cache.py): 'memory', 'file', 'redis' or 'none'
+    PAGE_CACHE = os.environ.get('PAGE_CACHE', 'memory')
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 1000))
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR') or os.path.join(basedir, 'instance', 'page_cache')
+    PAGE_CACHE_URL = os.environ.get('PAGE_CACHE_URL', 'redis://localhost:6379/0')
 
     MAIL_SERVER = os.environ.get('MAIL_SERVER') 
     MAIL_PORT = os.environ.get('MAIL_PORT')
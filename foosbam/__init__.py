@@ -17,9 +17,16 @@ login.login_message_category = "is-danger"
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
     
+    from foosbam import engine
+    engine.configure(app)
+    from foosbam import metrics
+    metrics.configure(app)
     db.init_app(app)
+    engine.init_app(app, db)
+    from foosbam import instrumentation
+    instrumentation.init_app(app, db)
     if os.environ.get('FLASK_ENV') == 'development':
         migrate.init_app(app, db, render_as_batch=True)
     else:
@@ -33,6 +40,14 @@ def create_app(config_class=Config):
     from foosbam.core import bp as core_bp
     app.register_blueprint(core_bp)
 
+    from foosbam.core import page_cache
+    page_cache.init_app(app)
+
+    from foosbam.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api')
+
+    metrics.init_app(app)
+
     return app
 
 from foosbam import models
\ No newline at end of file
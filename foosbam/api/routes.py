@@ -0,0 +1,102 @@
+from flask import abort, jsonify, request, url_for
+from flask_login import login_required
+from foosbam import db
+from foosbam.api import bp
+from foosbam.core import elo, history, rating_jobs, results
+from foosbam.models import User
+import sqlalchemy as sa
+
+MAX_LINEUPS = 10000
+
+def page_response(page, endpoint, **values):
+    """Return a page of results as JSON, with links to the newer and older pages."""
+    size = request.args.get('size')
+    page['results'] = [result.to_dict() for result in page['results']]
+    page['links'] = {
+        'newer': url_for(endpoint, after=page['newer'], size=size, **values) if page['newer'] else None,
+        'older': url_for(endpoint, before=page['older'], size=size, **values) if page['older'] else None,
+    }
+    return jsonify(page)
+
+@bp.route('/results')
+@login_required
+def results_page():
+    try:
+        page = results.get_results_page_from_args(request.args)
+    except ValueError:
+        abort(400)
+
+    return page_response(page, 'api.results_page')
+
+@bp.route('/user/<user_id>/results')
+@login_required
+def user_results_page(user_id):
+    user = db.first_or_404(sa.select(User).where(User.id == user_id))
+
+    try:
+        page = results.get_results_page_from_args(request.args, user_id=user.id)
+    except ValueError:
+        abort(400)
+
+    return page_response(page, 'api.user_results_page', user_id=user.id)
+
+@bp.route('/user/<user_id>/ratings')
+@login_required
+def user_rating_history(user_id):
+    """
+    Rating history of a player: ?from=...&to=... (ISO timestamps, UTC), ?season=..., ?points=... (maximum number of points)
+    and ?downsampling=lttb|day. The ETag is based on the content, so an unchanged series is answered with 304 Not Modified.
+    """
+    user = db.first_or_404(sa.select(User).where(User.id == user_id))
+
+    try:
+        args = history.parse_history_args(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    response = jsonify({'user_id': user.id, 'season': args['season'], **history.get_rating_history(user.id, **args)})
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+@bp.route('/rating_queue')
+@login_required
+def rating_queue():
+    """Number of results waiting to be rated, running workers and the rating latency (seconds) of the last ?window=... seconds."""
+    window = request.args.get('window', rating_jobs.METRICS_WINDOW, type=int)
+    return jsonify(rating_jobs.get_metrics(window).to_dict())
+
+@bp.route('/predict', methods=['GET', 'POST'])
+@login_required
+def predict():
+    """
+    Win probabilities of one or more lineups, with the current ratings.
+    Lineups are given as ?lineup=att_black,def_black,att_white,def_white (repeatable),
+    or as a JSON body {"lineups": [[att_black, def_black, att_white, def_white], ...]}.
+    """
+    if request.method == 'POST':
+        lineups = (request.get_json(silent=True) or {}).get('lineups')
+    else:
+        lineups = [lineup.split(',') for lineup in request.args.getlist('lineup')]
+
+    try:
+        lineups = [[int(user_id) for user_id in lineup] for lineup in lineups]
+    except (TypeError, ValueError):
+        abort(400, 'Lineups should be lists of user ids.')
+    if not lineups or len(lineups) > MAX_LINEUPS:
+        abort(400, f'Give between 1 and {MAX_LINEUPS} lineups.')
+    if any(len(lineup) != 4 or len(set(lineup)) != 4 for lineup in lineups):
+        abort(400, 'A lineup consists of four different players.')
+
+    try:
+        probabilities = elo.predict_batch(lineups)
+    except KeyError:
+        abort(404, 'Unknown player in lineup.')
+
+    return jsonify({
+        'predictions': [
+            {'lineup': lineup, 'black': round(black, 4), 'white': round(white, 4)}
+            for lineup, (black, white) in zip(lineups, probabilities.tolist())
+        ]
+    })
@@ -3,7 +3,7 @@ from flask_login import current_user, login_user, logout_user
 from foosbam import db
 from foosbam.auth import bp
 from foosbam.auth.forms import LoginForm, RegistrationForm, ResetPasswordForm, RequestPasswordResetForm
-from foosbam.core import seasons
+from foosbam.core import rating, seasons
 from foosbam.email import send_password_reset
 from foosbam.models import User, Rating
 import sqlalchemy as sa
@@ -61,8 +61,8 @@ def register():
         db.session.flush()
 
         # add initial rating for new user to ratings table
-        rating = Rating(user_id=user.id, rating=1500, season=seasons.get_season_from_date(datetime.today()), rating_season=1500)
-        db.session.add(rating)
+        initial_rating = Rating(user_id=user.id, rating=1500, season=seasons.get_season_from_date(datetime.today()), rating_season=1500)
+        rating.add_ratings(db, [initial_rating])
         db.session.commit()
 
         flash(f"Have fun with Foosbam, {user.username.title()}!", "is-success")
@@ -1,5 +1,5 @@
 from flask import Blueprint
 
-bp = Blueprint('core', __name__)
+bp = Blueprint('core', __name__, cli_group=None)
 
-from foosbam.core import routes
\ No newline at end of file
+from foosbam.core import commands, routes
@@ -0,0 +1,229 @@
+# RATING AUDIT
+# ------------
+# Ratings are stored denormalized (previous_rating, rating, previous_rating_season, rating_season, season and since per row),
+# so manual changes (e.g. misc/add_seasons.sql, or a result that was edited in the database) can leave them out of line
+# with what the matches and results give. The audit checks every rating of a played match in a single pass:
+# 1) Stream all matches with a confirmed result and their stored ratings in order of played_at (one query, fetched in chunks)
+# 2) Replay every match on the in-memory state of replay.RatingState, starting from the initial ratings
+# 3) Compare the stored ratings of the match with the replayed ones
+#
+# The replay continues from the replayed (correct) ratings, not from the stored ones, so a wrong rating also shows up
+# in the later matches that depend on it. Time is linear in the number of ratings; memory is the RatingState
+# (a few integers per player and season) plus the divergent rows.
+# With repair, only the divergent rows are written: wrong rows are updated and missing rows are inserted, in batches.
+# Ratings of matches without a confirmed result are reported, but not removed.
+
+from foosbam import db
+from foosbam.core import details, player_state, standings, versions
+from foosbam.core.results import CONFIRMED
+from foosbam.models import Match, Rating, Result, User
+from itertools import groupby
+import sqlalchemy as sa
+from typing import Dict, List, Optional
+
+BATCH_SIZE = 1000
+COLUMNS = ['since', 'season', 'previous_rating', 'rating', 'previous_rating_season', 'rating_season']
+
+class Divergence:
+    """
+    A rating that differs from the replay. kind is 'changed' (stored, but with other values), 'missing' (not stored)
+    or 'unexpected' (stored, but the player did not play the match or the match has no confirmed result).
+    """
+    __slots__ = ('kind', 'match_id', 'played_at', 'user_id', 'rating_id', 'stored', 'expected')
+
+    def __init__(self, kind: str, match_id: int, played_at, user_id: int, rating_id: Optional[int] = None,
+                 stored: Optional[Dict] = None, expected: Optional[Dict] = None):
+        self.kind = kind
+        self.match_id = match_id
+        self.played_at = played_at
+        self.user_id = user_id
+        self.rating_id = rating_id
+        self.stored = stored
+        self.expected = expected
+
+    @property
+    def columns(self) -> List[str]:
+        """The columns that differ (of a changed rating)."""
+        if self.stored is None or self.expected is None:
+            return []
+        return [column for column in COLUMNS if self.stored[column] != self.expected[column]]
+
+class AuditReport:
+    __slots__ = ('matches', 'ratings', 'divergences', 'repaired')
+
+    def __init__(self):
+        self.matches = 0
+        self.ratings = 0
+        self.divergences: List[Divergence] = []
+        self.repaired = 0
+
+    @property
+    def first(self) -> Optional[Divergence]:
+        """The first point of divergence: the first divergent rating in order of played_at."""
+        return self.divergences[0] if self.divergences else None
+
+    def first_per_player(self) -> Dict[int, Divergence]:
+        first = {}
+        for divergence in self.divergences:
+            first.setdefault(divergence.user_id, divergence)
+        return first
+
+def query_matches_with_ratings() -> sa.Select:
+    """All matches with a confirmed result and their stored ratings (one row per rating), in order of played_at."""
+    return sa.select(
+        Match.id,
+        Match.played_at,
+        Match.season,
+        Match.att_black,
+        Match.def_black,
+        Match.att_white,
+        Match.def_white,
+        Result.score_black,
+        Result.score_white,
+        Rating.id.label('rating_id'),
+        Rating.user_id,
+        Rating.since,
+        Rating.season.label('rating_season_number'),
+        Rating.previous_rating,
+        Rating.rating,
+        Rating.previous_rating_season,
+        Rating.rating_season,
+    ).join(
+        Result,
+        sa.and_(Result.match_id == Match.id, Result.status == CONFIRMED)
+    ).outerjoin(
+        Rating,
+        Rating.match_id == Match.id
+    ).order_by(
+        Match.played_at,
+        Match.id,
+        Rating.id
+    )
+
+def query_ratings_without_result() -> sa.Select:
+    """Ratings of matches that have no confirmed result (or do not exist), which a replay would not give."""
+    return sa.select(
+        Rating.id,
+        Rating.match_id,
+        Rating.user_id,
+        Rating.since
+    ).outerjoin(
+        Result,
+        sa.and_(Result.match_id == Rating.match_id, Result.status == CONFIRMED)
+    ).where(
+        Rating.match_id.is_not(None),
+        Result.id.is_(None)
+    ).order_by(
+        Rating.since,
+        Rating.id
+    )
+
+def load_initial_state():
+    """A RatingState with the initial ratings (the ratings without match) of all players."""
+    # replay uses numpy, so it is only imported when it is needed
+    from foosbam.core import replay
+
+    state = replay.RatingState(user_id for (user_id,) in db.session.query(User.id).order_by(User.id))
+    initial = db.session.query(Rating.user_id, Rating.rating).filter(Rating.match_id.is_(None)).order_by(Rating.since, Rating.id)
+    for user_id, rating in initial:
+        if user_id in state.index:
+            state.set_rating(user_id, rating)
+    return state
+
+def stored_values(row) -> Dict:
+    return {
+        'since': player_state.normalize(row.since),
+        'season': row.rating_season_number,
+        'previous_rating': row.previous_rating,
+        'rating': row.rating,
+        'previous_rating_season': row.previous_rating_season,
+        'rating_season': row.rating_season,
+    }
+
+def check_match(rows: List[sa.Row], expected_rows: List[Dict]) -> List[Divergence]:
+    """Compare the stored ratings of a match (rows of query_matches_with_ratings) with the replayed ones."""
+    match = rows[0]
+    expected = {row['user_id']: row for row in expected_rows}
+    divergences = []
+    seen = set()
+    for row in rows:
+        if row.rating_id is None:
+            continue    # no ratings stored for this match at all (outer join)
+        if row.user_id not in expected or row.user_id in seen:
+            divergences.append(Divergence('unexpected', match.id, match.played_at, row.user_id, row.rating_id, stored_values(row)))
+            continue
+        seen.add(row.user_id)
+        stored = stored_values(row)
+        wanted = expected[row.user_id]
+        if any(stored[column] != wanted[column] for column in COLUMNS):
+            divergences.append(Divergence('changed', match.id, match.played_at, row.user_id, row.rating_id, stored, wanted))
+
+    for user_id, wanted in expected.items():
+        if user_id not in seen:
+            divergences.append(Divergence('missing', match.id, match.played_at, user_id, expected=wanted))
+    return divergences
+
+def verify_ratings(batch_size: int = BATCH_SIZE, lock: bool = False) -> AuditReport:
+    """
+    Replay all matches and compare the result with the stored ratings. No data is written.
+
+    Args:
+        batch_size (int): Number of rows fetched from the database at a time.
+        lock (bool): Take the ratings lock first (see versions.lock_version), so no ratings are added until the transaction ends.
+                     Needed before repair_ratings.
+
+    Returns:
+        AuditReport: The number of checked matches and ratings, and every divergent rating in order of played_at.
+    """
+    from foosbam.core import replay
+
+    if lock:
+        versions.lock_version(versions.RATINGS)
+    report = AuditReport()
+    state = load_initial_state()
+
+    rows = db.session.execute(query_matches_with_ratings().execution_options(yield_per=batch_size))
+    for _, match_rows in groupby(rows, key=lambda row: row.id):
+        match_rows = list(match_rows)
+        expected_rows = replay.replay_matches(state, match_rows[:1])
+        for row in expected_rows:
+            row['since'] = player_state.normalize(row['since'])
+        report.divergences += check_match(match_rows, expected_rows)
+        report.matches += 1
+        report.ratings += sum(row.rating_id is not None for row in match_rows)
+
+    for rating_id, match_id, user_id, since in db.session.execute(query_ratings_without_result()):
+        report.divergences.append(Divergence('unexpected', match_id, player_state.normalize(since), user_id, rating_id))
+        report.ratings += 1
+
+    report.divergences.sort(key=lambda d: (d.played_at, d.match_id))
+    return report
+
+def repair_ratings(report: AuditReport, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Rewrite the changed ratings and insert the missing ones of an audit, in batches, and rebuild the standings
+    of the affected players and seasons. Unexpected ratings are left as they are. The caller commits.
+
+    Returns:
+        int: The number of ratings that were updated or inserted.
+    """
+    changed = [{'id': d.rating_id, **d.expected} for d in report.divergences if d.kind == 'changed']
+    missing = [dict(d.expected) for d in report.divergences if d.kind == 'missing']
+    if not changed and not missing:
+        return 0
+
+    for start in range(0, len(changed), batch_size):
+        db.session.execute(sa.update(Rating), changed[start:start + batch_size])
+    for start in range(0, len(missing), batch_size):
+        db.session.execute(sa.insert(Rating), missing[start:start + batch_size])
+
+    # The season of a rating may have been repaired as well, so both the old and the new seasons are rebuilt
+    repaired_seasons = {row['season'] for row in changed + missing}
+    repaired_seasons |= {d.stored['season'] for d in report.divergences if d.kind == 'changed'}
+    standings.rebuild_players()
+    standings.rebuild_seasons(repaired_seasons)
+    details.record_rerated_matches({row['match_id'] for row in changed + missing})
+    versions.bump_version(versions.RATINGS)
+
+    report.repaired = len(changed) + len(missing)
+    return report.repaired
@@ -0,0 +1,185 @@
+import click
+from flask import current_app
+from foosbam import db
+from foosbam.core import audit, bp, export, importer, ranking, rating_jobs, standings, startup
+import os
+import signal
+import sys
+from foosbam.models import SeasonStanding, User
+import sqlalchemy as sa
+
+def compare_rankings(name, expected, actual):
+    """Compare two rankings (as rows of since, user_id, username, rating) and report the differences."""
+    expected = sorted(set((user_id, rating, since) for since, user_id, _, rating in expected))
+    actual = sorted(set((user_id, rating, since) for since, user_id, _, rating in actual))
+    for row in sorted(set(expected) ^ set(actual)):
+        click.echo(f'{name} - {"missing" if row in expected else "unexpected"}: user {row[0]}, rating {row[1]} since {row[2]}')
+    return expected == actual
+
+@bp.cli.command('rebuild-standings')
+@click.option('--check', is_flag=True, help='Only compare the standings with the rankings calculated from the ratings table.')
+@click.option('--all-seasons', is_flag=True, help='Also rebuild the standings of seasons that have ended.')
+def rebuild_standings(check, all_seasons):
+    """Rebuild the player and season standings from the ratings table."""
+    if not check:
+        standings.rebuild(all_seasons=all_seasons)
+        db.session.commit()
+        click.echo('Rebuilt standings.')
+
+    ok = compare_rankings('all-time', ranking.query_current_ranking_from_ratings(), ranking.query_current_ranking())
+    season_numbers = [season for (season,) in db.session.query(SeasonStanding.season).distinct().order_by(SeasonStanding.season)]
+    for season in season_numbers:
+        ok = compare_rankings(f'season {season}', ranking.query_season_ranking_from_ratings(season), ranking.query_season_ranking(season)) and ok
+
+    if not ok:
+        raise click.ClickException('Standings do not match the ratings table.')
+    click.echo(f'Standings match the ratings table (all-time and {len(season_numbers)} seasons).')
+
+# Heavy packages that should only be imported by the code paths that need them, not when a worker starts
+DEFERRED_PACKAGES = ['numpy', 'pandas']
+
+@bp.cli.command('startup-profile')
+@click.option('--path', default='/auth/login', show_default=True, help='URL of the first request.')
+@click.option('--top', default=15, show_default=True, help='Number of slowest imports to show.')
+@click.option('--budget', type=float, help='Fail if importing foosbam and create_app() take longer than this many milliseconds.')
+def startup_profile(path, top, budget):
+    """Measure the import time per module and the time until the app has served its first request, in a fresh interpreter."""
+    profile = startup.profile_startup(os.path.dirname(current_app.root_path), path)
+
+    click.echo('Import time per package:')
+    for package, self_time in startup.time_per_package(profile['modules'])[:top]:
+        click.echo(f'  {self_time / 1000:8.1f} ms  {package}')
+
+    click.echo('Slowest modules:')
+    for name, _, self_time, _ in sorted(profile['modules'], key=lambda m: m[2], reverse=True)[:top]:
+        click.echo(f'  {self_time / 1000:8.1f} ms  {name}')
+
+    startup_ms = (profile['import'] + profile['create_app']) * 1000
+    click.echo(f'import foosbam:      {profile["import"] * 1000:8.1f} ms')
+    click.echo(f'create_app():        {profile["create_app"] * 1000:8.1f} ms')
+    click.echo(f'first request:       {profile["first_request"] * 1000:8.1f} ms  (GET {path} -> {profile["status"]})')
+    click.echo(f'app ready (total):   {(startup_ms + profile["first_request"] * 1000):8.1f} ms')
+    for package in DEFERRED_PACKAGES:
+        click.echo(f'{package}: {"loaded" if package in profile["loaded"] else "not loaded"}')
+
+    if budget is not None and startup_ms > budget:
+        raise click.ClickException(f'Startup took {startup_ms:.1f} ms, which is over the budget of {budget:.1f} ms.')
+
+@bp.cli.command('export')
+@click.argument('dataset', type=click.Choice(export.DATASETS))
+@click.option('--format', 'format_', type=click.Choice(export.FORMATS), default='csv', show_default=True, help='Output format (Parquet needs pyarrow).')
+@click.option('--season', type=int, help='Only export this season.')
+@click.option('--user-id', type=int, help='Only export the matches or ratings of this player.')
+@click.option('--no-compress', is_flag=True, help='Do not gzip CSV output.')
+@click.option('--chunk-size', type=int, default=export.CHUNK_SIZE, show_default=True, help='Number of rows fetched and written at a time.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, allow_dash=True), help='Output file, "-" for stdout. Defaults to <dataset>.csv.gz or <dataset>.parquet.')
+def export_data(dataset, format_, season, user_id, no_compress, chunk_size, output):
+    """Export the matches (with results) or the rating history as CSV or Parquet."""
+    try:
+        parts = export.export(dataset, format_, season=season, user_id=user_id, compress=not no_compress, chunk_size=chunk_size)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    output = output or export.get_filename(dataset, format_, not no_compress)
+    size = 0
+    with (open(output, 'wb') if output != '-' else os.fdopen(os.dup(sys.stdout.fileno()), 'wb')) as f:
+        for part in parts:
+            f.write(part)
+            size += len(part)
+
+    if output != '-':
+        click.echo(f'Exported {dataset} to {output} ({size / 2**20:.1f} MiB).')
+
+@bp.cli.command('import-matches')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--created-by', required=True, help='Username or id of the user that is stored as the creator of the results.')
+@click.option('--utc', is_flag=True, help='played_at is in UTC instead of local time (e.g. a file made with `flask export matches --no-compress`).')
+@click.option('--chunk-size', type=int, default=importer.CHUNK_SIZE, show_default=True, help='Number of matches per transaction.')
+@click.option('--dry-run', is_flag=True, help='Only validate the file.')
+def import_matches(file, created_by, utc, chunk_size, dry_run):
+    """Import matches with their results from a CSV file and rate them."""
+    if created_by.isdigit():
+        user = db.session.get(User, int(created_by))
+    else:
+        user = db.session.scalar(sa.select(User).where(User.username == created_by.lower()))
+    if user is None:
+        raise click.ClickException(f'Unknown user {created_by}.')
+
+    report = importer.import_csv(file, user.id, utc=utc, chunk_size=chunk_size, dry_run=dry_run)
+    if report.errors:
+        for error in report.errors:
+            click.echo(error, err=True)
+        raise click.ClickException(f'{len(report.errors)} invalid row(s), nothing was imported.')
+
+    if dry_run:
+        click.echo(f'{len(report.matches)} valid matches, nothing was imported (dry run).')
+    else:
+        click.echo(f'Imported {report.imported} matches.' + (' Later matches were rated again.' if report.rerated else ''))
+
+def describe_divergence(divergence):
+    where = f'match {divergence.match_id} ({divergence.played_at:%Y-%m-%d %H:%M:%S}), user {divergence.user_id}'
+    if divergence.kind == 'changed':
+        changes = ', '.join(f'{column} {divergence.stored[column]} != {divergence.expected[column]}' for column in divergence.columns)
+        return f'{where}, rating {divergence.rating_id}: {changes}'
+    if divergence.kind == 'missing':
+        return f'{where}: missing rating'
+    return f'{where}, rating {divergence.rating_id}: unexpected rating (not a player of the match, a duplicate, or the match has no confirmed result)'
+
+@bp.cli.command('verify-ratings')
+@click.option('--repair', is_flag=True, help='Rewrite the divergent ratings and insert the missing ones.')
+@click.option('--batch-size', type=int, default=audit.BATCH_SIZE, show_default=True, help='Number of rows fetched and written at a time.')
+def verify_ratings(repair, batch_size):
+    """Replay all matches and report every stored rating that differs from the replay (as stored != replayed)."""
+    queued = rating_jobs.get_queue_depth()
+    if queued:
+        click.echo(f'{queued} result(s) are queued for rating (see flask rating-worker): their ratings and later ones are not final yet.')
+
+    report = audit.verify_ratings(batch_size, lock=repair)
+    for divergence in report.divergences:
+        click.echo(describe_divergence(divergence))
+
+    click.echo(f'Checked {report.ratings} ratings of {report.matches} matches.')
+    if not report.divergences:
+        click.echo('All ratings match a replay of the matches.')
+        return
+
+    first = report.first
+    click.echo(f'{len(report.divergences)} divergent rating(s) of {len(report.first_per_player())} player(s), '
+               f'the first in match {first.match_id} ({first.played_at:%Y-%m-%d %H:%M:%S}).')
+
+    if repair:
+        audit.repair_ratings(report, batch_size)
+        db.session.commit()
+        click.echo(f'Repaired {report.repaired} rating(s).')
+        unexpected = sum(divergence.kind == 'unexpected' for divergence in report.divergences)
+        if unexpected:
+            raise click.ClickException(f'{unexpected} unexpected rating(s) were not removed, please check them by hand.')
+    else:
+        raise click.ClickException('Ratings do not match a replay of the matches, run with --repair to fix them.')
+
+@bp.cli.command('rating-worker')
+@click.option('--poll', type=float, help='Seconds between checks of the queue. Defaults to RATING_WORKER_POLL.')
+@click.option('--once', is_flag=True, help='Rate the queued results and stop.')
+def rating_worker(poll, once):
+    """Rate added results in the background, in order of played_at (see foosbam/core/rating_jobs.py)."""
+    # Stop on SIGTERM (e.g. from systemd or docker) like on Ctrl+C, so the worker unregisters itself
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    click.echo(f'Rating worker started, {rating_jobs.get_queue_depth()} result(s) queued.')
+    try:
+        rating_jobs.run_worker(poll, once, log=click.echo)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        click.echo('Rating worker stopped.')
+
+@bp.cli.command('rating-queue')
+@click.option('--window', type=int, default=rating_jobs.METRICS_WINDOW, show_default=True, help='Seconds of finished jobs to include in the latency.')
+def rating_queue(window):
+    """Show the number of queued results, the running workers and the rating latency."""
+    metrics = rating_jobs.get_metrics(window)
+    oldest = f', the oldest for {metrics.oldest_age:.1f} s' if metrics.oldest_age is not None else ''
+    click.echo(f'queued:   {metrics.depth}{oldest}')
+    click.echo(f'workers:  {metrics.workers}')
+    click.echo(f'finished: {metrics.finished} in the last {window} s ({metrics.finished_inline} rated in the request)')
+    if metrics.finished:
+        click.echo(f'latency:  p50 {metrics.latency_p50:.2f} s, p95 {metrics.latency_p95:.2f} s, max {metrics.latency_max:.2f} s')
@@ -0,0 +1,118 @@
+# RESULT CONFIRMATION
+# -------------------
+# A result is added as "Pending" and only counts for the ratings once a player of the other team has confirmed it:
+# - confirming a pending (or disputed) result queues a rating job (see rating_jobs.py)
+# - disputing a pending result keeps it out of the ratings; disputing a confirmed result queues a rating job as well,
+#   which replays the matches from that result onwards without it (see rating.rerate_from) and so removes its ratings
+# Results are checked by the players of the team that did not add them (by any of the players if the one who added it did not play).
+#
+# Several results can be checked at once (e.g. all results of a league night), and the worker waits until confirmations
+# stop coming in (RATING_BATCH_DELAY), so a burst of confirmations is rated in one transaction, with at most one replay.
+
+from datetime import datetime, timezone
+from foosbam import db
+from foosbam.core import details, rating_jobs, results, versions
+from foosbam.core.results import CONFIRMED, DISPUTED, PENDING
+from foosbam.models import Match, MatchParticipant, Result
+import sqlalchemy as sa
+from sqlalchemy.orm import aliased
+from typing import Iterable, List, Tuple
+
+# action -> (new status, statuses it can be applied to)
+ACTIONS = {
+    'confirm': (CONFIRMED, [PENDING, DISPUTED]),
+    'dispute': (DISPUTED, [PENDING, CONFIRMED]),
+}
+
+def get_checkers(players: List[int], created_by: int) -> List[int]:
+    """
+    The players that can confirm or dispute a result.
+
+    Args:
+        players (list): The players of the match, in the order att_black, def_black, att_white, def_white.
+        created_by (int): The user that added the result.
+    """
+    black, white = players[:2], players[2:]
+    if created_by in black:
+        return white
+    if created_by in white:
+        return black
+    return players
+
+def query_results_to_check(user_id: int, statuses: Iterable[str] = (PENDING,)):
+    """Query of the results (rows of results.query_results) that the given user can check, oldest first."""
+    player = aliased(MatchParticipant)
+    creator = aliased(MatchParticipant)
+    return results.query_results().join(
+        player,
+        sa.and_(player.match_id == Match.id, player.user_id == user_id)
+    ).outerjoin(
+        creator,
+        sa.and_(creator.match_id == Match.id, creator.user_id == Result.created_by)
+    ).filter(
+        Result.status.in_(list(statuses)),
+        sa.or_(creator.user_id.is_(None), creator.team != player.team)
+    ).order_by(
+        Match.played_at
+    )
+
+def check_results(match_ids: Iterable[int], user_id: int, action: str) -> Tuple[int, int]:
+    """
+    Confirm or dispute the results of the given matches, in the current transaction, and queue the rating jobs. The caller commits.
+    Results that the user cannot check, or that already have the new status, are skipped.
+
+    Args:
+        match_ids (iterable): The matches of the results.
+        user_id (int): The user that checks the results.
+        action (str): 'confirm' or 'dispute'.
+
+    Returns:
+        tuple: The number of checked and skipped results.
+
+    Raises:
+        ValueError: If the action is unknown.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown action {action}, choose from {", ".join(ACTIONS)}.')
+    new_status, from_statuses = ACTIONS[action]
+    match_ids = set(match_ids)
+
+    # Checks of the same result by two players are done one after the other (see versions.lock_version)
+    versions.lock_version(versions.MATCHES)
+    rows = db.session.execute(
+        sa.select(
+            Result,
+            Match.att_black,
+            Match.def_black,
+            Match.att_white,
+            Match.def_white
+        ).join(
+            Match,
+            Match.id == Result.match_id
+        ).where(
+            Result.match_id.in_(match_ids)
+        ).with_for_update(of=Result)
+    ).all()
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    checked = 0
+    rerate = []
+    for result, *players in rows:
+        if user_id not in get_checkers(players, result.created_by) or result.status not in from_statuses:
+            continue
+        # Confirmed results get ratings, and confirmed results that are disputed lose them
+        if new_status == CONFIRMED or result.status == CONFIRMED:
+            rerate.append(result.match_id)
+        result.status = new_status
+        result.checked_at = now
+        result.checked_by = user_id
+        checked += 1
+
+    if rerate:
+        rating_jobs.enqueue(rerate)
+    if new_status == DISPUTED and rerate:
+        # Rated match pages are cached (see details.py): show the new status before the ratings are removed
+        details.record_rerated_matches(rerate)
+    elif checked:
+        versions.bump_version(versions.MATCHES)
+    return checked, len(match_ids) - checked
@@ -1,149 +1,220 @@
-from datetime import datetime
-from foosbam import db
-from foosbam.core import elo, misc
-from foosbam.models import Match, Result, Rating, User
-from typing import Dict, Union
-
-def get_match_and_result_details(match_id: int) -> Dict[str, Union[int, str]]:
+# MATCH DETAILS
+# -------------
+# Everything on the match page (match, result, the four players and their ratings) is fetched in a single query
+# and stored in a MatchView. Played matches do not change, so views are cached per match in the process.
+# Only rated views are cached: until a result is confirmed and rated its status can still change.
+#
+# The only exception is a backdated match: then later matches are rated again (see rating.rerate_from).
+# Re-rating bumps the 'rerates' version in the data_versions table. Matches that were re-rated in this process are removed
+# from the cache once the transaction is committed; if another process re-rated matches, the whole cache is cleared.
+# The views also contain the usernames of the players, so the cache is cleared as well when the 'users' version changes
+# (e.g. a user changed their username).
+
+from collections import OrderedDict
+from foosbam import db, metrics
+from foosbam.core import elo, versions, views
+from foosbam.models import Match, Rating, Result, User
+import sqlalchemy as sa
+from sqlalchemy.orm import aliased
+from typing import Dict, Iterable, List, Optional
+
+ROLES = ['att_black', 'def_black', 'att_white', 'def_white']
+MAX_CACHED_MATCHES = 10000
+
+class PlayerView:
+    __slots__ = ('id', 'name', 'previous_rating', 'current_rating')
+
+    def __init__(self, user_id: int, username: str, previous_rating: Optional[int], current_rating: Optional[int]):
+        self.id = user_id
+        self.name = username.title()
+        self.previous_rating = previous_rating
+        self.current_rating = current_rating
+
+class MatchView:
+    __slots__ = (
+        'id', 'played_at', 'status', 'created_by', 'score_black', 'score_white',
+        'klinker_att_black', 'klinker_def_black', 'klinker_att_white', 'klinker_def_white', 'keeper_black', 'keeper_white',
+        'att_black', 'def_black', 'att_white', 'def_white', 'prediction_details'
+    )
+
+    def __init__(self, row):
+        self.id = row.id
+        self.played_at = views.format_timestamp(row.played_at)
+        self.status = row.status
+        self.created_by = row.created_by
+        self.score_black = row.score_black
+        self.score_white = row.score_white
+        self.klinker_att_black = row.klinker_att_black
+        self.klinker_def_black = row.klinker_def_black
+        self.klinker_att_white = row.klinker_att_white
+        self.klinker_def_white = row.klinker_def_white
+        self.keeper_black = row.keeper_black
+        self.keeper_white = row.keeper_white
+
+        for role in ROLES:
+            setattr(self, role, PlayerView(
+                getattr(row, f'{role}_id'),
+                getattr(row, f'{role}_name'),
+                getattr(row, f'{role}_previous_rating'),
+                getattr(row, f'{role}_rating')
+            ))
+
+        self.prediction_details = create_prediction_details(self.players) if self.is_rated() else None
+
+    @property
+    def players(self) -> List[PlayerView]:
+        return [getattr(self, role) for role in ROLES]
+
+    def is_rated(self) -> bool:
+        return all(player.previous_rating is not None for player in self.players)
+
+def query_match_view(match_id: int):
     """
-    Retrieves details of a specific match and its result from the database.
-
-    Args:
-        match_id (int): The ID of the match to retrieve details for.
-
-    Returns:
-        dict: A dictionary containing details of the match and its result, with the following keys:
-            - 'id' (int): The ID of the match.
-            - 'played_at' (str): The date and time the match was played, in 'YYYY-MM-DD HH:MM' format, 
-                                 converted from UTC to Europe/Amsterdam timezone.
-            - 'score_black' (int): The score of the black team.
-            - 'score_white' (int): The score of the white team.
-            - 'klinker_att_black' (int): The number of klinkers scored by the black attacker.
-            - 'klinker_def_white' (int): The number of klinkers scored by the black defender.
-            - 'klinker_att_white' (int): The number of klinkers scored by the white attacker.
-            - 'klinker_def_white' (int): The number of klinkers scored by the white defender.
-            - 'keeper_black' (str): The number of keeper goals scored by the black team.
-            - 'keeper_white' (str): The number of keeper goals scored by the white team.
-
-    Raises:
-        Exception: If there's an error while querying the database.
+    Retrieve the match, its result, and the name and rating of each of the four players in a single query.
+    The ratings of a match are found with the (user_id, match_id) index of the ratings table.
     """
-
-    try:
-        details = db.session.query(
-            Match.id, 
-            Match.played_at,
-            Result.score_black,
-            Result.score_white,
-            Result.klinker_att_black,
-            Result.klinker_def_black,
-            Result.klinker_att_white,
-            Result.klinker_def_white,
-            Result.keeper_black,
-            Result.keeper_white
-        ).filter(
-            Match.id == match_id
+    columns = [
+        Match.id,
+        Match.played_at,
+        Result.status,
+        Result.created_by,
+        Result.score_black,
+        Result.score_white,
+        Result.klinker_att_black,
+        Result.klinker_def_black,
+        Result.klinker_att_white,
+        Result.klinker_def_white,
+        Result.keeper_black,
+        Result.keeper_white,
+    ]
+    query = db.session.query(Match).filter(
+        Match.id == match_id
+    ).join(
+        Result,
+        Match.id == Result.match_id,
+        isouter = True
+    )
+
+    for role in ROLES:
+        user = aliased(User)
+        rating = aliased(Rating)
+        player_id = getattr(Match, role)
+        columns += [
+            player_id.label(f'{role}_id'),
+            user.username.label(f'{role}_name'),
+            rating.previous_rating.label(f'{role}_previous_rating'),
+            rating.rating.label(f'{role}_rating'),
+        ]
+        query = query.join(
+            user,
+            player_id == user.id
         ).join(
-            Result,
-            Match.id == Result.match_id,
+            rating,
+            sa.and_(rating.user_id == player_id,
+                    rating.match_id == Match.id),
             isouter = True
-        ).one()
-
-        match_details = dict(
-            zip(
-                [
-                    'id',
-                    'played_at',
-                    'score_black',
-                    'score_white',
-                    'klinker_att_black',
-                    'klinker_def_black',
-                    'klinker_att_white',
-                    'klinker_def_white',
-                    'keeper_black',
-                    'keeper_white'
-                ],
-                details,
-            )
         )
-        
-        match_details['played_at'] = misc.change_timezone(match_details['played_at'], 'Etc/UTC', 'Europe/Amsterdam')
-        match_details['played_at'] = datetime.strftime(match_details['played_at'], '%Y-%m-%d %H:%M')
-        
-        return match_details
-    except Exception as e:
-        raise e
-
-def get_previous_and_current_rating(user_id : int, match_id : int):
+
+    return query.with_entities(*columns).one_or_none()
+
+class MatchViewCache:
+    def __init__(self):
+        self.views: OrderedDict = OrderedDict()
+        self.version: Optional[int] = None
+        self.users_version: Optional[int] = None
+        self.database: Optional[str] = None
+
+    def refresh(self):
+        """Clear the cache if matches were re-rated by another process or users were changed."""
+        version_state = versions.get_versions([versions.RERATES, versions.USERS])
+        version, users_version = version_state[versions.RERATES][0], version_state[versions.USERS][0]
+        if version != self.version or users_version != self.users_version or str(db.engine.url) != self.database:
+            self.views.clear()
+            self.version = version
+            self.users_version = users_version
+            self.database = str(db.engine.url)
+
+    def get(self, match_id: int) -> Optional[MatchView]:
+        view = self.views.get(match_id)
+        if view is not None:
+            self.views.move_to_end(match_id)
+        return view
+
+    def add(self, view: MatchView):
+        self.views[view.id] = view
+        if len(self.views) > MAX_CACHED_MATCHES:
+            self.views.popitem(last=False)
+
+cache = MatchViewCache()
+
+def load_match_view(match_id: int) -> Optional[MatchView]:
     """
+    Retrieve everything that is shown on the page of a match.
+
+    Args:
+        match_id (int): The ID of the match.
+
+    Returns:
+        MatchView: The match, its result and its players, or None if the match does not exist.
     """
-    try:
-        details = db.session.query(
-            Rating.previous_rating,
-            Rating.rating
-        ).filter(
-            Rating.user_id == user_id,
-            Rating.match_id == match_id
-        ).one()
-        return details
-    except Exception as e:
-        raise e
-
-def get_players_from_match(match_id: int):
-    try:
-        player_ids = db.session.query(
-            Match.att_black,
-            Match.def_black,
-            Match.att_white,
-            Match.def_white
-        ).filter(
-            Match.id == match_id
-        ).one()
-
-        att_black = {'id': player_ids[0]}
-        def_black = {'id': player_ids[1]}
-        att_white = {'id': player_ids[2]}
-        def_white = {'id': player_ids[3]}
-
-
-        return [att_black, def_black, att_white, def_white]
-    
-    except Exception as e:
-        raise e
-
-def get_player_name(user_id : int) ->  str:
+    cache.refresh()
+    view = cache.get(match_id)
+    metrics.inc('foosbam_cache_requests_total', cache='match_view', result='hit' if view is not None else 'miss')
+    if view is not None:
+        return view
+
+    row = query_match_view(match_id)
+    if row is None:
+        return None
+
+    view = MatchView(row)
+    # A match without ratings may still be rated, so only complete views are cached
+    if view.is_rated():
+        cache.add(view)
+    return view
+
+def record_rerated_matches(match_ids: Iterable[int]):
     """
+    Register matches that are rated again in the current transaction.
+    This bumps the rerates version (in the same transaction) and removes the matches from the cache once the transaction is committed.
     """
-    try:
-        name = db.session.query(
-            User.username,
-        ).filter(
-            User.id == user_id,
-        ).one()
-
-        return name[0]  # name is a tuple with 1 element, so only return the actual name
-    except Exception as e:
-        raise e
-
-def enrich_player_details(player_details, match_id):
-    for player in player_details:
-        player['name'] = get_player_name(player['id']).title()
-        r = get_previous_and_current_rating(player['id'], match_id)
-        player['previous_rating'] = r[0]
-        player['current_rating'] = r[1]
-    return player_details
-
-
-def create_prediction_details(player_details):
+    new_version = versions.bump_version(versions.RERATES)
+    db.session.info.setdefault('match_view_base_version', new_version - 1)
+    db.session.info.setdefault('match_view_rerated', set()).update(match_ids)
+    db.session.info['match_view_version'] = new_version
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _invalidate_rerated(session):
+    match_ids = session.info.pop('match_view_rerated', None)
+    base_version = session.info.pop('match_view_base_version', None)
+    new_version = session.info.pop('match_view_version', None)
+    if new_version is None:
+        return
+
+    # Only remove the re-rated matches if no other process re-rated matches in the meantime, otherwise clear everything
+    if cache.version is not None and cache.version == base_version:
+        for match_id in match_ids:
+            cache.views.pop(match_id, None)
+        cache.version = new_version
+    else:
+        cache.views.clear()
+        cache.version = None
+
+@sa.event.listens_for(db.session, 'after_rollback')
+def _discard_rerated(session):
+    for key in ['match_view_rerated', 'match_view_base_version', 'match_view_version']:
+        session.info.pop(key, None)
+
+def create_prediction_details(player_details: List[PlayerView]) -> Dict[str, float]:
     prediction_details = {
-        'ab_dw' : round(elo.calculate_expected_score(player_details[0]['previous_rating'],player_details[3]['previous_rating']), 2),
-        'ab_aw' : round(elo.calculate_expected_score(player_details[0]['previous_rating'],player_details[2]['previous_rating']), 2),
-        'db_dw' : round(elo.calculate_expected_score(player_details[1]['previous_rating'],player_details[3]['previous_rating']), 2),
-        'db_aw' : round(elo.calculate_expected_score(player_details[1]['previous_rating'],player_details[2]['previous_rating']), 2),
-        'aw_db' : round(elo.calculate_expected_score(player_details[2]['previous_rating'],player_details[1]['previous_rating']), 2),
-        'aw_ab' : round(elo.calculate_expected_score(player_details[2]['previous_rating'],player_details[0]['previous_rating']), 2),
-        'dw_db' : round(elo.calculate_expected_score(player_details[3]['previous_rating'],player_details[1]['previous_rating']), 2),
-        'dw_ab' : round(elo.calculate_expected_score(player_details[3]['previous_rating'],player_details[0]['previous_rating']), 2),
+        'ab_dw' : round(elo.calculate_expected_score(player_details[0].previous_rating,player_details[3].previous_rating), 2),
+        'ab_aw' : round(elo.calculate_expected_score(player_details[0].previous_rating,player_details[2].previous_rating), 2),
+        'db_dw' : round(elo.calculate_expected_score(player_details[1].previous_rating,player_details[3].previous_rating), 2),
+        'db_aw' : round(elo.calculate_expected_score(player_details[1].previous_rating,player_details[2].previous_rating), 2),
+        'aw_db' : round(elo.calculate_expected_score(player_details[2].previous_rating,player_details[1].previous_rating), 2),
+        'aw_ab' : round(elo.calculate_expected_score(player_details[2].previous_rating,player_details[0].previous_rating), 2),
+        'dw_db' : round(elo.calculate_expected_score(player_details[3].previous_rating,player_details[1].previous_rating), 2),
+        'dw_ab' : round(elo.calculate_expected_score(player_details[3].previous_rating,player_details[0].previous_rating), 2),
     }
 
     prediction_details['ab'] = round((prediction_details['ab_dw'] + prediction_details['ab_aw'])/2, 2)
@@ -154,4 +225,4 @@ def create_prediction_details(player_details):
     prediction_details['black'] = round((prediction_details['ab'] + prediction_details['db'])/2, 2)
     prediction_details['white'] = round((prediction_details['aw'] + prediction_details['dw'])/2, 2)
 
-    return prediction_details
\ No newline at end of file
+    return prediction_details
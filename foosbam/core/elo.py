@@ -10,12 +10,15 @@
 
 from datetime import datetime
 from foosbam import db
-from foosbam.core import seasons
-from foosbam.models import Match, Rating
+from foosbam.core import player_state, seasons, standings
+from foosbam.models import Rating
 import math
-import pandas as pd
 import sqlalchemy as sa
-from typing import Optional
+from typing import TYPE_CHECKING, List, Optional
+
+# numpy is imported in the functions that use it, so it is only loaded once ratings are calculated
+if TYPE_CHECKING:
+    import numpy as np
 
 def get_most_recent_rating(user_id: int, season: Optional[int] = None) -> int:
     """
@@ -54,38 +57,97 @@ def get_current_match_count(user_id: int) -> int:
         user_id (int): The ID of the user whose matches are being counted.
 
     Returns:
-        int: The count of matches in which the user is involved.
-    """
-    count = Match.query.filter(
-        (Match.att_black == user_id) | 
-        (Match.def_black == user_id) | 
-        (Match.att_white == user_id) | 
-        (Match.def_white == user_id)
-    ).count()
+        int: The count of rated matches in which the user is involved.
+    """
+    count = db.session.scalar(sa.select(sa.func.count(Rating.match_id)).where(
+        Rating.user_id == user_id
+    ))
     return count
 
 def get_match_count_before(user_id: int, before_timestamp: datetime) -> int:
     """
     Retrieve the match count for a given user, that were played before a given timestamp. The match count is independent of seasons.
+    Matches are counted by their ratings, like in the replay and the standings, so pending and disputed matches do not count.
 
     Args:
         user_id (int): The ID of the user whose matches are being counted.
         before_timestamp (datetime): The timestamp before which the matches were played. 
 
     Returns:
-        int: The number of matches involving the user before the specified timestamp.
-    """
-    count = Match.query.filter(
-        (Match.att_black == user_id) | 
-        (Match.def_black == user_id) | 
-        (Match.att_white == user_id) | 
-        (Match.def_white == user_id)
-    ).filter(
-        Match.played_at < before_timestamp
-    ).count()
+        int: The number of rated matches involving the user before the specified timestamp.
+    """
+    count = db.session.scalar(sa.select(sa.func.count(Rating.match_id)).where(
+        Rating.user_id == user_id,
+        Rating.since < before_timestamp
+    ))
     return count
 
+def get_players_before_match(user_ids, played_at, season):
+    """
+    Get the latest ratings, season ratings and match counts of the players of a match, from their standings.
+    Call this while holding the ratings lock (see versions.lock_version), so the standings cannot change before the new ratings are added.
+
+    Returns:
+        tuple: Lists with the ratings, season ratings and match counts of the players, in the order of user_ids.
+    """
+    players = standings.get_current_standings(user_ids, season)
+    ratings = [players[user_id].rating for user_id in user_ids]
+    ratings_season = [players[user_id].rating_season for user_id in user_ids]
+
+    # The match count of the standings includes all matches, so only use it if the match is played after the player's latest rating
+    played_at_utc = player_state.normalize(played_at)
+    counts = [
+        players[user_id].match_count if players[user_id].rating_since < played_at_utc else get_match_count_before(user_id, played_at)
+        for user_id in user_ids
+    ]
+    return ratings, ratings_season, counts
+
+def construct_ratings(user_ids, match_id, played_at, score_black, score_white) -> List[Rating]:
+    """
+    Calculate the ratings of the four players of a new match, with calculate_new_ratings instead of a DataFrame.
+
+    Args:
+        user_ids (list): The players of the match, in the order att_black, def_black, att_white, def_white.
+        match_id (int): The ID of the match.
+        played_at (datetime): The time the match was played.
+        score_black (int): The score of team black.
+        score_white (int): The score of team white.
+
+    Returns:
+        list: A new Rating for each player, in the order of user_ids.
+    """
+    import numpy as np
+
+    season = seasons.get_season_from_date(played_at)
+    ratings, ratings_season, counts = get_players_before_match(user_ids, played_at, season)
+
+    new_ratings, new_ratings_season = calculate_new_ratings(
+        np.array([ratings, ratings_season], dtype=np.int64),
+        np.array(counts),
+        calculate_point_factor(score_black, score_white),
+        get_winner(score_black, score_white) == 'black'
+    )
+
+    return [
+        Rating(
+            user_id = user_id,
+            match_id = match_id,
+            since = played_at,
+            season = season,
+            previous_rating = rating,
+            rating = int(new_rating),
+            previous_rating_season = rating_season,
+            rating_season = int(new_rating_season)
+        )
+        for user_id, rating, new_rating, rating_season, new_rating_season
+        in zip(user_ids, ratings, new_ratings, ratings_season, new_ratings_season)
+    ]
+
 def construct_dataframe(user_ids, match_id, played_at, score_black, score_white):
+    # Original DataFrame based calculation, kept as reference for construct_ratings.
+    # pandas is imported here, so it is not loaded when handling requests.
+    import pandas as pd
+
     # Prepare arguments
     roles = [
         'att_black',
@@ -100,9 +162,7 @@ def construct_dataframe(user_ids, match_id, played_at, score_black, score_white)
         'white'
     ]
     season = seasons.get_season_from_date(played_at)
-    ratings = [get_most_recent_rating(user_id, None) for user_id in user_ids]
-    ratings_season = [get_most_recent_rating(user_id, season) for user_id in user_ids]
-    counts = [get_match_count_before(user_id, played_at) for user_id in user_ids]
+    ratings, ratings_season, counts = get_players_before_match(user_ids, played_at, season)
 
     df = pd.DataFrame(list(zip(user_ids, roles, teams, ratings, ratings_season, counts)), columns=["user_id", "role", "team", "rating", "rating_season", "num_games"])
 
@@ -199,4 +259,109 @@ def calculate_rating(df, score_black, score_white):
     df['player_expected_season'] = df.apply(lambda x : calculate_expected_player_score(x, True), axis=1)
     df = calculate_expected_team_score(df, True)
     df['new_rating_season'] = df.apply(lambda x : calculate_new_rating(x, point_factor, winner, True), axis=1)
-    return df
\ No newline at end of file
+    return df
+
+# Positions of the two opponents for each player, with players in the order att_black, def_black, att_white, def_white.
+OPPONENTS = [[2, 3], [2, 3], [0, 1], [0, 1]]
+TEAMMATE = [1, 0, 3, 2]
+IS_BLACK = [True, True, False, False]
+
+def calculate_new_ratings(ratings: 'np.ndarray', num_games: 'np.ndarray', point_factor: float, black_won: bool) -> 'np.ndarray':
+    """
+    Calculate the new ratings of the four players of a single match with plain array arithmetic.
+    This gives exactly the same integers as calculate_rating, without building a DataFrame.
+
+    Args:
+        ratings (np.ndarray): Ratings of the players, in the order att_black, def_black, att_white, def_white.
+                              Several sets of ratings (e.g. overall and season ratings) can be stacked in the first axis.
+        num_games (np.ndarray): Number of matches played by each player before this match.
+        point_factor (float): Point factor of the match, see calculate_point_factor.
+        black_won (bool): Whether team black won the match.
+
+    Returns:
+        np.ndarray: The new (integer) ratings of the players, in the same order.
+    """
+    import numpy as np
+
+    k_factor = 50 / (1 + num_games / 300)
+    expected = 1 / (1 + 10 ** ((ratings[..., OPPONENTS] - ratings[..., None]) / 400))
+    player_expected = (expected[..., 0] + expected[..., 1]) / 2
+    team_expected = (player_expected + player_expected[..., TEAMMATE]) / 2
+    actual = (np.array(IS_BLACK) == black_won).astype(float)
+    return np.rint(ratings + k_factor * point_factor * (actual - team_expected)).astype(np.int64)
+
+def calculate_expected_scores(ratings: 'np.ndarray') -> 'np.ndarray':
+    """
+    Calculate the expected score of every player against every other player (see calculate_expected_score).
+
+    Args:
+        ratings (np.ndarray): The ratings of N players.
+
+    Returns:
+        np.ndarray: N x N matrix with the expected score of player i against player j at [i, j].
+    """
+    return 1 / (1 + 10 ** ((ratings[None, :] - ratings[:, None]) / 400))
+
+class ExpectedScoreMatrix:
+    """
+    Pairwise expected scores of all players, based on their current ratings (from the player state store).
+    The matrix is only rebuilt when the ratings have changed, i.e. when the version of the store has changed.
+    """
+
+    def __init__(self):
+        self.lookup = None          # user_id -> position in the matrix, -1 for unknown users
+        self.scores = None
+        self.version: Optional[int] = None
+        self.database: Optional[str] = None
+
+    def refresh(self):
+        import numpy as np
+
+        player_state.store.refresh()
+        store = player_state.store
+        if store.version == self.version and store.database == self.database:
+            return
+
+        user_ids = sorted(store.players)
+        self.lookup = np.full(max(user_ids, default=0) + 1, -1, dtype=np.int64)
+        self.lookup[user_ids] = np.arange(len(user_ids))
+        self.scores = calculate_expected_scores(np.array([store.players[user_id].rating for user_id in user_ids], dtype=np.float64))
+        self.version = store.version
+        self.database = store.database
+
+    def positions(self, user_ids: 'np.ndarray') -> 'np.ndarray':
+        """Convert user ids to positions in the matrix. Raises a KeyError for players without a rating."""
+        if user_ids.size and (user_ids.min() < 0 or user_ids.max() >= len(self.lookup)):
+            raise KeyError('No rating for some of the players')
+        positions = self.lookup[user_ids]
+        if (positions < 0).any():
+            raise KeyError('No rating for some of the players')
+        return positions
+
+expected_score_matrix = ExpectedScoreMatrix()
+
+def predict_batch(lineups) -> 'np.ndarray':
+    """
+    Calculate the win probabilities of many lineups at once, with the current ratings.
+    Like the prediction on the match page, the expected score of a player is the average against both opponents,
+    and the expected score of a team is the average of its two players.
+
+    Args:
+        lineups (array-like): L x 4 user ids, in the order att_black, def_black, att_white, def_white.
+
+    Returns:
+        np.ndarray: L x 2 array with the win probability of team black and team white for every lineup.
+
+    Raises:
+        KeyError: If one of the players has no rating.
+    """
+    import numpy as np
+
+    lineups = np.asarray(lineups, dtype=np.int64).reshape(-1, 4)
+    expected_score_matrix.refresh()
+    positions = expected_score_matrix.positions(lineups)
+
+    # Expected scores of both black players against both white players: L x 2 x 2
+    black_vs_white = expected_score_matrix.scores[positions[:, :2, None], positions[:, None, 2:]]
+    black = black_vs_white.mean(axis=(1, 2))
+    return np.stack([black, 1 - black], axis=1)
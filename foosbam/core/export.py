@@ -0,0 +1,211 @@
+# EXPORT
+# ------
+# Streams the matches (with their results) or the rating history as CSV or Parquet, for analysis outside of the app.
+# Rows are fetched from a server-side cursor in chunks (yield_per) and every chunk is written out before the next one is fetched,
+# so memory use does not depend on the number of rows.
+# CSV is gzipped on the fly, Parquet is compressed per row group (one row group per chunk). Parquet needs the optional pyarrow package.
+
+from foosbam import db
+from foosbam.models import Match, MatchParticipant, Rating, Result
+import csv
+from datetime import datetime
+import io
+import sqlalchemy as sa
+from typing import Iterator, List, Optional
+import zlib
+
+DATASETS = ['matches', 'ratings']
+FORMATS = ['csv', 'parquet']
+CHUNK_SIZE = 10000
+
+def query_matches(season: Optional[int] = None, user_id: Optional[int] = None) -> sa.Select:
+    """All matches with their result, in order of played_at. Optionally only of one season and/or one player."""
+    query = sa.select(
+        Match.id.label('match_id'),
+        Match.played_at,
+        Match.season,
+        Match.att_black,
+        Match.def_black,
+        Match.att_white,
+        Match.def_white,
+        Result.status,
+        Result.score_black,
+        Result.score_white,
+        Result.klinker_att_black,
+        Result.klinker_def_black,
+        Result.klinker_att_white,
+        Result.klinker_def_white,
+        Result.keeper_black,
+        Result.keeper_white,
+    ).join(
+        Result,
+        Result.match_id == Match.id
+    ).order_by(
+        Match.played_at
+    )
+
+    if season is not None:
+        query = query.where(Match.season == season)
+    if user_id is not None:
+        query = query.join(
+            MatchParticipant,
+            sa.and_(MatchParticipant.match_id == Match.id,
+                    MatchParticipant.user_id == user_id)
+        )
+    return query
+
+def query_ratings(season: Optional[int] = None, user_id: Optional[int] = None) -> sa.Select:
+    """
+    All ratings, in the order in which they were added. Optionally only of one season and/or one player.
+    Ratings are not sorted on since, so the database can stream them in primary key order without sorting the whole table.
+    """
+    query = sa.select(
+        Rating.id.label('rating_id'),
+        Rating.user_id,
+        Rating.match_id,
+        Rating.since,
+        Rating.season,
+        Rating.previous_rating,
+        Rating.rating,
+        Rating.previous_rating_season,
+        Rating.rating_season,
+    ).order_by(
+        Rating.id
+    )
+
+    if season is not None:
+        query = query.where(Rating.season == season)
+    if user_id is not None:
+        query = query.where(Rating.user_id == user_id)
+    return query
+
+QUERIES = {
+    'matches': query_matches,
+    'ratings': query_ratings,
+}
+
+def iter_chunks(query: sa.Select, chunk_size: int = CHUNK_SIZE) -> Iterator[List[sa.Row]]:
+    """Execute a query with a server-side cursor and yield the rows in lists of at most chunk_size rows."""
+    result = db.session.execute(query.execution_options(yield_per=chunk_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+def stream_csv(columns: List[str], chunks: Iterator[List[sa.Row]], compress: bool = True) -> Iterator[bytes]:
+    """Write chunks of rows as CSV (with a header), optionally gzipped, and yield the output per chunk."""
+    compressor = zlib.compressobj(wbits=31) if compress else None   # wbits=31 gives the gzip format
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def drain(final=False):
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        if compressor is not None:
+            data = compressor.compress(data)
+            if final:
+                data += compressor.flush()
+        return data
+
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        data = drain()
+        if data:
+            yield data
+    yield drain(final=True)
+
+class _ChunkSink:
+    """Writable file-like object that keeps what is written until it is collected, so Parquet output can be streamed."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def collect(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def get_arrow_schema(query: sa.Select):
+    import pyarrow as pa
+
+    arrow_types = {int: pa.int64(), str: pa.string(), datetime: pa.timestamp('us')}
+    return pa.schema([(column.name, arrow_types[column.type.python_type]) for column in query.selected_columns])
+
+def check_parquet_support():
+    """Raise a RuntimeError if pyarrow (an optional dependency) is not installed."""
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('Exporting to Parquet needs the pyarrow package (pip install pyarrow).')
+
+def stream_parquet(query: sa.Select, chunks: Iterator[List[sa.Row]]) -> Iterator[bytes]:
+    """Write chunks of rows as row groups of a Parquet file and yield the output per chunk."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = get_arrow_schema(query)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd')
+    try:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            yield sink.collect()
+    finally:
+        writer.close()
+    yield sink.collect()
+
+def export(dataset: str, format: str = 'csv', season: Optional[int] = None, user_id: Optional[int] = None,
+           compress: bool = True, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Stream a data set as CSV or Parquet.
+
+    Args:
+        dataset (str): 'matches' (matches with their results) or 'ratings' (the rating history).
+        format (str): 'csv' or 'parquet'.
+        season (Optional[int]): Only export this season.
+        user_id (Optional[int]): Only export the matches or ratings of this player.
+        compress (bool): Gzip the CSV output. Parquet output is always compressed.
+        chunk_size (int): Number of rows fetched and written at a time.
+
+    Returns:
+        Iterator[bytes]: The exported file, in parts.
+
+    Raises:
+        ValueError: If the data set or format is unknown.
+        RuntimeError: If Parquet is requested, but pyarrow is not installed.
+    """
+    if dataset not in QUERIES:
+        raise ValueError(f'Unknown data set {dataset}, choose from {", ".join(DATASETS)}.')
+    if format not in FORMATS:
+        raise ValueError(f'Unknown format {format}, choose from {", ".join(FORMATS)}.')
+
+    query = QUERIES[dataset](season=season, user_id=user_id)
+    if format == 'parquet':
+        check_parquet_support()
+        return stream_parquet(query, iter_chunks(query, chunk_size))
+    return stream_csv([column.name for column in query.selected_columns], iter_chunks(query, chunk_size), compress)
+
+def get_filename(dataset: str, format: str = 'csv', compress: bool = True) -> str:
+    if format == 'csv' and compress:
+        return f'{dataset}.csv.gz'
+    return f'{dataset}.{format}'
@@ -1,21 +1,22 @@
 from datetime import datetime
 from flask_login import current_user
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from foosbam import db
-from foosbam.core import misc
+from foosbam.core import misc, teams
 from foosbam.models import Match, User
 import sqlalchemy as sa
-from wtforms import DateField, IntegerField, SelectField, SubmitField, StringField, TimeField
+from wtforms import BooleanField, DateField, IntegerField, SelectField, SelectMultipleField, SubmitField, StringField, TimeField
 from wtforms.validators import InputRequired, Email, ValidationError
 
 class AddMatchForm(FlaskForm):
     # Match fields
     date = DateField('Date', validators=[InputRequired()])
     time = TimeField('Time', validators=[InputRequired()])
-    att_black = SelectField('Team Black - Attacker', validators=[InputRequired()])
-    def_black = SelectField('Team Black - Defender', validators=[InputRequired()])
-    att_white = SelectField('Team White - Attacker', validators=[InputRequired()])
-    def_white = SelectField('Team White - Defender', validators=[InputRequired()])
+    att_black = SelectField('Team Black - Attacker', coerce=int, validators=[InputRequired()])
+    def_black = SelectField('Team Black - Defender', coerce=int, validators=[InputRequired()])
+    att_white = SelectField('Team White - Attacker', coerce=int, validators=[InputRequired()])
+    def_white = SelectField('Team White - Defender', coerce=int, validators=[InputRequired()])
 
     # Result fields
     score_black = IntegerField('Team Black - Score', validators=[InputRequired()])
@@ -50,6 +51,25 @@ class AddMatchForm(FlaskForm):
                 seen.add(player.data)
         return True
     
+class MakeTeamsForm(FlaskForm):
+    players = SelectMultipleField('Present players', coerce=int, validators=[InputRequired()])
+    make_teams = SubmitField('Make teams', name='Make teams')
+
+    def validate_players(self, players):
+        if not teams.MIN_PLAYERS <= len(set(players.data)) <= teams.MAX_PLAYERS:
+            raise ValidationError(f'Please select between {teams.MIN_PLAYERS} and {teams.MAX_PLAYERS} players.')
+
+class ImportMatchesForm(FlaskForm):
+    file = FileField('CSV file', validators=[FileRequired(), FileAllowed(['csv'], 'Please upload a CSV file.')])
+    utc = BooleanField('Times are in UTC')
+    import_matches = SubmitField('Import matches', name='Import matches')
+
+class CheckResultsForm(FlaskForm):
+    # The checkboxes of the results are rendered in the table of results (or as a hidden field on the match page)
+    results = SelectMultipleField('Results', coerce=int, validate_choice=False, validators=[InputRequired('Please select at least one result.')])
+    confirm = SubmitField('Confirm', name='confirm')
+    dispute = SubmitField('Dispute', name='dispute')
+
 class EditProfileForm(FlaskForm):
     username = StringField('Name', validators=[InputRequired()])
     email = StringField('Email', validators=[InputRequired(), Email()])
@@ -0,0 +1,202 @@
+# RATING HISTORY
+# --------------
+# The rating of a player over time, for the chart on the player page (and /api/user/<id>/ratings).
+# The series is read from the ratings table with the covering index ix_ratings_user_id_since_history
+# (user_id, since, season, match_id, rating, rating_season), so the table itself is not touched.
+# The full series of a player is cached in the process until ratings are added or changed (the 'ratings' version),
+# and from/to/season are applied to the cached series.
+#
+# Long histories are downsampled on the server to a maximum number of points:
+# - 'lttb': Largest-Triangle-Three-Buckets, which keeps the shape of the line (peaks and dips) with few points
+# - 'day': the last rating of every day (followed by LTTB if that still gives too many points)
+
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from foosbam import db
+from foosbam.core import player_state, versions
+from foosbam.models import Rating
+from itertools import accumulate
+import sqlalchemy as sa
+from typing import Dict, List, Mapping, Optional, Sequence
+
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+DOWNSAMPLING = ['lttb', 'day']
+MAX_CACHED_PLAYERS = 1000
+EPOCH = datetime(1970, 1, 1)
+
+class RatingSeries:
+    __slots__ = ('since', 'seconds', 'season', 'rating', 'rating_season')
+
+    def __init__(self, rows):
+        self.since: List[datetime] = []
+        self.seconds: List[float] = []     # since as seconds since the epoch, the x values for downsampling
+        self.season: List[int] = []
+        self.rating: List[int] = []
+        self.rating_season: List[int] = []
+        for since, season, rating, rating_season in rows:
+            self.since.append(since)
+            self.seconds.append((since - EPOCH).total_seconds())
+            self.season.append(season)
+            self.rating.append(rating)
+            self.rating_season.append(rating_season)
+
+def query_history(user_id: int) -> sa.Select:
+    """The ratings of a player after each of their matches, in order of since. Initial ratings (without match) are left out."""
+    return sa.select(
+        Rating.since,
+        Rating.season,
+        Rating.rating,
+        Rating.rating_season
+    ).where(
+        Rating.user_id == user_id,
+        Rating.match_id.is_not(None)
+    ).order_by(
+        Rating.since
+    )
+
+class RatingSeriesCache:
+    def __init__(self):
+        self.series: OrderedDict = OrderedDict()
+        self.version: Optional[int] = None
+        self.database: Optional[str] = None
+
+    def refresh(self):
+        """Clear the cache if ratings were added or changed (by any process)."""
+        version = versions.get_version(versions.RATINGS)
+        if version != self.version or str(db.engine.url) != self.database:
+            self.series.clear()
+            self.version = version
+            self.database = str(db.engine.url)
+
+    def get(self, user_id: int) -> RatingSeries:
+        self.refresh()
+        series = self.series.get(user_id)
+        if series is not None:
+            self.series.move_to_end(user_id)
+            return series
+
+        # Executed on the connection: the rows are plain tuples, which saves the ORM overhead per row
+        series = RatingSeries(db.session.connection().execute(query_history(user_id)))
+        self.series[user_id] = series
+        if len(self.series) > MAX_CACHED_PLAYERS:
+            self.series.popitem(last=False)
+        return series
+
+cache = RatingSeriesCache()
+
+def lttb(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    """
+    Select at most threshold points of a line with Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+    The first and last points are always kept. In every bucket in between, the point is kept that forms the largest
+    triangle with the point kept in the previous bucket and the average of the next bucket.
+
+    Every point is visited once. Each bucket depends on the point kept in the previous one, so the buckets cannot be vectorized:
+    a plain loop is faster than NumPy calls per bucket (which cost more than the few points in a bucket).
+
+    Args:
+        x (sequence): The x values, in increasing order.
+        y (sequence): The y values.
+        threshold (int): The maximum number of points.
+
+    Returns:
+        list: The positions of the kept points, in increasing order.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    # Bucket i (of threshold - 2 buckets) covers positions edges[i]:edges[i + 1], the first and last points are buckets on their own
+    buckets = threshold - 2
+    edges = [1 + i * (n - 2) // buckets for i in range(buckets + 1)] + [n]
+    sum_x = list(accumulate(x, initial=0))
+    sum_y = list(accumulate(y, initial=0))
+
+    kept = [0]
+    a = 0
+    for i in range(buckets):
+        start, end, next_end = edges[i], edges[i + 1], edges[i + 2]
+        avg_x = (sum_x[next_end] - sum_x[end]) / (next_end - end)
+        avg_y = (sum_y[next_end] - sum_y[end]) / (next_end - end)
+
+        # Twice the area of the triangle (a, candidate, average of the next bucket) is |dx * (y_j - y_a) + dy * (x_j - x_a)|
+        x_a, y_a = x[a], y[a]
+        dx, dy = x_a - avg_x, avg_y - y_a
+        best_area = -1.0
+        for j in range(start, end):
+            area = abs(dx * (y[j] - y_a) + dy * (x[j] - x_a))
+            if area > best_area:
+                best_area, a = area, j
+        kept.append(a)
+    kept.append(n - 1)
+    return kept
+
+def last_per_day(since: List[datetime], positions: Sequence[int]) -> List[int]:
+    """Of the given positions (in increasing order of since), keep the position of the last rating of every day."""
+    return [
+        i for i, j in zip(positions, positions[1:])
+        if since[i].date() != since[j].date()
+    ] + list(positions[-1:])
+
+def get_rating_history(user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None, season: Optional[int] = None,
+                       points: int = DEFAULT_POINTS, downsampling: str = 'lttb') -> Dict:
+    """
+    Retrieve the rating history of a player, downsampled to at most the given number of points.
+
+    Args:
+        user_id (int): The ID of the player.
+        start (Optional[datetime]): Only include ratings from this timestamp (UTC).
+        end (Optional[datetime]): Only include ratings before this timestamp (UTC).
+        season (Optional[int]): Only include ratings of this season. The season rating is then used to select points.
+        points (int): The maximum number of points.
+        downsampling (str): 'lttb' or 'day', see the top of this module.
+
+    Returns:
+        dict: A dictionary with the following keys:
+            - 'total' (int): The number of ratings before downsampling.
+            - 'since' (list): The timestamps of the points (ISO format, UTC).
+            - 'rating' (list): The overall ratings.
+            - 'rating_season' (list): The season ratings.
+    """
+    series = cache.get(user_id)
+
+    positions = range(
+        bisect_left(series.since, start) if start is not None else 0,
+        bisect_left(series.since, end) if end is not None else len(series.since)
+    )
+    if season is not None:
+        positions = [i for i in positions if series.season[i] == season]
+    total = len(positions)
+
+    if downsampling == 'day':
+        positions = last_per_day(series.since, positions)
+    if len(positions) > points:
+        y = series.rating_season if season is not None else series.rating
+        positions = [positions[i] for i in lttb([series.seconds[i] for i in positions], [y[i] for i in positions], points)]
+
+    return {
+        'total': total,
+        'since': [series.since[i].isoformat() for i in positions],
+        'rating': [series.rating[i] for i in positions],
+        'rating_season': [series.rating_season[i] for i in positions],
+    }
+
+def parse_history_args(args: Mapping[str, str]) -> Dict:
+    """
+    Convert the query string of a history request (from, to, season, points, downsampling) to arguments of get_rating_history.
+
+    Raises:
+        ValueError: If one of the arguments is invalid.
+    """
+    downsampling = args.get('downsampling', 'lttb')
+    if downsampling not in DOWNSAMPLING:
+        raise ValueError(f'Unknown downsampling {downsampling}, choose from {", ".join(DOWNSAMPLING)}.')
+
+    return {
+        'start': player_state.normalize(datetime.fromisoformat(args['from'])) if args.get('from') else None,
+        'end': player_state.normalize(datetime.fromisoformat(args['to'])) if args.get('to') else None,
+        'season': int(args['season']) if args.get('season') else None,
+        'points': max(3, min(int(args.get('points', DEFAULT_POINTS)), MAX_POINTS)),
+        'downsampling': downsampling,
+    }
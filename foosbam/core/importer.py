@@ -0,0 +1,267 @@
+# BULK MATCH IMPORT
+# -----------------
+# Imports matches (with their results) from a CSV file, e.g. of league nights that were recorded on paper.
+# 1) Read and validate all rows: known players, four distinct players, valid scores, and a unique played_at.
+#    played_at is checked against the file itself and against the matches in the database (one query) with set lookups.
+# 2) Sort the matches on played_at
+# 3) Insert matches, participants, results (confirmed by the importing user) and ratings with bulk inserts, one transaction per chunk of matches.
+#    Ratings are calculated with the in-memory state of replay.RatingState, continuing from the state before the first match.
+#
+# Nothing is imported if any row is invalid. If matches were already played after the first imported match (i.e. the import is backdated),
+# the matches are inserted first and all matches from the first imported match onwards are rated again at the end (see rating.rerate_from).
+#
+# CSV columns: played_at, att_black, def_black, att_white, def_white, score_black, score_white
+# and optionally klinker_att_black, klinker_def_black, klinker_att_white, klinker_def_white, keeper_black, keeper_white (default 0).
+# Players are given by username or user id. played_at is in local time (like the add result form), unless it is marked as UTC.
+#
+# Because the results are confirmed right away, only ADMINS can upload a file at /import_matches (anyone can use flask import-matches).
+
+import csv
+from datetime import datetime, timezone
+from foosbam import db
+from foosbam.core import misc, player_state, seasons, standings, versions
+from foosbam.core.results import CONFIRMED
+from foosbam.models import Match, MatchParticipant, Result, User
+import sqlalchemy as sa
+from typing import Dict, Iterable, List, Optional
+
+CHUNK_SIZE = 1000
+ROLES = ['att_black', 'def_black', 'att_white', 'def_white']
+SCORES = ['score_black', 'score_white']
+EXTRAS = ['klinker_att_black', 'klinker_def_black', 'klinker_att_white', 'klinker_def_white', 'keeper_black', 'keeper_white']
+REQUIRED_COLUMNS = ['played_at'] + ROLES + SCORES
+
+class ImportedMatch:
+    __slots__ = ('line', 'id', 'played_at', 'season', *ROLES, *SCORES, *EXTRAS)
+
+    def __init__(self, line: int, played_at: datetime, players: List[int], values: Dict[str, int]):
+        self.line = line
+        self.id: Optional[int] = None
+        self.played_at = played_at
+        self.season = seasons.get_season_from_date(played_at)
+        self.att_black, self.def_black, self.att_white, self.def_white = players
+        for column in SCORES + EXTRAS:
+            setattr(self, column, values[column])
+
+    @property
+    def players(self) -> List[int]:
+        return [self.att_black, self.def_black, self.att_white, self.def_white]
+
+class ImportReport:
+    __slots__ = ('matches', 'errors', 'imported', 'rerated')
+
+    def __init__(self, matches: List[ImportedMatch], errors: List[str]):
+        self.matches = matches
+        self.errors = errors
+        self.imported = 0
+        self.rerated = False
+
+def get_player_lookup() -> Dict[str, int]:
+    """Map the username and the id (as text) of every user to the user id, so players can be resolved without queries."""
+    lookup = {}
+    for user_id, username in db.session.query(User.id, User.username):
+        lookup[username.lower()] = user_id
+        lookup[str(user_id)] = user_id
+    return lookup
+
+def parse_played_at(value: str, utc: bool) -> datetime:
+    """Parse a timestamp (e.g. '2024-03-14 20:15') to a UTC timestamp without timezone, as it is stored."""
+    played_at = datetime.fromisoformat(value.strip())
+    if not utc and played_at.tzinfo is None:
+        played_at = misc.change_timezone(played_at, 'Europe/Amsterdam', 'Etc/UTC')
+    return player_state.normalize(played_at)
+
+def parse_row(line: int, row: Dict[str, str], players: Dict[str, int], utc: bool) -> ImportedMatch:
+    """
+    Convert a CSV row to a match.
+
+    Raises:
+        ValueError: If the row is invalid, with a message for the user.
+    """
+    try:
+        played_at = parse_played_at(row['played_at'] or '', utc)
+    except ValueError:
+        raise ValueError(f'Line {line}: invalid played_at "{row["played_at"]}", use e.g. 2024-03-14 20:15.')
+
+    user_ids = []
+    for role in ROLES:
+        name = (row[role] or '').strip().lower()
+        if name not in players:
+            raise ValueError(f'Line {line}: unknown player "{row[role]}" for {role}.')
+        user_ids.append(players[name])
+
+    # Same rule as the add result form: four distinct players
+    if len(set(user_ids)) < 4:
+        raise ValueError(f'Line {line}: please select four distinct players.')
+
+    values = {}
+    for column in SCORES + EXTRAS:
+        value = (row.get(column) or '').strip()
+        if not value and column in EXTRAS:
+            value = '0'
+        try:
+            values[column] = int(value)
+        except ValueError:
+            raise ValueError(f'Line {line}: {column} should be a number, not "{value}".')
+        if values[column] < 0:
+            raise ValueError(f'Line {line}: {column} cannot be negative.')
+
+    try:
+        return ImportedMatch(line, played_at, user_ids, values)
+    except ValueError as e:
+        raise ValueError(f'Line {line}: {e}')
+
+def check_played_at(matches: List[ImportedMatch]) -> List[str]:
+    """
+    Check that every match has a unique played_at (1 foosball table, so no games can be played simultaneously),
+    both within the file and compared to the matches that are already in the database.
+    """
+    if not matches:
+        return []
+
+    existing = {
+        player_state.normalize(played_at)
+        for (played_at,) in db.session.query(Match.played_at).filter(
+            Match.played_at.between(min(m.played_at for m in matches), max(m.played_at for m in matches))
+        )
+    }
+
+    errors = []
+    seen = {}
+    for match in matches:
+        if match.played_at in existing:
+            errors.append(f'Line {match.line}: there already is a game at {match.played_at:%Y-%m-%d %H:%M:%S} (UTC).')
+        elif match.played_at in seen:
+            errors.append(f'Line {match.line}: same date and time as line {seen[match.played_at]}.')
+        else:
+            seen[match.played_at] = match.line
+    return errors
+
+def read_matches(lines: Iterable[str], utc: bool = False) -> ImportReport:
+    """
+    Read and validate matches from CSV. No data is written.
+
+    Args:
+        lines (iterable): The lines of the CSV file, e.g. an opened file.
+        utc (bool): Whether played_at is in UTC instead of local time (e.g. a file made with `flask export matches`).
+
+    Returns:
+        ImportReport: The valid matches, sorted on played_at, and an error message for every invalid row.
+    """
+    reader = csv.DictReader(lines)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        return ImportReport([], [f'Missing column(s): {", ".join(missing)}.'])
+
+    players = get_player_lookup()
+    matches = []
+    errors = []
+    for row in reader:
+        try:
+            matches.append(parse_row(reader.line_num, row, players, utc))
+        except ValueError as e:
+            errors.append(str(e))
+
+    errors += check_played_at(matches)
+    matches.sort(key=lambda m: m.played_at)
+    return ImportReport(matches, errors)
+
+def insert_chunk(chunk: List[ImportedMatch], created_by: int, created_at: datetime):
+    """Bulk insert the matches, participants and results of a chunk, and set the ids of the matches."""
+    db.session.execute(sa.insert(Match), [
+        {'played_at': m.played_at, 'season': m.season, **{role: getattr(m, role) for role in ROLES}}
+        for m in chunk
+    ])
+
+    # played_at is unique, so the new ids can be found by their timestamps (works for databases without RETURNING as well)
+    ids = {
+        player_state.normalize(played_at): match_id
+        for match_id, played_at in db.session.query(Match.id, Match.played_at).filter(
+            Match.played_at.between(chunk[0].played_at, chunk[-1].played_at)
+        )
+    }
+    for m in chunk:
+        m.id = ids[m.played_at]
+
+    db.session.execute(sa.insert(MatchParticipant), [
+        {'match_id': m.id, 'user_id': getattr(m, f'{role}_{team}'), 'role': role, 'team': team, 'played_at': m.played_at}
+        for m in chunk
+        for team in ['black', 'white']
+        for role in ['att', 'def']
+    ])
+    db.session.execute(sa.insert(Result), [
+        # Imported results are confirmed by the one who imports them, so they are rated right away
+        {'match_id': m.id, 'created_at': created_at, 'created_by': created_by, 'status': CONFIRMED,
+         'checked_at': created_at, 'checked_by': created_by,
+         **{column: getattr(m, column) for column in SCORES + EXTRAS}}
+        for m in chunk
+    ])
+    versions.bump_version(versions.MATCHES)
+
+def import_matches(matches: List[ImportedMatch], created_by: int, chunk_size: int = CHUNK_SIZE) -> bool:
+    """
+    Insert validated matches (see read_matches) and their ratings, committing every chunk_size matches.
+
+    Args:
+        matches (list): The matches to import, sorted on played_at.
+        created_by (int): The user id that is stored as the creator of the results.
+        chunk_size (int): Number of matches per transaction.
+
+    Returns:
+        bool: Whether later matches were rated again, because the import was backdated.
+    """
+    # replay uses numpy, so it is only imported when it is needed
+    from foosbam.core import rating, replay
+
+    if not matches:
+        return False
+
+    first_played_at = matches[0].played_at
+    version = versions.lock_version(versions.RATINGS)
+    backdated = db.session.query(Match.id).filter(Match.played_at > first_played_at).first() is not None
+    state = None if backdated else replay.load_state_before(db, first_played_at, {m.season for m in matches})
+    rerate_since = first_played_at
+    created_at = player_state.normalize(datetime.now(timezone.utc))
+
+    for start in range(0, len(matches), chunk_size):
+        chunk = matches[start:start + chunk_size]
+
+        # Every chunk is a transaction, so results may be added in between. Then the state is outdated,
+        # and the rest of the import is rated again at the end, like a backdated import.
+        if start > 0 and versions.lock_version(versions.RATINGS) != version and state is not None:
+            state = None
+            backdated = True
+            rerate_since = chunk[0].played_at
+        insert_chunk(chunk, created_by, created_at)
+
+        if state is not None:
+            rows = replay.replay_matches(state, chunk)
+            replay.insert_ratings(db, rows)
+            standings.update_after_replay(rows, rows)
+            version = versions.bump_version(versions.RATINGS)
+        db.session.commit()
+
+    if backdated:
+        rating.rerate_from(db, rerate_since)
+        db.session.commit()
+    return backdated
+
+def import_csv(lines: Iterable[str], created_by: int, utc: bool = False, chunk_size: int = CHUNK_SIZE, dry_run: bool = False) -> ImportReport:
+    """
+    Validate and import matches from CSV. If any row is invalid, nothing is imported.
+
+    Args:
+        lines (iterable): The lines of the CSV file.
+        created_by (int): The user id that is stored as the creator of the results.
+        utc (bool): Whether played_at is in UTC instead of local time.
+        chunk_size (int): Number of matches per transaction.
+        dry_run (bool): Only validate the file.
+
+    Returns:
+        ImportReport: The matches, the errors and the number of imported matches.
+    """
+    report = read_matches(lines, utc)
+    if not report.errors and not dry_run:
+        report.rerated = import_matches(report.matches, created_by, chunk_size)
+        report.imported = len(report.matches)
+    return report
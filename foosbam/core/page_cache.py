@@ -0,0 +1,232 @@
+# PAGE CACHE
+# ----------
+# Pages that only change when data changes (rankings, results, match pages) are served with an ETag and Last-Modified header
+# based on the data versions (see versions.py): adding a result bumps the 'matches' version, rating it the 'ratings' version,
+# changing a username the 'users' version.
+# 1) Read the versions (one primary key lookup)
+# 2) If the browser already has this version of the page (If-None-Match / If-Modified-Since), answer 304 Not Modified,
+#    without running the queries of the page or rendering its template
+# 3) Otherwise return the rendered page from the page store, or render it and put it in the store
+#
+# Pages are stored per (endpoint, path with query string, user, versions), because the navigation bar depends on the user.
+# Pages with flashed messages are neither served from nor put in the store. Neither are pages with a form (e.g. the
+# check form on a match page), because its CSRF token belongs to the session and expires: those are sent without ETag
+# and with Cache-Control: no-store, so the browser can't revalidate a stale form either.
+#
+# The store is chosen with the PAGE_CACHE setting:
+# - 'memory' (default): LRU in the process, with at most PAGE_CACHE_SIZE pages
+# - 'file': files in PAGE_CACHE_DIR, shared by all processes on the machine (e.g. gunicorn workers)
+# - 'redis': a Redis-compatible server at PAGE_CACHE_URL, shared by all processes (needs the optional redis package)
+# - 'none': no store, only the ETag/Last-Modified handling
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from foosbam import metrics
+from foosbam.core import versions
+from functools import wraps
+import hashlib
+import os
+import tempfile
+from typing import Callable, Iterable, Optional
+from werkzeug.http import is_resource_modified
+
+PAGE_VERSIONS = [versions.MATCHES, versions.RATINGS, versions.USERS]
+PRUNE_EVERY = 100
+
+class MemoryStore:
+    """LRU store in the memory of the process."""
+
+    def __init__(self, size: int = 1000):
+        self.pages: OrderedDict = OrderedDict()
+        self.size = size
+
+    def get(self, key: str) -> Optional[bytes]:
+        page = self.pages.get(key)
+        if page is not None:
+            self.pages.move_to_end(key)
+        return page
+
+    def set(self, key: str, page: bytes):
+        self.pages[key] = page
+        self.pages.move_to_end(key)
+        if len(self.pages) > self.size:
+            self.pages.popitem(last=False)
+
+    def clear(self):
+        self.pages.clear()
+
+class FileStore:
+    """
+    Store with one file per page, shared by all processes that use the same directory.
+    Files are written to a temporary file first and then renamed, so other processes never read a partly written page.
+    Every PRUNE_EVERY writes, the oldest files are removed if there are more than size files.
+    """
+
+    def __init__(self, directory: str, size: int = 1000):
+        self.directory = directory
+        self.size = size
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.html')
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, page: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(page)
+        os.replace(temp_path, self.path(key))
+
+        self.writes += 1
+        if self.writes % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.html')]
+        if len(entries) <= self.size:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.size]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass    # already removed by another process
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.html'):
+                os.remove(entry.path)
+
+class RedisStore:
+    """
+    Store on a Redis-compatible server. Pages expire after ttl seconds, old versions are never read again.
+    If the server cannot be reached, pages are rendered as if they were not in the store.
+    """
+
+    def __init__(self, url: str, ttl: int = 24 * 60 * 60):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('PAGE_CACHE=redis needs the redis package (pip install redis).')
+        self.client = redis.Redis.from_url(url)
+        self.errors = (redis.RedisError,)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get(f'foosbam:page:{key}')
+        except self.errors as e:
+            current_app.logger.warning('Page cache unavailable: %s', e)
+            return None
+
+    def set(self, key: str, page: bytes):
+        try:
+            self.client.set(f'foosbam:page:{key}', page, ex=self.ttl)
+        except self.errors as e:
+            current_app.logger.warning('Page cache unavailable: %s', e)
+
+    def clear(self):
+        for key in self.client.scan_iter('foosbam:page:*'):
+            self.client.delete(key)
+
+def create_store(config):
+    """
+    Create the page store that is configured with PAGE_CACHE.
+
+    Raises:
+        ValueError: If PAGE_CACHE is unknown.
+    """
+    kind = config.get('PAGE_CACHE', 'memory')
+    size = config.get('PAGE_CACHE_SIZE', 1000)
+    if kind == 'memory':
+        return MemoryStore(size)
+    if kind == 'file':
+        return FileStore(config['PAGE_CACHE_DIR'], size)
+    if kind == 'redis':
+        return RedisStore(config['PAGE_CACHE_URL'])
+    if kind == 'none':
+        return None
+    raise ValueError(f'Unknown PAGE_CACHE {kind}, choose from memory, file, redis or none.')
+
+def init_app(app):
+    """Create the page store of an app, so a wrong PAGE_CACHE setting is noticed when the app starts."""
+    app.extensions['page_cache'] = create_store(app.config)
+
+def get_store():
+    return current_app.extensions.get('page_cache')
+
+def get_page_key(version_state) -> str:
+    user_id = current_user.get_id() if current_user.is_authenticated else None
+    versions_part = ','.join(f'{name}={version}' for name, (version, _) in sorted(version_state.items()))
+    key = f'{request.endpoint}|{request.full_path}|{user_id}|{versions_part}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def get_last_modified(version_state) -> Optional[datetime]:
+    updated = [updated_at for _, updated_at in version_state.values() if updated_at is not None]
+    if not updated:
+        return None
+    return max(updated).replace(tzinfo=timezone.utc, microsecond=0)
+
+def cached_page(names: Iterable[str] = PAGE_VERSIONS, bypass: Optional[Callable[..., bool]] = None):
+    """
+    Decorator for views that only change when the given data sets change. Apply it below login_required.
+    Views that return something else than a rendered template (e.g. a redirect) or raise an error are not cached.
+
+    Args:
+        names (iterable): The data sets (see versions.py) the page depends on.
+        bypass (callable): Called with the arguments of the view; if it returns True the page is rendered without ETag
+                           and not stored, and the browser may not store it either (e.g. pages with a form and its CSRF token).
+    """
+    names = list(names)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Flashed messages are shown (and removed) when a page is rendered, so such pages are always rendered
+            if session.get('_flashes'):
+                metrics.inc('foosbam_cache_requests_total', cache='page', result='bypass')
+                return view(*args, **kwargs)
+            if bypass is not None and bypass(*args, **kwargs):
+                metrics.inc('foosbam_cache_requests_total', cache='page', result='bypass')
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.private = True
+                response.cache_control.no_store = True
+                return response
+
+            version_state = versions.get_versions(names)
+            key = get_page_key(version_state)
+            last_modified = get_last_modified(version_state)
+
+            if not is_resource_modified(request.environ, etag=key, last_modified=last_modified):
+                metrics.inc('foosbam_cache_requests_total', cache='page', result='not_modified')
+                response = make_response('', 304)
+            else:
+                store = get_store()
+                page = store.get(key) if store is not None else None
+                metrics.inc('foosbam_cache_requests_total', cache='page', result='hit' if page is not None else 'miss')
+                if page is None:
+                    page = view(*args, **kwargs)
+                    if not isinstance(page, str):
+                        return page
+                    page = page.encode('utf-8')
+                    if store is not None:
+                        store.set(key, page)
+                response = make_response(page)
+
+            response.set_etag(key)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
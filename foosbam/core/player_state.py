@@ -0,0 +1,158 @@
+# PLAYER STATE STORE
+# ------------------
+# Process-level store with, for every player, the latest overall rating, the latest rating per season and the match count.
+# Predictions and the team generator only need this state, so they do not have to query the ratings table for every player.
+# (Adding a result reads the same values from the standings of its players instead, see standings.get_current_standings.)
+#
+# Every transaction that adds ratings bumps the 'ratings' version in the data_versions table. Before the store is used,
+# its version is compared to that row: if another process (e.g. another gunicorn worker) added ratings in the meantime,
+# the store is reloaded. Ratings added in this process are applied to the store after their transaction is committed.
+
+from datetime import datetime, timezone
+from foosbam import db
+from foosbam.core import versions
+from foosbam.models import Rating
+import sqlalchemy as sa
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_RATING = 1500
+
+class PlayerState:
+    __slots__ = ('rating', 'since', 'season_ratings', 'match_count', 'last_played')
+
+    def __init__(self):
+        self.rating = DEFAULT_RATING
+        self.since = datetime.min
+        self.season_ratings: Dict[int, tuple] = {}  # season -> (since, rating_season)
+        self.match_count = 0
+        self.last_played = datetime.min
+
+    def get_season_rating(self, season: int) -> int:
+        # A player that has not played in a season yet starts with the default rating
+        return self.season_ratings.get(season, (None, DEFAULT_RATING))[1]
+
+    def apply(self, since: datetime, season: int, rating: int, rating_season: Optional[int], is_match: bool):
+        if since >= self.since:
+            self.rating = rating
+            self.since = since
+        if rating_season is not None and since >= self.season_ratings.get(season, (datetime.min,))[0]:
+            self.season_ratings[season] = (since, rating_season)
+        if is_match:
+            self.match_count += 1
+            self.last_played = max(self.last_played, since)
+
+class PlayerStateStore:
+    def __init__(self):
+        self.players: Dict[int, PlayerState] = {}
+        self.version: Optional[int] = None
+        self.database: Optional[str] = None
+
+    def load(self, version: int):
+        """Fill the store from the ratings and matches tables."""
+        players: Dict[int, PlayerState] = {}
+
+        latest = db.session.query(
+            Rating.user_id,
+            Rating.season,
+            sa.func.max(Rating.since).label('max_since')
+        ).group_by(
+            Rating.user_id,
+            Rating.season
+        ).subquery()
+
+        # Sorted on since (and id, in case of equal timestamps), so the latest rating of each player is applied last
+        ratings = db.session.query(
+            Rating.user_id,
+            Rating.since,
+            Rating.season,
+            Rating.rating,
+            Rating.rating_season
+        ).join(
+            latest,
+            sa.and_(Rating.user_id == latest.c.user_id,
+                    Rating.season == latest.c.season,
+                    Rating.since == latest.c.max_since)
+        ).order_by(
+            Rating.since,
+            Rating.id
+        )
+        for user_id, since, season, rating, rating_season in ratings:
+            players.setdefault(user_id, PlayerState()).apply(since, season, rating, rating_season, False)
+
+        # Matches are counted by their ratings, like the updates of the store. The matches table cannot be used,
+        # because the store may be loaded while a new match has been added, but not yet rated.
+        counts = db.session.query(
+            Rating.user_id,
+            sa.func.count(),
+            sa.func.max(Rating.since)
+        ).filter(
+            Rating.match_id.is_not(None)
+        ).group_by(
+            Rating.user_id
+        )
+        for user_id, match_count, last_played in counts:
+            player = players.setdefault(user_id, PlayerState())
+            player.match_count = match_count
+            player.last_played = last_played
+
+        self.players = players
+        self.version = version
+        self.database = str(db.engine.url)
+
+    def refresh(self):
+        """Reload the store if ratings were added by another process (or were never loaded)."""
+        version = versions.get_version(versions.RATINGS)
+        if version != self.version or str(db.engine.url) != self.database:
+            self.load(version)
+
+    def get(self, user_id: int) -> PlayerState:
+        return self.players.get(user_id) or PlayerState()
+
+store = PlayerStateStore()
+
+def normalize(dt: datetime) -> datetime:
+    """Timestamps are stored in UTC, without timezone. Convert aware timestamps so they can be compared."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def get_players(user_ids: Iterable[int]) -> List[PlayerState]:
+    """Get the current state of the given players, reloading the store first if it is outdated."""
+    store.refresh()
+    return [store.get(user_id) for user_id in user_ids]
+
+def record(ratings: List[Rating]):
+    """
+    Register ratings that are added in the current transaction.
+    This bumps the ratings version (in the same transaction) and updates the store once the transaction is committed.
+    """
+    new_version = versions.bump_version(versions.RATINGS)
+    db.session.info.setdefault('player_state_base_version', new_version - 1)
+    updates = db.session.info.setdefault('player_state_updates', [])
+    updates.extend(
+        (r.user_id, normalize(r.since or datetime.now(timezone.utc)), r.season, r.rating, r.rating_season, r.match_id is not None)
+        for r in ratings
+    )
+    db.session.info['player_state_version'] = new_version
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _apply_updates(session):
+    updates = session.info.pop('player_state_updates', None)
+    base_version = session.info.pop('player_state_base_version', None)
+    new_version = session.info.pop('player_state_version', None)
+    if new_version is None:
+        return
+
+    # Only apply the updates if no other process changed the ratings since the store was loaded,
+    # otherwise the store is reloaded the next time it is used.
+    if store.version is not None and store.version == base_version:
+        for user_id, since, season, rating, rating_season, is_match in updates:
+            store.players.setdefault(user_id, PlayerState()).apply(since, season, rating, rating_season, is_match)
+        store.version = new_version
+    else:
+        store.version = None
+
+@sa.event.listens_for(db.session, 'after_rollback')
+def _discard_updates(session):
+    for key in ['player_state_updates', 'player_state_base_version', 'player_state_version']:
+        session.info.pop(key, None)
@@ -1,11 +1,36 @@
-from foosbam import db
-from foosbam.core import misc
-from foosbam.models import Rating, User
-import pandas as pd
+from foosbam import db, metrics
+from foosbam.core import views
+from foosbam.models import PlayerStanding, Rating, SeasonStanding, User
 from sqlalchemy import and_, func
 from sqlalchemy.orm import aliased
 
+@metrics.timed('foosbam_ranking_query_seconds', ranking='all_time')
+def query_current_ranking():
+    # The current rating and match count of every player are kept in the player_standings table (see standings.py)
+    return db.session.query(
+        PlayerStanding.rating_since,
+        User.id,
+        User.username,
+        PlayerStanding.rating
+    ).join(
+        User,
+        PlayerStanding.user_id == User.id
+    ).filter(
+        PlayerStanding.match_count >= 5           # only include ratings for players with a match count of 5 and higher
+    ).order_by(
+        PlayerStanding.rating.desc()
+    ).order_by(
+        PlayerStanding.rating_since
+    ).all()
+
 def get_current_ranking():
+    return views.create_ranking(query_current_ranking())
+
+def query_current_ranking_from_ratings():
+    """
+    Determine the current ranking directly from the ratings table, by searching the latest rating of every player.
+    This is how the ranking was calculated before the player_standings table existed; it is used to check the standings.
+    """
     r1 = aliased(Rating)
     r2 = aliased(Rating)
 
@@ -17,7 +42,7 @@ def get_current_ranking():
         r1.user_id
     ).subquery()
 
-    ranking = db.session.query(
+    return db.session.query(
         r1.since,
         User.id,
         User.username,
@@ -45,36 +70,34 @@ def get_current_ranking():
         r1.since
     ).all()
 
-    ranking_as_dict = [
-        dict(
-            zip(
-                [
-                    'since',
-                    'user_id',
-                    'player',
-                    'rating',
-                ],
-                rank,
-            )
-        )
-        for rank in ranking
-    ]
-
-    df = pd.DataFrame.from_records(ranking_as_dict)
-
-    # Add rank column
-    df['rank'] = df['rating'].rank(method='min', ascending=False).astype(int)
-
-    # Change since column to Amsterdam time (for frontend) and in desired format
-    df['since'] = df['since'].apply(lambda x : misc.change_timezone(x, 'Etc/UTC', 'Europe/Amsterdam'))
-    df['since'] = df['since'].dt.strftime('%Y-%m-%d %H:%M')
-
-    # Use the title function on the player names, so they get capitals
-    df['player'] = df['player'].str.title()
-
-    return df
+@metrics.timed('foosbam_ranking_query_seconds', ranking='season')
+def query_season_ranking(season):
+    # The latest season rating and match count of every player are kept in the season_standings table (see standings.py)
+    return db.session.query(
+        SeasonStanding.last_played,
+        User.id,
+        User.username,
+        SeasonStanding.rating,
+    ).join(
+        User,
+        SeasonStanding.user_id == User.id,
+    ).filter(
+        SeasonStanding.season == season,
+        SeasonStanding.match_count >= 5           # only include ratings for players with a match count of 5 and higher
+    ).order_by(
+        SeasonStanding.rating.desc()
+    ).order_by(
+        SeasonStanding.last_played
+    ).all()
 
 def get_season_ranking(season):
+    return views.create_ranking(query_season_ranking(season))
+
+def query_season_ranking_from_ratings(season):
+    """
+    Determine the ranking of a season directly from the ratings table.
+    This is how the season ranking was calculated before the season_standings table existed; it is used to check the standings.
+    """
     r1 = aliased(Rating)
 
     # In this subquery we first get the latest rating for the given season for each user.
@@ -90,7 +113,7 @@ def get_season_ranking(season):
     ).subquery()
 
     # Join the actual rating and the User table to the subquery
-    ranking = db.session.query(
+    return db.session.query(
         r1.since,
         User.id,
         User.username,
@@ -109,34 +132,3 @@ def get_season_ranking(season):
     ).order_by(
         r1.since
     ).all()
-
-    ranking_as_dict = [
-        dict(
-            zip(
-                [
-                    'since',
-                    'user_id',
-                    'player',
-                    'rating',
-                ],
-                rank,
-            )
-        )
-        for rank in ranking
-    ]
-
-    df = pd.DataFrame.from_records(ranking_as_dict)
-
-    if len(df) > 0:
-        # Add rank column
-        df['rank'] = df['rating'].rank(method='min', ascending=False).astype(int)
-
-        # Change since column to Amsterdam time (for frontend) and in desired format
-        df['since'] = df['since'].apply(lambda x : misc.change_timezone(x, 'Etc/UTC', 'Europe/Amsterdam'))
-        df['since'] = df['since'].dt.strftime('%Y-%m-%d %H:%M')
-
-        # Use the title function on the player names, so they get capitals
-        df['player'] = df['player'].str.title()
-
-    return df
-
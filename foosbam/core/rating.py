@@ -1,6 +1,7 @@
 from datetime import datetime
-from foosbam.core import elo
-from foosbam.models import Match, Rating, Result, User 
+from foosbam.core import details, elo, player_state, standings, versions
+from foosbam.models import Match, Rating, User
+import sqlalchemy as sa
 
 def add_initial_ratings(db):
     # add inital rating for every user,
@@ -20,34 +21,125 @@ def add_initial_ratings(db):
     ratings = [Rating(user_id=pid, rating=1500, since=since_date, season=0, rating_season=1500) for pid in players_without_rating]
 
     # add initial ratings to database
-    db.session.add_all(ratings)
+    add_ratings(db, ratings)
     db.session.commit()
 
+def add_ratings(db, ratings):
+    # add ratings to the session and keep the player state store and standings up to date (in the same transaction)
+    db.session.add_all(ratings)
+    player_state.record(ratings)
+    standings.update(ratings)
+
+def add_match_ratings(db, match, result):
+    # calculate the ratings of a newly added match.
+    # if matches were already played after this match (i.e. it is backdated), their ratings are no longer correct,
+    # so then all matches from this match onwards are rated again.
+    # results that are submitted at the same time are rated one after the other: the ratings lock is taken first,
+    # so the check for later matches and the standings used for the new ratings include everything committed before.
+    versions.lock_version(versions.RATINGS)
+    later_match = db.session.query(Match.id).filter(Match.played_at > match.played_at).first()
+    if later_match is not None:
+        rerate_from(db, match.played_at)
+        return
+
+    add_latest_match_ratings(db, match, result)
+
+def add_latest_match_ratings(db, match, result):
+    # calculate the ratings of a match that was played after every rated match, on top of the standings of its players.
+    # the caller holds the ratings lock.
+    user_ids = [match.att_black, match.def_black, match.att_white, match.def_white]
+    ratings = elo.construct_ratings(
+        user_ids = user_ids,
+        match_id = match.id,
+        played_at = match.played_at,
+        score_black = result.score_black,
+        score_white = result.score_white,
+    )
+    add_ratings(db, ratings)
+
+def get_last_rated(db):
+    # played_at of the latest match that has ratings (None if no match was rated yet), found with the index on since
+    return db.session.scalar(
+        sa.select(Rating.since).where(Rating.match_id.is_not(None)).order_by(Rating.since.desc()).limit(1)
+    )
+
+def rerate_from(db, since):
+    # rate all matches played at or after since again, starting from the ratings just before since.
+    # only ratings that changed are rewritten, so the cost depends on the number of matches after since, not on the full history.
+    # ratings of matches whose result is no longer confirmed (i.e. disputed) are removed.
+    # (replay uses numpy, so it is only imported when it is needed)
+    from foosbam.core import replay
+
+    ## replay the matches on top of the state just before since (no other ratings can be written until the transaction ends)
+    versions.lock_version(versions.RATINGS)
+    matches = replay.load_matches(db, since=since).all()
+    state = replay.load_state_before(db, since, {m.season for m in matches})
+    rows = replay.replay_matches(state, matches)
+
+    ## compare with the ratings that are already stored
+    existing = {
+        (r.match_id, r.user_id): r
+        for r in db.session.query(
+            Rating.id,
+            Rating.match_id,
+            Rating.user_id,
+            Rating.season,
+            Rating.previous_rating,
+            Rating.rating,
+            Rating.previous_rating_season,
+            Rating.rating_season
+        ).filter(
+            Rating.since >= since,
+            Rating.match_id.is_not(None)
+        )
+    }
+    changed_rows = []
+    new_rows = []
+    for row in rows:
+        old = existing.get((row['match_id'], row['user_id']))
+        if old is None:
+            new_rows.append(row)
+        elif (old.previous_rating, old.rating, old.previous_rating_season, old.rating_season) != \
+                (row['previous_rating'], row['rating'], row['previous_rating_season'], row['rating_season']):
+            changed_rows.append({'id': old.id, **row})
+    replayed = {(row['match_id'], row['user_id']) for row in rows}
+    removed = [old for key, old in existing.items() if key not in replayed]
+
+    ## write changed and new ratings, remove ratings of disputed results, and keep standings and player states up to date
+    if changed_rows:
+        db.session.execute(sa.update(Rating), changed_rows)
+    if removed:
+        db.session.execute(sa.delete(Rating).where(Rating.id.in_([old.id for old in removed])))
+    if changed_rows or removed:
+        details.record_rerated_matches({row['match_id'] for row in changed_rows} | {old.match_id for old in removed})
+    replay.insert_ratings(db, new_rows)
+    standings.update_after_replay(rows, new_rows)
+    if removed:
+        # players may have lost their latest rating, so their standings are recalculated from the ratings that are left
+        user_ids = {old.user_id for old in removed}
+        standings.rebuild_players(user_ids)
+        standings.rebuild_seasons({old.season for old in removed}, user_ids)
+    versions.bump_version(versions.RATINGS)
+
+    return changed_rows, new_rows
+
 def create_existing_ratings(db):
-    # loop over all matches already played and add ratings for these matches
-
-    ## get already played matches and results (in order!)
-
-    matches = db.session.query(
-        Match.id,
-        Match.played_at,
-        Match.att_black,              
-        Match.def_black,                
-        Match.att_white,              
-        Match.def_white,                
-        Result.score_black,     
-        Result.score_white,       
-    ).join(
-        Match,
-        Result.match_id == Match.id
-    ).order_by('played_at')
-
-    for match in matches:
-        players = [match.att_black, match.def_black, match.att_white, match.def_white]
-        df = elo.construct_dataframe(players, match.id, match.played_at, match.score_black, match.score_white)
-
-        db.session.add_all(list(df['rating_obj']))
+    # replay all matches already played and add ratings for these matches.
+    # the state of all players is kept in memory (see replay.py), so only a handful of queries are needed.
+    from foosbam.core import replay
+
+    ## get the current ratings of every player (normally the initial ratings)
+    versions.lock_version(versions.RATINGS)
+    state = replay.load_state(db)
+
+    ## get already played matches and results (in order!) and calculate their ratings
+    rows = replay.replay_matches(state, replay.load_matches(db))
+
+    replay.insert_ratings(db, rows)
 
+    ## the ratings were bulk inserted, so rebuild the standings and let the player state store reload them
+    standings.rebuild()
+    versions.bump_version(versions.RATINGS)
     db.session.commit()
 
 
@@ -0,0 +1,252 @@
+# RATING JOBS
+# -----------
+# Confirming a result (see confirmation.py) does not rate it in the request: the new status of the result is committed
+# together with a job in the rating_jobs table, and the ratings are calculated afterwards:
+# - by a worker process (`flask rating-worker`), which polls the queue every RATING_WORKER_POLL seconds and starts rating once
+#   no job has been added for RATING_BATCH_DELAY seconds (or the oldest job waits RATING_BATCH_MAX_WAIT seconds), or
+# - in the request itself, right after the commit, if no worker has been seen for RATING_WORKER_TIMEOUT seconds.
+#
+# Both take the ratings lock (see versions.lock_version) and rate all queued jobs in a single transaction, in order of played_at:
+# - a few confirmed results that were all played after the last rated match (the usual case): one by one on top of the standings
+#   of their players
+# - otherwise: in one replay from the earliest played_at among them (see rating.rerate_from), which also re-rates the later matches
+#   and removes the ratings of results that are no longer confirmed. rerate_from only writes ratings that are new or changed,
+#   so a job whose match was already rated (e.g. by a bulk import) is simply marked as finished.
+#
+# Finished jobs are kept for a day, for the latency metrics (see get_metrics).
+
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from foosbam import db, metrics
+from foosbam.core import player_state, versions
+from foosbam.core.results import CONFIRMED
+from foosbam.models import Match, RatingJob, RatingWorker, Result
+import math
+import os
+import socket
+import sqlalchemy as sa
+import time
+from typing import Iterable, List, Optional
+
+METRICS_WINDOW = 60 * 60
+KEEP_FINISHED = timedelta(days=1)
+PRUNE_EVERY = 60 * 60
+# Up to this many results played after the last rated match are rated one by one (about 15 ms each, with 50,000 matches),
+# more in one replay (a fixed 35 ms to load the state of all players, then about 1 ms per match)
+INCREMENTAL_JOBS = 3
+
+class QueueMetrics:
+    """
+    State of the queue: the number of queued jobs and the age of the oldest one (seconds), the number of running workers,
+    and the latency (seconds from queued to rated) of the jobs finished in the last window seconds.
+    """
+    __slots__ = ('depth', 'oldest_age', 'workers', 'window', 'finished', 'finished_inline', 'latency_p50', 'latency_p95', 'latency_max')
+
+    def __init__(self, depth: int, oldest_age: Optional[float], workers: int, window: int, latencies: List[float], finished_inline: int):
+        self.depth = depth
+        self.oldest_age = oldest_age
+        self.workers = workers
+        self.window = window
+        self.finished = len(latencies)
+        self.finished_inline = finished_inline
+        self.latency_p50 = percentile(latencies, 50)
+        self.latency_p95 = percentile(latencies, 95)
+        self.latency_max = max(latencies, default=None)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, None if there are no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * p / 100) - 1)]
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def enqueue(match_ids: Iterable[int]):
+    """Queue the rating of the given matches (e.g. because their result was confirmed) in the current transaction. The caller commits."""
+    now = utcnow()
+    db.session.add_all(RatingJob(match_id=match_id, created_at=now) for match_id in match_ids)
+    # The status of the results is shown before they are rated
+    versions.bump_version(versions.MATCHES)
+
+def query_queued():
+    """The queued jobs with their match and result, in order of played_at."""
+    return sa.select(
+        RatingJob.id.label('job_id'),
+        Match.id,
+        Match.played_at,
+        Match.att_black,
+        Match.def_black,
+        Match.att_white,
+        Match.def_white,
+        Result.score_black,
+        Result.score_white,
+        Result.status
+    ).join(
+        Match,
+        Match.id == RatingJob.match_id
+    ).join(
+        Result,
+        Result.match_id == Match.id
+    ).where(
+        RatingJob.finished_at.is_(None)
+    ).order_by(
+        Match.played_at
+    )
+
+def get_queue_depth() -> int:
+    return db.session.scalar(sa.select(sa.func.count()).select_from(RatingJob).where(RatingJob.finished_at.is_(None)))
+
+def process_jobs(processed_by: str) -> int:
+    """
+    Rate all queued jobs in one replay and mark them as finished, in the current transaction. The caller commits.
+
+    Args:
+        processed_by (str): Who rated the jobs: 'worker' or 'inline'.
+
+    Returns:
+        int: The number of jobs that were rated.
+    """
+    from foosbam.core import rating
+
+    # The queue is read after the lock is taken, so it includes the jobs that were committed while waiting for it
+    versions.lock_version(versions.RATINGS)
+    jobs = db.session.execute(query_queued().with_for_update(of=RatingJob)).all()
+    if not jobs:
+        return 0
+
+    # A result can be confirmed and disputed again before it is rated, then it has several jobs
+    matches = list({job.id: job for job in jobs}.values())
+    last_rated = rating.get_last_rated(db)
+    appended = last_rated is None or player_state.normalize(jobs[0].played_at) > player_state.normalize(last_rated)
+    started = time.perf_counter()
+    if appended and len(matches) <= INCREMENTAL_JOBS and all(match.status == CONFIRMED for match in matches):
+        for match in matches:
+            rating.add_latest_match_ratings(db, match, match)
+        method = 'incremental'
+    else:
+        rating.rerate_from(db, jobs[0].played_at)
+        method = 'replay'
+    metrics.observe('foosbam_rating_duration_seconds', time.perf_counter() - started, method=method)
+    db.session.execute(
+        sa.update(RatingJob).where(RatingJob.id.in_([job.job_id for job in jobs])).values(finished_at=utcnow(), processed_by=processed_by)
+    )
+    return len(jobs)
+
+def is_ready(delay: float, max_wait: float) -> bool:
+    """Whether there are queued jobs, and either no job was added in the last delay seconds, or the oldest waits max_wait seconds."""
+    oldest, newest = db.session.execute(
+        sa.select(sa.func.min(RatingJob.created_at), sa.func.max(RatingJob.created_at)).where(RatingJob.finished_at.is_(None))
+    ).one()
+    if oldest is None:
+        return False
+    now = utcnow()
+    return newest <= now - timedelta(seconds=delay) or oldest <= now - timedelta(seconds=max_wait)
+
+def worker_running(timeout: Optional[int] = None) -> bool:
+    """Whether a worker was seen in the last timeout seconds (default RATING_WORKER_TIMEOUT)."""
+    timeout = timeout if timeout is not None else current_app.config['RATING_WORKER_TIMEOUT']
+    seen_after = utcnow() - timedelta(seconds=timeout)
+    return db.session.scalar(sa.select(sa.exists().where(RatingWorker.seen_at >= seen_after)))
+
+def rate_if_no_worker() -> int:
+    """
+    Rate the queued jobs in this request if no worker is running. The caller has committed the job, so if rating fails
+    (e.g. the database is locked for too long), the job stays queued for the next request or worker.
+    """
+    if worker_running():
+        return 0
+    try:
+        rated = process_jobs('inline')
+        db.session.commit()
+    except sa.exc.OperationalError as e:
+        db.session.rollback()
+        current_app.logger.warning('Rating queued results failed, they stay queued: %s', e)
+        return 0
+    return rated
+
+def get_metrics(window: int = METRICS_WINDOW) -> QueueMetrics:
+    now = utcnow()
+    oldest = db.session.scalar(sa.select(sa.func.min(RatingJob.created_at)).where(RatingJob.finished_at.is_(None)))
+    workers = db.session.scalar(
+        sa.select(sa.func.count()).select_from(RatingWorker).where(
+            RatingWorker.seen_at >= now - timedelta(seconds=current_app.config['RATING_WORKER_TIMEOUT'])
+        )
+    )
+    finished = db.session.execute(
+        sa.select(RatingJob.created_at, RatingJob.finished_at, RatingJob.processed_by).where(
+            RatingJob.finished_at >= now - timedelta(seconds=window)
+        )
+    ).all()
+    return QueueMetrics(
+        depth=get_queue_depth(),
+        oldest_age=(now - oldest).total_seconds() if oldest is not None else None,
+        workers=workers,
+        window=window,
+        latencies=[(finished_at - created_at).total_seconds() for created_at, finished_at, _ in finished],
+        finished_inline=sum(processed_by == 'inline' for _, _, processed_by in finished),
+    )
+
+def prune_finished(keep: timedelta = KEEP_FINISHED) -> int:
+    """Remove jobs that finished longer than keep ago. The caller commits."""
+    return db.session.execute(sa.delete(RatingJob).where(RatingJob.finished_at < utcnow() - keep)).rowcount
+
+def beat(name: str):
+    """Register that the worker is running. The caller commits."""
+    now = utcnow()
+    updated = db.session.execute(sa.update(RatingWorker).where(RatingWorker.name == name).values(seen_at=now)).rowcount
+    if updated == 0:
+        db.session.add(RatingWorker(name=name, started_at=now, seen_at=now))
+
+def run_worker(poll: Optional[float] = None, once: bool = False, log=print):
+    """
+    Rate queued jobs until interrupted (or until the queue is empty, with once: then without waiting for more jobs).
+    The worker registers itself every few seconds, so requests leave the rating to it while it runs.
+    """
+    poll = poll if poll is not None else current_app.config['RATING_WORKER_POLL']
+    delay = 0 if once else current_app.config['RATING_BATCH_DELAY']
+    max_wait = current_app.config['RATING_BATCH_MAX_WAIT']
+    heartbeat = current_app.config['RATING_WORKER_TIMEOUT'] / 3
+    name = f'{socket.gethostname()}:{os.getpid()}'[:128]
+    last_beat = last_prune = -math.inf
+
+    try:
+        while True:
+            now = time.monotonic()
+            try:
+                if now - last_beat >= heartbeat:
+                    beat(name)
+                    db.session.commit()
+                    last_beat = now
+                if now - last_prune >= PRUNE_EVERY:
+                    prune_finished()
+                    db.session.commit()
+                    last_prune = now
+
+                # Only take the ratings lock if there is something to rate, and confirmations stopped coming in
+                rated = 0
+                if is_ready(delay, max_wait):
+                    started = time.perf_counter()
+                    rated = process_jobs('worker')
+                    db.session.commit()
+                    if rated:
+                        log(f'Rated {rated} queued result(s) in {(time.perf_counter() - started) * 1000:.0f} ms.')
+                else:
+                    db.session.rollback()    # end the read transaction, so the next poll sees new jobs
+            except sa.exc.OperationalError as e:
+                db.session.rollback()
+                current_app.logger.warning('Rating worker: %s', e)
+                rated = 0
+
+            if once and not rated:
+                return
+            if not rated:
+                time.sleep(poll)
+    finally:
+        db.session.rollback()
+        db.session.execute(sa.delete(RatingWorker).where(RatingWorker.name == name))
+        db.session.commit()
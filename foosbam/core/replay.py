@@ -0,0 +1,197 @@
+# BATCH RATING REPLAY
+# -------------------
+# Instead of querying the latest ratings and match counts for every match (see elo.construct_dataframe),
+# the state of all players is kept in NumPy arrays while the matches are replayed in order of played_at.
+# 1) Load all matches and their results (one query)
+# 2) Keep overall ratings, season ratings and match counts per player in arrays
+# 3) Calculate the new ratings of each match with elo.calculate_new_ratings
+# 4) Bulk insert the resulting ratings
+
+from foosbam.core import elo
+from foosbam.core.results import CONFIRMED
+from foosbam.models import Match, Rating, Result, User
+import numpy as np
+import sqlalchemy as sa
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_RATING = 1500
+
+class RatingState:
+    """
+    In-memory state of all players: their latest overall rating, their latest rating per season and their match count.
+    Players are stored at a fixed position in the arrays, see RatingState.index.
+    """
+
+    def __init__(self, user_ids: Iterable[int]):
+        self.index = {user_id: i for i, user_id in enumerate(user_ids)}
+        self.ratings = np.full(len(self.index), DEFAULT_RATING, dtype=np.int64)
+        self.counts = np.zeros(len(self.index), dtype=np.int64)
+        self.season_ratings: Dict[int, np.ndarray] = {}
+
+    def positions(self, user_ids: Iterable[int]) -> np.ndarray:
+        return np.array([self.index[user_id] for user_id in user_ids])
+
+    def get_season_ratings(self, season: int) -> np.ndarray:
+        # Every player starts a new season with the default rating
+        if season not in self.season_ratings:
+            self.season_ratings[season] = np.full(len(self.index), DEFAULT_RATING, dtype=np.int64)
+        return self.season_ratings[season]
+
+    def set_rating(self, user_id: int, rating: Optional[int] = None, season: Optional[int] = None, rating_season: Optional[int] = None):
+        i = self.index[user_id]
+        if rating is not None:
+            self.ratings[i] = rating
+        if season is not None and rating_season is not None:
+            self.get_season_ratings(season)[i] = rating_season
+
+    def rate_match(self, user_ids: List[int], season: int, score_black: int, score_white: int) -> Tuple[np.ndarray, ...]:
+        """
+        Calculate the new ratings for a single match and update the state.
+
+        Args:
+            user_ids (list): The players of the match, in the order att_black, def_black, att_white, def_white.
+            season (int): The season in which the match was played.
+            score_black (int): The score of team black.
+            score_white (int): The score of team white.
+
+        Returns:
+            tuple: Arrays with the previous ratings, new ratings, previous season ratings and new season ratings of the players.
+        """
+        pos = self.positions(user_ids)
+        season_ratings = self.get_season_ratings(season)
+
+        point_factor = elo.calculate_point_factor(score_black, score_white)
+        black_won = elo.get_winner(score_black, score_white) == 'black'
+        num_games = self.counts[pos]
+
+        previous_rating = self.ratings[pos]
+        previous_rating_season = season_ratings[pos]
+        new_rating, new_rating_season = elo.calculate_new_ratings(
+            np.stack([previous_rating, previous_rating_season]), num_games, point_factor, black_won
+        )
+
+        self.ratings[pos] = new_rating
+        season_ratings[pos] = new_rating_season
+        self.counts[pos] += 1
+
+        return previous_rating, new_rating, previous_rating_season, new_rating_season
+
+def load_state(db) -> RatingState:
+    """Create a RatingState for all users, seeded with the ratings that are already in the ratings table."""
+    state = RatingState(user_id for (user_id,) in db.session.query(User.id).order_by(User.id))
+
+    query = db.session.query(
+        Rating.user_id,
+        Rating.season,
+        Rating.rating,
+        Rating.rating_season
+    ).order_by(
+        Rating.since,
+        Rating.id
+    )
+
+    # Ratings are sorted on since, so the latest rating of each player (and season) is set last
+    for user_id, season, rating, rating_season in query:
+        state.set_rating(user_id, rating, season, rating_season)
+
+    return state
+
+def load_state_before(db, before, season_numbers: Iterable[int]) -> RatingState:
+    """
+    Create a RatingState for all users as it was just before the given timestamp, for the given seasons.
+    Per player, the latest rating before that timestamp is looked up with the (user_id, since) index,
+    so the cost does not depend on the length of the history.
+    Matches are counted by their ratings, so only rated (confirmed) matches count.
+    """
+    def latest_before(column, *conditions):
+        return sa.select(
+            column
+        ).where(
+            Rating.user_id == User.id,
+            Rating.since < before,
+            *conditions
+        ).order_by(
+            Rating.since.desc(),
+            Rating.id.desc()
+        ).limit(1).scalar_subquery()
+
+    match_count = sa.select(
+        sa.func.count(Rating.match_id)
+    ).where(
+        Rating.user_id == User.id,
+        Rating.since < before
+    ).scalar_subquery()
+
+    players = db.session.query(
+        User.id,
+        latest_before(Rating.rating),
+        match_count
+    ).order_by(
+        User.id
+    ).all()
+
+    state = RatingState(user_id for user_id, _, _ in players)
+    for user_id, rating, count in players:
+        state.set_rating(user_id, rating)
+        state.counts[state.index[user_id]] = count
+
+    for season in season_numbers:
+        season_ratings = db.session.query(
+            User.id,
+            latest_before(Rating.rating_season, Rating.season == season)
+        )
+        for user_id, rating_season in season_ratings:
+            state.set_rating(user_id, season=season, rating_season=rating_season)
+
+    return state
+
+def load_matches(db, since=None):
+    """Load matches with a confirmed result in order of played_at, in a single query."""
+    query = db.session.query(
+        Match.id,
+        Match.played_at,
+        Match.season,
+        Match.att_black,
+        Match.def_black,
+        Match.att_white,
+        Match.def_white,
+        Result.score_black,
+        Result.score_white,
+    ).join(
+        Result,
+        sa.and_(Result.match_id == Match.id, Result.status == CONFIRMED)
+    ).order_by(
+        Match.played_at
+    )
+    if since is not None:
+        query = query.filter(Match.played_at >= since)
+    return query
+
+def replay_matches(state: RatingState, matches) -> List[Dict[str, int]]:
+    """
+    Replay the given matches (in order of played_at) on top of state and return the resulting ratings
+    as dictionaries with the columns of the ratings table, ready to be bulk inserted.
+    """
+    rows = []
+    for match in matches:
+        user_ids = [match.att_black, match.def_black, match.att_white, match.def_white]
+        new_ratings = state.rate_match(user_ids, match.season, match.score_black, match.score_white)
+
+        # Convert to plain Python integers, so they can be passed to any database driver
+        for user_id, previous_rating, rating, previous_rating_season, rating_season in zip(user_ids, *(r.tolist() for r in new_ratings)):
+            rows.append({
+                'user_id': user_id,
+                'match_id': match.id,
+                'since': match.played_at,
+                'season': match.season,
+                'previous_rating': previous_rating,
+                'rating': rating,
+                'previous_rating_season': previous_rating_season,
+                'rating_season': rating_season,
+            })
+    return rows
+
+def insert_ratings(db, rows: List[Dict[str, int]], chunk_size: int = 10000):
+    """Bulk insert rating rows (as returned by replay_matches) in chunks."""
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(sa.insert(Rating), rows[start:start + chunk_size])
@@ -0,0 +1,134 @@
+from datetime import datetime
+from foosbam import db
+from foosbam.core import views
+from foosbam.models import Match, MatchParticipant, Result, User
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+from typing import Dict, Optional
+
+# Statuses of a result: only confirmed results are rated (see confirmation.py)
+PENDING = 'Pending'
+CONFIRMED = 'Confirmed'
+DISPUTED = 'Disputed'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def parse_cursor(cursor: Optional[str]) -> Optional[datetime]:
+    """
+    Convert a cursor from a URL back to a timestamp.
+
+    Raises:
+        ValueError: If the cursor is not a valid timestamp.
+    """
+    if not cursor:
+        return None
+    return datetime.fromisoformat(cursor)
+
+def format_cursor(played_at: datetime) -> str:
+    return played_at.isoformat()
+
+def parse_page_size(page_size: Optional[str]) -> int:
+    try:
+        return max(1, min(int(page_size), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+def query_results():
+    """Query of all matches with their result and the names of the players, not sorted yet."""
+    u_att_black = aliased(User)
+    u_def_black = aliased(User)
+    u_att_white = aliased(User)
+    u_def_white = aliased(User)
+
+    return db.session.query(
+        Match.id,
+        Match.played_at,
+        u_att_black.username.label('att_black'),
+        u_def_black.username.label('def_black'),
+        u_att_white.username.label('att_white'),
+        u_def_white.username.label('def_white'),
+        Result.score_black,
+        Result.score_white,
+        Result.status
+    ).join(
+        Result,
+        Result.match_id == Match.id
+    ).join(
+        u_att_black,
+        Match.att_black == u_att_black.id
+    ).join(
+        u_def_black,
+        Match.def_black == u_def_black.id
+    ).join(
+        u_att_white,
+        Match.att_white == u_att_white.id
+    ).join(
+        u_def_white,
+        Match.def_white == u_def_white.id
+    )
+
+def get_results_page(user_id: Optional[int] = None,
+                     before: Optional[datetime] = None,
+                     after: Optional[datetime] = None,
+                     page_size: int = DEFAULT_PAGE_SIZE) -> Dict:
+    """
+    Retrieve a page of results, newest first, using keyset pagination on played_at. played_at is unique, so it can be used as the cursor.
+
+    Args:
+        user_id (Optional[int]): Only include matches of this player.
+        before (Optional[datetime]): Return the matches played before this timestamp (the next, older page).
+        after (Optional[datetime]): Return the matches played after this timestamp (the previous, newer page).
+        page_size (int): The maximum number of results on the page.
+
+    Returns:
+        dict: A dictionary with the following keys:
+            - 'results' (list): The results on the page, as views.ResultView.
+            - 'older' (str): Cursor for the page with older results, or None if there are none.
+            - 'newer' (str): Cursor for the page with newer results, or None if there are none.
+    """
+    query = query_results()
+
+    # For a single player the (user_id, played_at) index of match_participants is used for sorting and paging
+    played_at = Match.played_at
+    if user_id is not None:
+        query = query.join(
+            MatchParticipant,
+            and_(MatchParticipant.match_id == Match.id,
+                 MatchParticipant.user_id == user_id)
+        )
+        played_at = MatchParticipant.played_at
+
+    # Fetch one extra row, to find out whether there is another page in the same direction
+    if after is not None:
+        rows = query.filter(played_at > after).order_by(played_at.asc()).limit(page_size + 1).all()
+        has_newer = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_older = True
+    else:
+        if before is not None:
+            query = query.filter(played_at < before)
+        rows = query.order_by(played_at.desc()).limit(page_size + 1).all()
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_newer = before is not None
+
+    return {
+        'results': [views.ResultView(row) for row in rows],
+        'older': format_cursor(rows[-1].played_at) if rows and has_older else None,
+        'newer': format_cursor(rows[0].played_at) if rows and has_newer else None,
+    }
+
+def get_results_page_from_args(args, user_id: Optional[int] = None) -> Dict:
+    """
+    Retrieve a page of results based on the query string parameters 'before', 'after' and 'size'.
+
+    Raises:
+        ValueError: If one of the cursors is invalid.
+    """
+    return get_results_page(
+        user_id=user_id,
+        before=parse_cursor(args.get('before')),
+        after=parse_cursor(args.get('after')),
+        page_size=parse_page_size(args.get('size')),
+    )
@@ -1,13 +1,12 @@
 from datetime import datetime
-from flask import flash, redirect, render_template, request, url_for
+from flask import Response, abort, flash, g, redirect, render_template, request, stream_with_context, url_for
 from flask_login import current_user, login_required
-from foosbam import db
-from foosbam.models import Match, Result, User
-from foosbam.core import bp, details, elo, misc, ranking, seasons
-from foosbam.core.forms import AddMatchForm, EditProfileForm
-import pandas as pd
+from foosbam import db, instrumentation
+from foosbam.models import Match, MatchParticipant, Result, User
+from foosbam.core import bp, confirmation, details, export, importer, misc, page_cache, ranking, rating_jobs, results, seasons, teams, versions, views
+from foosbam.core.forms import AddMatchForm, CheckResultsForm, EditProfileForm, ImportMatchesForm, MakeTeamsForm
+import io
 import sqlalchemy as sa
-from sqlalchemy.orm import aliased
 from zoneinfo import ZoneInfo
 
 @bp.route('/')
@@ -33,6 +32,11 @@ def add_result():
         form.keeper_black.data = 0
         form.keeper_white.data = 0
 
+        # Players can be filled in from a proposal of make_teams
+        for field in [form.att_black, form.def_black, form.att_white, form.def_white]:
+            if request.args.get(field.name, type=int) is not None:
+                field.data = request.args.get(field.name, type=int)
+
     if form.validate_on_submit():
         played_at_timestamp = misc.change_timezone(datetime.combine(form.date.data, form.time.data), 'Europe/Amsterdam', 'Etc/UTC')
 
@@ -47,12 +51,13 @@ def add_result():
         )
         db.session.add(match)
         db.session.flush()
+        db.session.add_all(MatchParticipant.from_match(match))
 
         # Add result to database
         result = Result(
             match_id = match.id,
             created_by = current_user.id,
-            status = "Pending",
+            status = results.PENDING,
             score_black = form.score_black.data,
             score_white = form.score_white.data,
             klinker_att_black = form.klinker_att_black.data,
@@ -63,131 +68,116 @@ def add_result():
             keeper_white = form.keeper_white.data
         )
         db.session.add(result)
-        db.session.flush()
 
-        # Calculate new ratings and add them to database
-
-        ## Prepare arguments
-        user_ids = [
-            form.att_black.data,
-            form.def_black.data,
-            form.att_white.data,
-            form.def_white.data
-        ]     
-        
-        df = elo.construct_dataframe(
-            user_ids = user_ids, 
-            match_id = match.id, 
-            played_at = match.played_at, 
-            score_black = result.score_black, 
-            score_white = result.score_white, 
-        )
-            
-
-        ## Add new ratings to database
-        db.session.add_all(list(df['rating_obj']))
+        # The result is rated once a player of the other team confirms it (see confirmation.py)
+        versions.bump_version(versions.MATCHES)
         db.session.commit()
+        flash('Result added. It counts for the rankings once a player of the other team has confirmed it.', 'is-success')
         return redirect(url_for('core.index'))
 
     return render_template("core/add_result.html", form=form)
 
-@bp.route('/show_results')
+@bp.route('/import_matches', methods=['GET', 'POST'])
 @login_required
-def show_results():
+def import_matches():
+    # Imported results are confirmed right away (see importer.py), so only admins may import them
+    if not current_user.is_admin:
+        abort(403)
 
-    u_att_black = aliased(User)
-    u_def_black = aliased(User)
-    u_att_white = aliased(User)
-    u_def_white = aliased(User)
-
-    results = db.session.query(
-        Match.id,
-        Match.played_at,
-        u_att_black.username.label('att_black'),              
-        u_def_black.username.label('def_black'),                
-        u_att_white.username.label('att_white'),              
-        u_def_white.username.label('def_white'),                
-        Result.score_black,     
-        Result.score_white,       
-        Result.status
-    ).join(
-        Match,
-        Result.match_id == Match.id
-    ).join(
-        u_att_black,
-        Match.att_black == u_att_black.id
-    ).join(
-        u_def_black,
-        Match.def_black == u_def_black.id
-    ).join(
-        u_att_white,
-        Match.att_white == u_att_white.id
-    ).join(
-        u_def_white,
-        Match.def_white == u_def_white.id
-    ).all()
-
-    results_as_dict = [
-        dict(
-            zip(
-                [
-                    'id',
-                    'played_at',
-                    'att_black',
-                    'def_black',
-                    'att_white',
-                    'def_white',
-                    'score_black',
-                    'score_white',
-                    'status',
-                ],
-                result,
-            )
-        )
-        for result in results
-    ]
+    form = ImportMatchesForm()
 
-    df = pd.DataFrame.from_records(results_as_dict)
+    report = None
+    if form.validate_on_submit():
+        lines = io.TextIOWrapper(form.file.data.stream, encoding='utf-8-sig', newline='')
+        report = importer.import_csv(lines, current_user.id, utc=form.utc.data)
+        if not report.errors:
+            flash(f'Imported {report.imported} matches.', 'is-success')
+            return redirect(url_for('core.show_results'))
 
-    if len(df) > 0:
-        df = df.sort_values(by='played_at', ascending=False)
+    return render_template("core/import_matches.html", form=form, report=report)
 
-        # Change played_at column to Amsterdam time (for frontend) and in desired format
-        df['played_at'] = df['played_at'].apply(lambda x : misc.change_timezone(x, 'Etc/UTC', 'Europe/Amsterdam'))
-        df['played_at'] = df['played_at'].dt.strftime('%Y-%m-%d %H:%M')
+@bp.route('/check_results', methods=['GET', 'POST'])
+@login_required
+def check_results():
+    form = CheckResultsForm()
 
-        # Use the title function on the player names, so they get capitals
-        for col in ['att_black', 'def_black', 'att_white', 'def_white']:
-            df[col] = df[col].str.title()
-    
-    return render_template("core/show_results.html", results=df)
+    if form.validate_on_submit():
+        action = 'confirm' if form.confirm.data else 'dispute'
+        checked, skipped = confirmation.check_results(form.results.data, current_user.id, action)
+        db.session.commit()
+        # Without a worker, all confirmations of this request are rated here, in one go
+        rating_jobs.rate_if_no_worker()
+
+        done = {'confirm': 'confirmed', 'dispute': 'disputed'}[action]
+        flash(f'{checked} result(s) {done}.', 'is-success')
+        if skipped:
+            flash(f'{skipped} result(s) could not be {done} by you.', 'is-warning')
+        match_id = request.args.get('match_id', type=int)
+        return redirect(url_for('core.match', match_id=match_id) if match_id else url_for('core.check_results'))
 
-@bp.route('/match/<match_id>')
+    rows = [views.ResultView(row) for row in confirmation.query_results_to_check(current_user.id)]
+    return render_template("core/check_results.html", form=form, results=rows)
+
+@bp.route('/make_teams', methods=['GET', 'POST'])
 @login_required
-def match(match_id):
-    # Get match results
-    match_details = details.get_match_and_result_details(match_id)
+def make_teams():
+    form = MakeTeamsForm()
+    form.players.choices = [(p.id, p.username.title()) for p in User.query.order_by('username')]
 
-    # Get players
-    player_details = details.get_players_from_match(match_id)
+    proposals = None
+    if form.validate_on_submit():
+        try:
+            proposals = teams.make_teams(form.players.data)
+        except KeyError:
+            flash('Not all selected players have a rating yet.', 'is-danger')
 
-    # For each player, get name and ratings before and after match
-    player_details = details.enrich_player_details(player_details, match_id)
+    names = dict(form.players.choices)
+    return render_template("core/make_teams.html", form=form, proposals=proposals, names=names)
 
-    # Get prediction details
-    prediction_details = details.create_prediction_details(player_details)
+@bp.route('/show_results')
+@login_required
+@page_cache.cached_page()
+def show_results():
+    try:
+        page = results.get_results_page_from_args(request.args)
+    except ValueError:
+        abort(400)
+
+    return render_template("core/show_results.html", page=page, size=request.args.get('size'))
+
+def can_check(match_view):
+    """Whether the current user can confirm or dispute the result of the match, i.e. its page has the check form."""
+    return match_view is not None and match_view.status is not None and \
+        current_user.id in confirmation.get_checkers([p.id for p in match_view.players], match_view.created_by)
+
+def can_check_match(match_id):
+    # The view is kept for the request, so the match page does not load it again
+    g.match_view = details.load_match_view(match_id)
+    return can_check(g.match_view)
+
+@bp.route('/match/<int:match_id>')
+@login_required
+# The check form has a CSRF token of the session, so pages with the form are never served from the page cache
+@page_cache.cached_page(bypass=can_check_match)
+def match(match_id):
+    # Match, result, players and their ratings (one query, cached per match), already loaded by can_check_match
+    match_view = g.pop('match_view') if 'match_view' in g else details.load_match_view(match_id)
+    if match_view is None:
+        abort(404)
 
     return render_template("core/match.html", 
-                           match_details=match_details, 
-                           att_black=player_details[0],
-                           def_black=player_details[1],
-                           att_white=player_details[2],
-                           def_white=player_details[3],
-                           prediction_details=prediction_details
+                           match_details=match_view, 
+                           check_form=CheckResultsForm() if can_check(match_view) else None,
+                           att_black=match_view.att_black,
+                           def_black=match_view.def_black,
+                           att_white=match_view.att_white,
+                           def_white=match_view.def_white,
+                           prediction_details=match_view.prediction_details
                         )
 
 @bp.route('/show_ranking')
 @login_required
+@page_cache.cached_page()
 def show_ranking():
     r = ranking.get_current_ranking()
     return render_template("core/show_ranking.html", ranking=r)
@@ -200,6 +190,7 @@ def show_season():
 
 @bp.route('/show_season_ranking/<season>')
 @login_required
+@page_cache.cached_page()
 def show_season_ranking(season):
     season = int(season)
     r = ranking.get_season_ranking(season)
@@ -211,74 +202,39 @@ def show_season_ranking(season):
 def user(user_id):
     user = db.first_or_404(sa.select(User).where(User.id == user_id))
 
-    u_att_black = aliased(User)
-    u_def_black = aliased(User)
-    u_att_white = aliased(User)
-    u_def_white = aliased(User)
-
-    results = db.session.query(
-        Match.id,
-        Match.played_at,
-        u_att_black.username.label('att_black'),              
-        u_def_black.username.label('def_black'),                
-        u_att_white.username.label('att_white'),              
-        u_def_white.username.label('def_white'),                
-        Result.score_black,     
-        Result.score_white,       
-        Result.status
-    ).join(
-        Match,
-        Result.match_id == Match.id
-    ).join(
-        u_att_black,
-        Match.att_black == u_att_black.id
-    ).join(
-        u_def_black,
-        Match.def_black == u_def_black.id
-    ).join(
-        u_att_white,
-        Match.att_white == u_att_white.id
-    ).join(
-        u_def_white,
-        Match.def_white == u_def_white.id
-    ).filter(
-        (Match.def_white == user_id) | (Match.att_white == user_id) | (Match.def_black == user_id) | (Match.att_black == user_id)
-    ).all()
-
-    results_as_dict = [
-        dict(
-            zip(
-                [
-                    'id',
-                    'played_at',
-                    'att_black',
-                    'def_black',
-                    'att_white',
-                    'def_white',
-                    'score_black',
-                    'score_white',
-                    'status',
-                ],
-                result,
-            )
-        )
-        for result in results
-    ]
-
-    df = pd.DataFrame.from_records(results_as_dict)
+    try:
+        page = results.get_results_page_from_args(request.args, user_id=user.id)
+    except ValueError:
+        abort(400)
 
-    if len(df) > 0:
-        df = df.sort_values(by='played_at', ascending=False)
+    return render_template("core/user.html", user=user, page=page, size=request.args.get('size'))
 
-        # Change played_at column to Amsterdam time (for frontend) and in desired format
-        df['played_at'] = df['played_at'].apply(lambda x : misc.change_timezone(x, 'Etc/UTC', 'Europe/Amsterdam'))
-        df['played_at'] = df['played_at'].dt.strftime('%Y-%m-%d %H:%M')
-
-        # Use the title function on the player names, so they get capitals
-        for col in ['att_black', 'def_black', 'att_white', 'def_white']:
-            df[col] = df[col].str.title()
-    
-    return render_template("core/user.html", user=user, results=df)
+@bp.route('/export')
+@login_required
+def export_data():
+    dataset = request.args.get('data', 'matches')
+    format = request.args.get('format', 'csv')
+    compress = request.args.get('compress', '1') != '0'
+    try:
+        parts = export.export(
+            dataset,
+            format,
+            season=request.args.get('season', type=int),
+            user_id=request.args.get('user_id', type=int),
+            compress=compress
+        )
+    except ValueError as e:
+        abort(400, str(e))
+    except RuntimeError as e:
+        abort(501, str(e))
+
+    filename = export.get_filename(dataset, format, compress)
+    mimetype = {'parquet': 'application/vnd.apache.parquet', 'csv': 'application/gzip' if compress else 'text/csv'}[format]
+    return Response(
+        stream_with_context(parts),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 @bp.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
@@ -290,10 +246,24 @@ def edit_profile():
         form.email.data = current_user.email
 
     if form.validate_on_submit():
+        if current_user.username != form.username.data.lower():
+            # Names are shown on cached pages (see page_cache.py)
+            versions.bump_version(versions.USERS)
         current_user.username = form.username.data.lower()
         current_user.email = form.email.data.lower()
         db.session.commit()
         flash('Your changes have been saved.', 'is-success')
         return redirect(url_for('core.user', user_id = current_user.id))
     
-    return render_template('core/edit_profile.html', form=form)
\ No newline at end of file
+    return render_template('core/edit_profile.html', form=form)
+
+@bp.route('/debug/requests')
+@login_required
+def debug_requests():
+    if not instrumentation.enabled():
+        abort(404)
+    if not current_user.is_admin:
+        abort(403)
+
+    recent = instrumentation.get_recent()
+    return render_template('core/debug_requests.html', recent=recent, summary=instrumentation.summarize(recent))
@@ -1,15 +1,47 @@
 import datetime as dt
+from dateutil import parser
 from dateutil.relativedelta import relativedelta
+from functools import lru_cache
 from math import ceil
-from typing import Union, List
-import pandas as pd
+from typing import TYPE_CHECKING, Union, List
 
-def get_season_from_date(date_arg: Union[str, pd.Timestamp]) -> int:
+if TYPE_CHECKING:
+    import numpy as np
+
+FIRST_GAME_DATE = dt.date(2023, 11, 30)
+SECOND_SEASON_START_DATE = dt.date(2024, 4, 1)
+
+def to_utc_date(date_arg: Union[str, dt.date, dt.datetime]) -> dt.date:
+    """
+    Convert a string, date or datetime to a date in UTC. Datetimes without timezone are assumed to be in UTC.
+
+    Raises:
+    ValueError: If the date is not in a valid format.
+    """
+    if isinstance(date_arg, str):
+        try:
+            date_arg = dt.datetime.fromisoformat(date_arg)
+        except ValueError:
+            try:
+                date_arg = parser.parse(date_arg)
+            except (ValueError, OverflowError):
+                raise ValueError("Invalid date format. Please provide a valid date.")
+
+    if isinstance(date_arg, dt.datetime):
+        if date_arg.tzinfo is not None:
+            date_arg = date_arg.astimezone(dt.timezone.utc)
+        return date_arg.date()
+    elif isinstance(date_arg, dt.date):
+        return date_arg
+    else:
+        raise ValueError("Invalid date format. Please provide a valid date.")
+
+def get_season_from_date(date_arg: Union[str, dt.date, dt.datetime]) -> int:
     """
     Determines the season number based on the provided date.
 
     Parameters:
-    date_arg (str or pandas.Timestamp): The date for which the season number is to be determined.
+    date_arg (str, date or datetime): The date for which the season number is to be determined. Datetimes without timezone are assumed to be in UTC.
 
     Returns:
     int: The season number corresponding to the provided date.
@@ -23,24 +55,50 @@ def get_season_from_date(date_arg: Union[str, pd.Timestamp]) -> int:
     >>> get_season_from_date('2024-04-15')
     2
     """
+    return get_season_from_utc_date(to_utc_date(date_arg))
 
-    try:
-        date_arg = pd.to_datetime(date_arg, utc=True)
-    except ValueError:
-        raise ValueError("Invalid date format. Please provide a valid date.")
-
-    first_game_date = pd.to_datetime('2023-11-30', utc=True)
-    second_season_start_date = pd.to_datetime('2024-04-01', utc=True)
-
-    if date_arg < first_game_date:
+@lru_cache(maxsize=4096)
+def get_season_from_utc_date(date: dt.date) -> int:
+    if date < FIRST_GAME_DATE:
         raise ValueError("No dates before the first game date are allowed. Please fill in a date equal to or later than 2023-11-30.")
-    elif date_arg < second_season_start_date:
+    elif date < SECOND_SEASON_START_DATE:
         return 1
     else:
-        # calculate difference in quarters between date_arg and second_season_start_date
-        q = (date_arg.year  * 4 + date_arg.quarter) - (second_season_start_date.year  * 4 + second_season_start_date.quarter)
+        # calculate difference in quarters between date and SECOND_SEASON_START_DATE
+        q = (date.year * 4 + (date.month - 1) // 3) - (SECOND_SEASON_START_DATE.year * 4 + (SECOND_SEASON_START_DATE.month - 1) // 3)
         return q + 2
-    
+
+def get_seasons_for_dates(dates: 'np.ndarray') -> 'np.ndarray':
+    """
+    Determines the season numbers of an array of dates at once, e.g. for all matches of a replay or migration.
+
+    Parameters:
+    dates (numpy.ndarray): Array of datetime64 values, in UTC.
+
+    Returns:
+    numpy.ndarray: The season number of every date.
+
+    Raises:
+    ValueError: If one of the dates is missing (NaT) or before the first game date (2023-11-30).
+
+    Example:
+    >>> import numpy as np
+    >>> get_seasons_for_dates(np.array(['2023-12-15', '2024-04-15T10:00'], dtype='datetime64[m]')).tolist()
+    [1, 2]
+    """
+    import numpy as np
+
+    days = np.asarray(dates).astype('datetime64[D]')
+    if np.isnat(days).any():
+        raise ValueError("Invalid date format. Please provide a valid date.")
+    if (days < np.datetime64(FIRST_GAME_DATE)).any():
+        raise ValueError("No dates before the first game date are allowed. Please fill in a date equal to or later than 2023-11-30.")
+
+    # Months since 1970-01, divided into quarters since 1970
+    quarters = days.astype('datetime64[M]').astype(np.int64) // 3
+    second_season_quarter = (np.datetime64(SECOND_SEASON_START_DATE, 'M').astype(np.int64)) // 3
+    return np.where(days < np.datetime64(SECOND_SEASON_START_DATE), 1, quarters - second_season_quarter + 2)
+
 def get_dates_from_season(season: int) -> List[str]:
     """
     Calculate the start and end dates of a given season.
@@ -98,6 +156,17 @@ def get_all_seasons() -> List[int]:
     [1, 2]
     """
 
-    today = pd.Timestamp.today('UTC')
+    today = dt.datetime.now(dt.timezone.utc)
     current_season = get_season_from_date(today)
-    return list(range(1, current_season + 1))
\ No newline at end of file
+    return list(range(1, current_season + 1))
+
+def has_ended(season: int) -> bool:
+    """
+    Check whether a season has ended, i.e. today is after its last day.
+
+    Example:
+    >>> has_ended(1)
+    True
+    """
+    end_date = dt.datetime.strptime(get_dates_from_season(season)[1], '%Y-%m-%d').date()
+    return dt.datetime.now(dt.timezone.utc).date() > end_date
@@ -0,0 +1,237 @@
+# PLAYER STANDINGS
+# ----------------
+# The player_standings table holds the current rating and match count of every player,
+# so the all-time ranking is a single read instead of a search for the latest rating of each player.
+# The season_standings table does the same per season, for the season rankings.
+# Both are updated whenever ratings are added (see rating.add_ratings) and can be rebuilt from the ratings table.
+# Seasons that have ended are frozen: they are only rebuilt when explicitly asked for.
+# A new match is rated on top of the standings of its players (see get_current_standings).
+
+from collections import Counter
+from datetime import datetime, timezone
+from foosbam import db
+from foosbam.core import player_state, seasons
+from foosbam.models import PlayerStanding, Rating, SeasonStanding
+import sqlalchemy as sa
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_RATING = 1500
+
+class CurrentStanding:
+    __slots__ = ('rating', 'rating_since', 'match_count', 'rating_season')
+
+    def __init__(self, rating: int = DEFAULT_RATING, rating_since: datetime = datetime.min, match_count: int = 0,
+                 rating_season: int = DEFAULT_RATING):
+        self.rating = rating
+        self.rating_since = rating_since
+        self.match_count = match_count
+        self.rating_season = rating_season
+
+def get_current_standings(user_ids: Iterable[int], season: int) -> Dict[int, CurrentStanding]:
+    """
+    Retrieve the latest committed rating, match count and season rating of the given players, to rate a new match.
+    The rows are read with SELECT ... FOR UPDATE: a locking read returns the latest committed values, also in a transaction
+    that started earlier (MySQL's REPEATABLE READ), and keeps the rows locked until the end of the transaction.
+    Players without standing get the default values.
+    """
+    user_ids = sorted(set(user_ids))
+    current = {user_id: CurrentStanding() for user_id in user_ids}
+
+    players = db.session.execute(
+        sa.select(
+            PlayerStanding.user_id,
+            PlayerStanding.rating,
+            PlayerStanding.rating_since,
+            PlayerStanding.match_count
+        ).where(
+            PlayerStanding.user_id.in_(user_ids)
+        ).order_by(
+            PlayerStanding.user_id
+        ).with_for_update()
+    )
+    for user_id, rating, rating_since, match_count in players:
+        current[user_id].rating = rating
+        current[user_id].rating_since = player_state.normalize(rating_since)
+        current[user_id].match_count = match_count
+
+    season_ratings = db.session.execute(
+        sa.select(
+            SeasonStanding.user_id,
+            SeasonStanding.rating
+        ).where(
+            SeasonStanding.season == season,
+            SeasonStanding.user_id.in_(user_ids)
+        ).order_by(
+            SeasonStanding.user_id
+        ).with_for_update()
+    )
+    for user_id, rating_season in season_ratings:
+        current[user_id].rating_season = rating_season
+    return current
+
+def update(ratings: List[Rating]):
+    """Update the standings of the players of the given ratings, in the current transaction."""
+    for r in ratings:
+        since = player_state.normalize(r.since or datetime.now(timezone.utc))
+        update_player(r.user_id, r.rating, since, int(r.match_id is not None))
+
+        # Season standings only include ratings of played matches
+        if r.match_id is not None and r.rating_season is not None:
+            update_season(r.season, r.user_id, r.rating_season, since, 1)
+
+def update_after_replay(rows: List[Dict], new_rows: List[Dict]):
+    """
+    Update the standings after matches were rated again (see rating.rerate_from).
+    rows are all replayed ratings (in order of played_at), new_rows the ones that did not exist before.
+    """
+    latest = {row['user_id']: row for row in rows}
+    latest_season = {(row['season'], row['user_id']): row for row in rows}
+    new_counts = Counter(row['user_id'] for row in new_rows)
+    new_season_counts = Counter((row['season'], row['user_id']) for row in new_rows)
+
+    for user_id, row in latest.items():
+        update_player(user_id, row['rating'], player_state.normalize(row['since']), new_counts[user_id])
+    for (season, user_id), row in latest_season.items():
+        update_season(season, user_id, row['rating_season'], player_state.normalize(row['since']), new_season_counts[(season, user_id)])
+
+def update_player(user_id: int, rating: int, since: datetime, added_matches: int):
+    is_newer = PlayerStanding.rating_since <= since
+
+    # rating has to be set before rating_since: MySQL uses already updated values in later assignments
+    updated = db.session.execute(
+        sa.update(PlayerStanding).where(
+            PlayerStanding.user_id == user_id
+        ).ordered_values(
+            (PlayerStanding.rating, sa.case((is_newer, rating), else_=PlayerStanding.rating)),
+            (PlayerStanding.rating_since, sa.case((is_newer, since), else_=PlayerStanding.rating_since)),
+            (PlayerStanding.match_count, PlayerStanding.match_count + added_matches),
+        ).execution_options(
+            synchronize_session=False
+        )
+    ).rowcount
+
+    if updated == 0:
+        db.session.add(PlayerStanding(user_id=user_id, rating=rating, rating_since=since, match_count=added_matches))
+        db.session.flush()
+
+def update_season(season: int, user_id: int, rating_season: int, since: datetime, added_matches: int):
+    is_newer = SeasonStanding.last_played <= since
+
+    # rating has to be set before last_played: MySQL uses already updated values in later assignments
+    updated = db.session.execute(
+        sa.update(SeasonStanding).where(
+            SeasonStanding.season == season,
+            SeasonStanding.user_id == user_id
+        ).ordered_values(
+            (SeasonStanding.rating, sa.case((is_newer, rating_season), else_=SeasonStanding.rating)),
+            (SeasonStanding.last_played, sa.case((is_newer, since), else_=SeasonStanding.last_played)),
+            (SeasonStanding.match_count, SeasonStanding.match_count + added_matches),
+        ).execution_options(
+            synchronize_session=False
+        )
+    ).rowcount
+
+    if updated == 0:
+        db.session.add(SeasonStanding(season=season, user_id=user_id, rating=rating_season, last_played=since, match_count=added_matches))
+        db.session.flush()
+
+def rebuild(all_seasons: bool = False):
+    """
+    Recalculate the standings from the ratings table.
+    Season standings are only recalculated for seasons that have not ended yet (or have no standings at all), unless all_seasons is set.
+    """
+    rebuild_players()
+
+    rated_seasons = {season for (season,) in db.session.query(Rating.season).filter(Rating.match_id.is_not(None)).distinct()}
+    if all_seasons:
+        rebuild_seasons(rated_seasons)
+    else:
+        frozen_seasons = {season for (season,) in db.session.query(SeasonStanding.season).distinct() if seasons.has_ended(season)}
+        rebuild_seasons(rated_seasons - frozen_seasons)
+
+def rebuild_players(user_ids: Optional[Iterable[int]] = None):
+    """Recalculate the player standings (of all players, or of the given players) from the ratings table."""
+    latest = db.session.query(
+        Rating.user_id,
+        sa.func.max(Rating.since).label('max_since'),
+        sa.func.count(Rating.match_id).label('match_count')
+    ).group_by(
+        Rating.user_id
+    )
+    delete = sa.delete(PlayerStanding)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        latest = latest.filter(Rating.user_id.in_(user_ids))
+        delete = delete.where(PlayerStanding.user_id.in_(user_ids))
+    latest = latest.subquery()
+
+    # Sorted on id, so in case of equal timestamps the last added rating wins
+    rows = db.session.query(
+        Rating.user_id,
+        Rating.rating,
+        Rating.since,
+        latest.c.match_count
+    ).join(
+        latest,
+        sa.and_(Rating.user_id == latest.c.user_id,
+                Rating.since == latest.c.max_since)
+    ).order_by(
+        Rating.id
+    )
+    standings = {
+        user_id: {'user_id': user_id, 'rating': rating, 'rating_since': since, 'match_count': match_count}
+        for user_id, rating, since, match_count in rows
+    }
+
+    db.session.execute(delete)
+    if standings:
+        db.session.execute(sa.insert(PlayerStanding), list(standings.values()))
+
+def rebuild_seasons(season_numbers: Iterable[int], user_ids: Optional[Iterable[int]] = None):
+    """Recalculate the season standings of the given seasons (of all players, or of the given players) from the ratings table."""
+    season_numbers = list(season_numbers)
+    delete = sa.delete(SeasonStanding).where(SeasonStanding.season.in_(season_numbers))
+
+    latest = db.session.query(
+        Rating.season,
+        Rating.user_id,
+        sa.func.max(Rating.since).label('max_since'),
+        sa.func.count(Rating.match_id).label('match_count')
+    ).filter(
+        Rating.season.in_(season_numbers),
+        Rating.match_id.is_not(None)
+    ).group_by(
+        Rating.season,
+        Rating.user_id
+    )
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        latest = latest.filter(Rating.user_id.in_(user_ids))
+        delete = delete.where(SeasonStanding.user_id.in_(user_ids))
+    latest = latest.subquery()
+
+    # Sorted on id, so in case of equal timestamps the last added rating wins
+    rows = db.session.query(
+        Rating.season,
+        Rating.user_id,
+        Rating.rating_season,
+        Rating.since,
+        latest.c.match_count
+    ).join(
+        latest,
+        sa.and_(Rating.season == latest.c.season,
+                Rating.user_id == latest.c.user_id,
+                Rating.since == latest.c.max_since)
+    ).filter(
+        Rating.match_id.is_not(None)
+    ).order_by(
+        Rating.id
+    )
+    standings = {
+        (season, user_id): {'season': season, 'user_id': user_id, 'rating': rating_season, 'last_played': since, 'match_count': match_count}
+        for season, user_id, rating_season, since, match_count in rows
+    }
+
+    db.session.execute(delete)
+    if standings:
+        db.session.execute(sa.insert(SeasonStanding), list(standings.values()))
@@ -0,0 +1,83 @@
+# STARTUP PROFILE
+# ---------------
+# Measures how long a fresh worker needs before it can serve requests: importing foosbam, create_app() and the first request.
+# The measurement runs in a new interpreter with `python -X importtime`, because modules that are already imported
+# in the current process (e.g. by the flask command itself) would not be measured otherwise.
+
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+PROFILE_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from foosbam import create_app
+imported = time.perf_counter()
+app = create_app()
+ready = time.perf_counter()
+status = app.test_client().get(sys.argv[1]).status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': ready - imported,
+    'first_request': served - ready,
+    'status': status,
+    'modules': sorted(sys.modules),
+}))
+'''
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Parse the output of `python -X importtime`.
+
+    Returns:
+        list: For every imported module a tuple of (name, depth, self time, cumulative time), times in microseconds.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, int(self_time), int(cumulative)))
+    return modules
+
+def time_per_package(modules: List[Tuple[str, int, int, int]]) -> List[Tuple[str, int]]:
+    """Sum the import times of modules (see parse_importtime) per top-level package, slowest first."""
+    totals: Dict[str, int] = {}
+    for name, _, self_time, _ in modules:
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + self_time
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+def profile_startup(root_path: str, path: str = '/auth/login') -> Dict:
+    """
+    Start a new interpreter that imports foosbam, creates the app and handles a single request to path.
+
+    Args:
+        root_path (str): Directory from which the app is started (with config.py).
+        path (str): The URL of the first request.
+
+    Returns:
+        dict: A dictionary with the following keys:
+            - 'import', 'create_app', 'first_request' (float): Durations in seconds.
+            - 'status' (int): The status code of the first request.
+            - 'modules' (list): All modules that were loaded, as returned by parse_importtime.
+            - 'loaded' (list): Names of all modules in sys.modules after the first request.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT, path],
+        cwd=root_path,
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f'Starting the app failed:\n{process.stderr[-2000:]}')
+
+    profile = json.loads(process.stdout.strip().splitlines()[-1])
+    profile['loaded'] = profile.pop('modules')
+    profile['modules'] = parse_importtime(process.stderr)
+    return profile
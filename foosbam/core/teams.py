@@ -0,0 +1,85 @@
+# TEAM GENERATOR
+# --------------
+# Proposes the most balanced matches for the players that are present: the lineups of which the chance of winning is closest to 0.5.
+# 1) Take every combination of four players from the pool
+# 2) Split each combination into team black and team white
+# 3) Calculate the chance of winning of all lineups at once (elo.predict_batch)
+# 4) Sort on the difference from 0.5
+#
+# With team averaging (see elo.calculate_expected_team_score) the chance of winning does not depend on who attacks and who defends,
+# and swapping the colours only swaps the chances. So of the 4! orders of four players only 3 splits are different:
+# for a pool of 16 players that is 1820 combinations x 3 splits = 5460 lineups, instead of 1820 x 24.
+
+from foosbam.core import elo
+from itertools import combinations
+from typing import Iterable, List
+
+MIN_PLAYERS = 4
+MAX_PLAYERS = 16
+
+# The three different ways to split four players (at positions 0-3) into two teams
+SPLITS = [
+    [0, 1, 2, 3],
+    [0, 2, 1, 3],
+    [0, 3, 1, 2],
+]
+
+class TeamProposal:
+    __slots__ = ('att_black', 'def_black', 'att_white', 'def_white', 'chance_black', 'chance_white')
+
+    def __init__(self, lineup: List[int], chance_black: float, chance_white: float):
+        self.att_black, self.def_black, self.att_white, self.def_white = lineup
+        self.chance_black = chance_black
+        self.chance_white = chance_white
+
+    @property
+    def lineup(self) -> List[int]:
+        return [self.att_black, self.def_black, self.att_white, self.def_white]
+
+def create_lineups(user_ids: List[int]):
+    """
+    Create every lineup of four players from the pool, without lineups that only differ in roles or colours.
+
+    Returns:
+        np.ndarray: L x 4 array of user ids, in the order att_black, def_black, att_white, def_white.
+    """
+    import numpy as np
+
+    players = np.array(user_ids, dtype=np.int64)
+    groups = np.array(list(combinations(range(len(players)), 4)), dtype=np.int64)
+    return players[groups[:, SPLITS].reshape(-1, 4)]
+
+def make_teams(user_ids: Iterable[int], number: int = 5) -> List[TeamProposal]:
+    """
+    Propose the most balanced matches for a pool of players.
+
+    Args:
+        user_ids (iterable): The players that are present, 4 to 16 players.
+        number (int): The maximum number of proposals.
+
+    Returns:
+        list: The proposals, the most balanced match first.
+
+    Raises:
+        ValueError: If the pool does not consist of 4 to 16 different players.
+        KeyError: If one of the players has no rating.
+    """
+    import numpy as np
+
+    user_ids = list(dict.fromkeys(user_ids))
+    if not MIN_PLAYERS <= len(user_ids) <= MAX_PLAYERS:
+        raise ValueError(f'Select between {MIN_PLAYERS} and {MAX_PLAYERS} players.')
+
+    lineups = create_lineups(user_ids)
+    chances = elo.predict_batch(lineups)
+
+    # Only the best lineups have to be sorted
+    imbalance = np.abs(chances[:, 0] - 0.5)
+    number = min(number, len(lineups))
+    best = np.argpartition(imbalance, number - 1)[:number]
+    best = best[np.argsort(imbalance[best], kind='stable')]
+
+    return [
+        TeamProposal(lineup, chance_black, chance_white)
+        for lineup, (chance_black, chance_white) in zip(lineups[best].tolist(), chances[best].tolist())
+    ]
@@ -0,0 +1,88 @@
+from datetime import datetime, timezone
+from foosbam import db
+from foosbam.models import DataVersion
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from typing import Dict, Iterable, Optional, Tuple
+
+MATCHES = 'matches'
+RATINGS = 'ratings'
+RERATES = 'rerates'
+USERS = 'users'
+
+def get_version(name: str) -> int:
+    """
+    Retrieve the current version of a data set (e.g. 'ratings') from the data_versions table.
+    A data set that has never been changed has version 0.
+    """
+    version = db.session.scalar(sa.select(DataVersion.version).where(DataVersion.name == name))
+    return version or 0
+
+def get_versions(names: Iterable[str]) -> Dict[str, Tuple[int, Optional[datetime]]]:
+    """
+    Retrieve the current versions of several data sets at once, with the time they were last changed (UTC, None if unknown).
+    A data set that has never been changed has version 0.
+    """
+    names = list(names)
+    rows = db.session.execute(
+        sa.select(DataVersion.name, DataVersion.version, DataVersion.updated_at).where(DataVersion.name.in_(names))
+    )
+    found = {name: (version, updated_at) for name, version, updated_at in rows}
+    return {name: found.get(name, (0, None)) for name in names}
+
+def insert_missing(name: str):
+    """
+    Create the version row of a data set with version 0 if it does not exist yet, without failing if another transaction
+    creates it at the same time (INSERT ... ON CONFLICT DO NOTHING / ON DUPLICATE KEY UPDATE, or on other databases a plain
+    INSERT in a savepoint whose duplicate key error is ignored).
+    The rows are created by the migrations, this is only needed for databases created otherwise (e.g. db.create_all()).
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        statement = mysql.insert(DataVersion).values(name=name, version=0)
+        statement = statement.on_duplicate_key_update(name=statement.inserted.name)
+    elif dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(DataVersion).values(name=name, version=0).on_conflict_do_nothing(index_elements=['name'])
+    else:
+        # The savepoint is rolled back if another transaction created the row, the rest of the transaction is kept
+        try:
+            with db.session.begin_nested():
+                db.session.execute(sa.insert(DataVersion).values(name=name, version=0))
+        except IntegrityError:
+            pass
+        return
+    db.session.execute(statement)
+
+def bump_version(name: str) -> int:
+    """
+    Increment the version of a data set in the current transaction and return the new version.
+    The row stays locked until the transaction ends, so concurrent writers get consecutive versions.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    update = sa.update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version + 1, updated_at=now)
+    if db.session.execute(update).rowcount == 0:
+        insert_missing(name)
+        db.session.execute(update)
+    return get_version(name)
+
+def lock_version(name: str) -> int:
+    """
+    Lock the version row of a data set until the end of the transaction and return its latest committed version.
+    Everything that writes a data set (e.g. adds or rates results) takes this lock before it reads what it is going to change,
+    so writers run one after the other. Readers do not take the lock and are never blocked by it.
+
+    The row is locked with SELECT ... FOR UPDATE. SQLite has no row locks: there a no-op update takes the write lock of the database.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(
+            sa.update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version).execution_options(synchronize_session=False)
+        )
+    query = sa.select(DataVersion.version).where(DataVersion.name == name).with_for_update()
+    version = db.session.scalar(query)
+    if version is None:
+        # A missing row can't be locked (and without a gap lock nothing is serialized), so create it and lock it then
+        insert_missing(name)
+        version = db.session.scalar(query)
+    return version
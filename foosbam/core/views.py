@@ -0,0 +1,65 @@
+# VIEWS
+# -----
+# Small structs with the data of a single row on a page (a result, a place in a ranking), created directly from SQLAlchemy rows.
+# Pages only iterate over these rows, so there is no need to build a DataFrame first.
+
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List
+from zoneinfo import ZoneInfo
+
+LOCAL_TIMEZONE = ZoneInfo('Europe/Amsterdam')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M'
+
+def format_timestamp(dt: datetime) -> str:
+    """Convert a timestamp from the database (UTC, without timezone) to Amsterdam time, in the format used on the pages."""
+    return dt.replace(tzinfo=timezone.utc).astimezone(LOCAL_TIMEZONE).strftime(TIMESTAMP_FORMAT)
+
+class ResultView:
+    __slots__ = ('id', 'played_at', 'att_black', 'def_black', 'att_white', 'def_white', 'score_black', 'score_white', 'status')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.played_at = format_timestamp(row.played_at)
+        self.att_black = row.att_black.title()
+        self.def_black = row.def_black.title()
+        self.att_white = row.att_white.title()
+        self.def_white = row.def_white.title()
+        self.score_black = row.score_black
+        self.score_white = row.score_white
+        self.status = row.status
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class RankingView:
+    __slots__ = ('rank', 'user_id', 'player', 'rating', 'since')
+
+    def __init__(self, rank: int, user_id: int, username: str, rating: int, since: datetime):
+        self.rank = rank
+        self.user_id = user_id
+        self.player = username.title()
+        self.rating = rating
+        self.since = format_timestamp(since)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def create_ranking(rows: Iterable) -> List[RankingView]:
+    """
+    Create a ranking from rows of (since, user_id, username, rating), sorted on rating (highest first).
+    Players with the same rating share the highest place, after which places are skipped (1, 2, 2, 4).
+
+    Example:
+    >>> since = datetime(2024, 5, 1)
+    >>> [r.rank for r in create_ranking([(since, 1, 'a', 1600), (since, 2, 'b', 1550), (since, 3, 'c', 1550), (since, 4, 'd', 1500)])]
+    [1, 2, 2, 4]
+    """
+    ranking = []
+    rank = 0
+    previous_rating = None
+    for position, (since, user_id, username, rating) in enumerate(rows, start=1):
+        if rating != previous_rating:
+            rank = position
+            previous_rating = rating
+        ranking.append(RankingView(rank, user_id, username, rating, since))
+    return ranking
@@ -0,0 +1,93 @@
+# DATABASE ENGINE PROFILES
+# ------------------------
+# The engine options depend on where the app runs. The profile is chosen with DB_PROFILE ('auto' picks it from the database URL):
+# - 'mysql' (production, PyMySQL): a pool of DB_POOL_SIZE connections that can grow by DB_MAX_OVERFLOW connections during bursts
+#   (e.g. league nights) instead of opening and closing a connection per request. Connections are checked before use (DB_POOL_PRE_PING)
+#   and recycled after DB_POOL_RECYCLE seconds, before MySQL closes idle connections itself.
+#   Transactions use DB_ISOLATION_LEVEL (default READ COMMITTED): every statement sees what was committed before it, so a writer
+#   that waited for the ratings lock (see versions.lock_version) reads the ratings of the writer before it.
+# - 'sqlite' (local): every new connection sets
+#   - PRAGMA journal_mode (SQLITE_JOURNAL_MODE, default WAL): readers no longer block the writer and the other way around
+#   - PRAGMA busy_timeout (SQLITE_BUSY_TIMEOUT, milliseconds): how long to wait for a lock before failing with "database is locked"
+#   - PRAGMA synchronous (SQLITE_SYNCHRONOUS, default NORMAL): with WAL, NORMAL only syncs at checkpoints, so commits are faster;
+#     a power loss may lose the last commits, but never corrupts the database. Use FULL to sync every commit.
+# - 'default': only DB_POOL_RECYCLE, as before the profiles (e.g. for other databases)
+# Options set in SQLALCHEMY_ENGINE_OPTIONS take precedence over the profile.
+
+from functools import partial
+import sqlalchemy as sa
+from typing import Dict
+
+PROFILES = ['auto', 'mysql', 'sqlite', 'default']
+JOURNAL_MODES = ['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']
+SYNCHRONOUS = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+
+def get_profile(config) -> str:
+    """
+    The engine profile of a config, with 'auto' resolved from the database URL.
+
+    Raises:
+        ValueError: If DB_PROFILE is unknown.
+    """
+    profile = config.get('DB_PROFILE', 'auto')
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown DB_PROFILE {profile}, choose from {", ".join(PROFILES)}.')
+    if profile == 'auto':
+        backend = sa.engine.make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+        profile = backend if backend in ['mysql', 'sqlite'] else 'default'
+    return profile
+
+def get_engine_options(config) -> Dict:
+    """The options for create_engine: those of the profile, updated with SQLALCHEMY_ENGINE_OPTIONS."""
+    profile = get_profile(config)
+    if profile == 'mysql':
+        options = {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'isolation_level': config['DB_ISOLATION_LEVEL'],
+        }
+    elif profile == 'sqlite':
+        options = {}
+    else:
+        options = {'pool_recycle': config['DB_POOL_RECYCLE']}
+    return {**options, **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+def get_sqlite_pragmas(config) -> Dict[str, str]:
+    """
+    The pragmas that the sqlite profile sets on every connection.
+
+    Raises:
+        ValueError: If SQLITE_JOURNAL_MODE or SQLITE_SYNCHRONOUS is unknown.
+    """
+    journal_mode = config['SQLITE_JOURNAL_MODE'].upper()
+    synchronous = config['SQLITE_SYNCHRONOUS'].upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f'Unknown SQLITE_JOURNAL_MODE {journal_mode}, choose from {", ".join(JOURNAL_MODES)}.')
+    if synchronous not in SYNCHRONOUS:
+        raise ValueError(f'Unknown SQLITE_SYNCHRONOUS {synchronous}, choose from {", ".join(SYNCHRONOUS)}.')
+    return {
+        'journal_mode': journal_mode,
+        'busy_timeout': str(int(config['SQLITE_BUSY_TIMEOUT'])),
+        'synchronous': synchronous,
+    }
+
+def set_pragmas(pragmas: Dict[str, str], dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+def configure(app):
+    """Set the engine options of the profile. Call before db.init_app."""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(app.config)
+
+def init_app(app, db):
+    """Set the pragmas of the sqlite profile on every new connection. Call after db.init_app."""
+    if get_profile(app.config) != 'sqlite':
+        return
+    pragmas = get_sqlite_pragmas(app.config)
+    with app.app_context():
+        sa.event.listen(db.engine, 'connect', partial(set_pragmas, pragmas))
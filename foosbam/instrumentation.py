@@ -0,0 +1,184 @@
+# REQUEST INSTRUMENTATION
+# -----------------------
+# With INSTRUMENTATION enabled, every request records:
+# - the number of SQL statements and their total time (SQLAlchemy before/after_cursor_execute events), and the
+#   INSTRUMENTATION_SLOWEST slowest statements (without their parameters)
+# - the time spent rendering templates (Flask before_render_template/template_rendered signals)
+# - the total time from request_started until the response is complete
+# The numbers are sent back in a Server-Timing header (shown in the network tab of the browser), written as a JSON line to
+# the foosbam.requests logger, and kept in a ring buffer of the last INSTRUMENTATION_BUFFER requests of the process,
+# which admins (see ADMINS) can view at /debug/requests.
+#
+# When INSTRUMENTATION is disabled (the default), nothing is registered: no events, no signals, no header, and
+# /debug/requests answers 404.
+
+from collections import deque
+from datetime import datetime, timezone
+from flask import current_app, g, has_request_context, request
+from flask import before_render_template, request_started, template_rendered
+from flask_login import current_user
+import heapq
+import json
+import logging
+import sqlalchemy as sa
+import time
+from typing import Dict, List, Optional
+
+class RequestStats:
+    """What one request did: SQL statements (count, total seconds, slowest), template rendering and total seconds."""
+    __slots__ = ('started_at', 'method', 'path', 'endpoint', 'status', 'user_id', 'total', 'queries', 'sql_time',
+                 'render_time', 'slowest', 'slowest_size', 'started', 'render_started')
+
+    def __init__(self, method: str, path: str, slowest_size: int):
+        self.started_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.method = method
+        self.path = path
+        self.endpoint = None
+        self.status = None
+        self.user_id = None
+        self.total = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        # heap of (seconds, statement number, statement), the fastest first
+        self.slowest = []
+        self.slowest_size = slowest_size
+        self.started = time.perf_counter()
+        self.render_started = None
+
+    def add_query(self, statement: str, seconds: float):
+        self.queries += 1
+        self.sql_time += seconds
+        entry = (seconds, self.queries, statement)
+        if len(self.slowest) < self.slowest_size:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def get_slowest(self) -> List[tuple]:
+        """The slowest statements as (seconds, statement), the slowest first."""
+        return [(seconds, statement) for seconds, _, statement in sorted(self.slowest, reverse=True)]
+
+    @property
+    def app_time(self) -> float:
+        """Seconds spent outside SQL and templates (Python code, waiting for locks)."""
+        return max(0.0, self.total - self.sql_time - self.render_time)
+
+    def server_timing(self) -> str:
+        return ', '.join([
+            f'sql;desc="{self.queries} queries";dur={self.sql_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'app;dur={self.app_time * 1000:.1f}',
+            f'total;dur={self.total * 1000:.1f}',
+        ])
+
+    def to_dict(self, statements: bool = True) -> Dict:
+        """The stats as a dict, with the slowest statements, or only the duration of the slowest one (for the log)."""
+        slowest = self.get_slowest()
+        stats = {
+            'started_at': self.started_at.isoformat(),
+            'method': self.method,
+            'path': self.path,
+            'endpoint': self.endpoint,
+            'status': self.status,
+            'user_id': self.user_id,
+            'total_ms': round(self.total * 1000, 2),
+            'queries': self.queries,
+            'sql_ms': round(self.sql_time * 1000, 2),
+            'render_ms': round(self.render_time * 1000, 2),
+        }
+        if statements:
+            stats['slowest'] = [{'ms': round(seconds * 1000, 2), 'statement': statement} for seconds, statement in slowest]
+        else:
+            stats['slowest_ms'] = round(slowest[0][0] * 1000, 2) if slowest else None
+        return stats
+
+class EndpointSummary:
+    """The requests of one endpoint in the buffer: count, mean and max total seconds, mean number of statements."""
+    __slots__ = ('endpoint', 'requests', 'mean_total', 'max_total', 'mean_queries', 'mean_sql_time', 'mean_render_time')
+
+    def __init__(self, endpoint: Optional[str], stats: List[RequestStats]):
+        self.endpoint = endpoint
+        self.requests = len(stats)
+        self.mean_total = sum(s.total for s in stats) / len(stats)
+        self.max_total = max(s.total for s in stats)
+        self.mean_queries = sum(s.queries for s in stats) / len(stats)
+        self.mean_sql_time = sum(s.sql_time for s in stats) / len(stats)
+        self.mean_render_time = sum(s.render_time for s in stats) / len(stats)
+
+def enabled(app=None) -> bool:
+    app = app or current_app
+    return 'instrumentation' in app.extensions
+
+def get_current() -> Optional[RequestStats]:
+    """The stats of the current request, None outside a request or when instrumentation is disabled."""
+    return g.get('request_stats') if has_request_context() else None
+
+def get_recent() -> List[RequestStats]:
+    """The requests in the buffer of this process, the most recent first."""
+    return list(reversed(current_app.extensions['instrumentation']))
+
+def summarize(stats: List[RequestStats]) -> List[EndpointSummary]:
+    """Summary per endpoint, the slowest (mean total) first."""
+    by_endpoint = {}
+    for s in stats:
+        by_endpoint.setdefault(s.endpoint, []).append(s)
+    summaries = [EndpointSummary(endpoint, endpoint_stats) for endpoint, endpoint_stats in by_endpoint.items()]
+    return sorted(summaries, key=lambda summary: summary.mean_total, reverse=True)
+
+def on_request_started(sender, **extra):
+    g.request_stats = RequestStats(request.method, request.full_path.rstrip('?'), sender.config['INSTRUMENTATION_SLOWEST'])
+
+def on_before_render_template(sender, template, context, **extra):
+    stats = get_current()
+    if stats is not None:
+        stats.render_started = time.perf_counter()
+
+def on_template_rendered(sender, template, context, **extra):
+    stats = get_current()
+    if stats is not None and stats.render_started is not None:
+        stats.render_time += time.perf_counter() - stats.render_started
+        stats.render_started = None
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info.pop('query_started')
+    stats = get_current()
+    if stats is not None:
+        stats.add_query(statement, seconds)
+
+def finish_request(response):
+    """Complete the stats of the request, add the Server-Timing header, log them and put them in the buffer."""
+    stats = get_current()
+    if stats is None:
+        return response
+    stats.total = time.perf_counter() - stats.started
+    stats.endpoint = request.endpoint
+    stats.status = response.status_code
+    stats.user_id = current_user.get_id() if current_user.is_authenticated else None
+
+    response.headers.add('Server-Timing', stats.server_timing())
+    current_app.logger.getChild('requests').info(json.dumps(stats.to_dict(statements=False)))
+    current_app.extensions['instrumentation'].append(stats)
+    return response
+
+def init_app(app, db):
+    """Register the events, signals and the after_request handler if INSTRUMENTATION is enabled. Call after db.init_app."""
+    if not app.config.get('INSTRUMENTATION'):
+        return
+    app.extensions['instrumentation'] = deque(maxlen=app.config['INSTRUMENTATION_BUFFER'])
+
+    request_started.connect(on_request_started, app)
+    before_render_template.connect(on_before_render_template, app)
+    template_rendered.connect(on_template_rendered, app)
+    app.after_request(finish_request)
+    with app.app_context():
+        sa.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        sa.event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+
+    # A child of the app logger (foosbam.requests), so the log lines go to its handlers (by default one that writes to stderr)
+    logger = app.logger.getChild('requests')
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
@@ -0,0 +1,295 @@
+# METRICS
+# -------
+# With METRICS enabled, /metrics answers in the Prometheus text format (e.g. `curl localhost:5000/metrics`), with:
+# - foosbam_http_request_duration_seconds: histogram of the request time per endpoint and method
+# - foosbam_db_pool_wait_seconds: histogram of the time to check out a connection from the pool (waits when all are in use)
+# - foosbam_rating_duration_seconds: histogram of rating queued results (see rating_jobs.process_jobs), per method
+#   (incremental or replay)
+# - foosbam_ranking_query_seconds: histogram of the ranking queries, per ranking (all-time or season)
+# - foosbam_cache_requests_total: counter of page cache and match view cache lookups, per cache and result
+#   (hit, miss, not_modified, bypass), for the hit ratio
+# - gauges that are read from the database on every scrape: matches per season and status, ratings per season,
+#   and the state of the rating queue (see rating_jobs.get_metrics)
+#
+# Counters and histograms are shared by all processes (e.g. gunicorn workers) through files in METRICS_DIR:
+# every process writes only to its own memory-mapped file (named after its pid), so updating a value never takes a lock
+# (only adding a new series to the file does), and a scrape sums the files of all processes.
+# Files of stopped processes keep counting, so counters do not drop when a worker restarts. Empty METRICS_DIR before
+# starting the app server, as the values of the previous run would otherwise be added.
+#
+# Within one process, two threads that update the same series at the same moment may lose one of the updates;
+# gunicorn sync workers handle one request at a time.
+#
+# When METRICS is disabled (the default), /metrics does not exist and the update functions return right away.
+
+from bisect import bisect_left
+from flask import Response, abort, current_app, g, request, request_started
+from functools import wraps
+import json
+import mmap
+import os
+import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+INITIAL_SIZE = 64 * 1024
+HEADER = struct.Struct('<Q')      # bytes in use
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+
+REQUEST_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+POOL_BUCKETS = [0.0001, 0.001, 0.01, 0.1, 0.5, 1, 5, 30]
+RATING_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+QUERY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1]
+
+# name -> (type, help, buckets)
+METRICS = {
+    'foosbam_http_request_duration_seconds': ('histogram', 'Time to handle a request.', REQUEST_BUCKETS),
+    'foosbam_db_pool_wait_seconds': ('histogram', 'Time to check out a database connection from the pool.', POOL_BUCKETS),
+    'foosbam_rating_duration_seconds': ('histogram', 'Time to rate the queued results, including writing the ratings.', RATING_BUCKETS),
+    'foosbam_ranking_query_seconds': ('histogram', 'Time to query a ranking.', QUERY_BUCKETS),
+    'foosbam_cache_requests_total': ('counter', 'Lookups in the page cache and the match view cache.', None),
+}
+
+class MmapValues:
+    """
+    The values of the series of one process, in a memory-mapped file: a header with the bytes in use, then entries of
+    a key length, the key (JSON of metric name, sample suffix and labels, padded to 8 bytes) and a float64 value.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{os.getpid()}.db')
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.positions: Dict[tuple, int] = {}
+        self.file = open(self.path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.truncate(INITIAL_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used = HEADER.unpack_from(self.map, 0)[0] or HEADER.size
+        HEADER.pack_into(self.map, 0, self.used)
+        for key, position in read_entries(self.map):
+            self.positions[parse_key(key)] = position
+
+    def position(self, key: tuple) -> int:
+        position = self.positions.get(key)
+        if position is not None:
+            return position
+        with self.lock:
+            if key not in self.positions:
+                self.positions[key] = self.allocate(json.dumps(key).encode('utf-8'))
+            return self.positions[key]
+
+    def allocate(self, encoded: bytes) -> int:
+        """Add an entry with value 0 for a new series and return the position of its value."""
+        padded = encoded + b' ' * (-(KEY_LENGTH.size + len(encoded)) % 8)
+        size = KEY_LENGTH.size + len(padded) + VALUE.size
+        if self.used + size > len(self.map):
+            # A new, larger map; values written through the old map end up in the same file
+            self.file.truncate(max(2 * len(self.map), self.used + size))
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        KEY_LENGTH.pack_into(self.map, self.used, len(padded))
+        self.map[self.used + KEY_LENGTH.size:self.used + KEY_LENGTH.size + len(padded)] = padded
+        position = self.used + KEY_LENGTH.size + len(padded)
+        VALUE.pack_into(self.map, position, 0.0)
+        # Readers only see the entry once it is complete
+        self.used += size
+        HEADER.pack_into(self.map, 0, self.used)
+        return position
+
+    def add(self, key: tuple, amount: float):
+        position = self.position(key)
+        VALUE.pack_into(self.map, position, VALUE.unpack_from(self.map, position)[0] + amount)
+
+def parse_key(key: str) -> tuple:
+    name, suffix, labels = json.loads(key)
+    return name, suffix, tuple(tuple(label) for label in labels)
+
+def read_entries(data) -> Iterable[Tuple[str, int]]:
+    """The keys and value positions of the entries of a values file."""
+    used = HEADER.unpack_from(data, 0)[0]
+    offset = HEADER.size
+    while offset < used:
+        length = KEY_LENGTH.unpack_from(data, offset)[0]
+        key = bytes(data[offset + KEY_LENGTH.size:offset + KEY_LENGTH.size + length]).decode('utf-8').rstrip(' ')
+        position = offset + KEY_LENGTH.size + length
+        yield key, position
+        offset = position + VALUE.size
+
+def read_directory(directory: str) -> Dict[tuple, float]:
+    """The sum of the values of all processes, per key."""
+    totals: Dict[tuple, float] = {}
+    for name in os.listdir(directory):
+        if not name.endswith('.db'):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            continue
+        for key, position in read_entries(data):
+            key = parse_key(key)
+            totals[key] = totals.get(key, 0.0) + VALUE.unpack_from(data, position)[0]
+    return totals
+
+# The values of this process, None when METRICS is disabled
+_values: Optional[MmapValues] = None
+_directory: Optional[str] = None
+
+def get_values() -> Optional[MmapValues]:
+    global _values
+    if _values is not None and _values.pid != os.getpid():
+        # Forked after the file was opened (e.g. gunicorn --preload): every process has its own file
+        _values = MmapValues(_directory)
+    return _values
+
+def label_key(labels: Dict[str, str]) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def inc(name: str, amount: float = 1, **labels):
+    """Increase a counter."""
+    values = get_values()
+    if values is None:
+        return
+    values.add((name, '', label_key(labels)), amount)
+
+def observe(name: str, seconds: float, **labels):
+    """Add an observation to a histogram: its bucket (the first with seconds <= le), the sum and the count."""
+    values = get_values()
+    if values is None:
+        return
+    labels = label_key(labels)
+    buckets = METRICS[name][2]
+    values.add((name, bisect_left(buckets, seconds), labels), 1)
+    values.add((name, '_sum', labels), seconds)
+    values.add((name, '_count', labels), 1)
+
+def timed(name: str, **labels):
+    """Decorator that observes the duration of every call in a histogram."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _values is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that observes how long every checkout takes, i.e. how long a request waits for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            observe('foosbam_db_pool_wait_seconds', time.perf_counter() - started)
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+def format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+def render_stored(totals: Dict[tuple, float]) -> List[str]:
+    """Lines of the counters and histograms, with cumulative histogram buckets."""
+    lines = []
+    for name, (kind, help, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+        series = sorted({labels for metric, _, labels in totals if metric == name})
+        for labels in series:
+            if kind == 'counter':
+                lines.append(f'{name}{format_labels(labels)} {format_value(totals[(name, "", labels)])}')
+                continue
+            cumulative = 0.0
+            for index, le in enumerate(buckets + ['+Inf']):
+                cumulative += totals.get((name, index, labels), 0.0)
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", str(le)),))} {format_value(cumulative)}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(totals.get((name, "_sum", labels), 0.0))}')
+            lines.append(f'{name}_count{format_labels(labels)} {format_value(totals.get((name, "_count", labels), 0.0))}')
+    return lines
+
+def gauge(lines: List[str], name: str, help: str, samples: Iterable[Tuple[Dict[str, str], Optional[float]]]):
+    lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f'{name}{format_labels(label_key(labels))} {format_value(value)}')
+
+def render_database() -> List[str]:
+    """Lines of the gauges that are read from the database."""
+    from foosbam import db
+    from foosbam.core import rating_jobs
+    from foosbam.models import Match, Rating, Result
+
+    matches = db.session.execute(
+        sa.select(Match.season, Result.status, sa.func.count()).join(
+            Result, Result.match_id == Match.id
+        ).group_by(Match.season, Result.status)
+    ).all()
+    ratings = db.session.execute(
+        sa.select(Rating.season, sa.func.count()).where(Rating.match_id.is_not(None)).group_by(Rating.season)
+    ).all()
+    queue = rating_jobs.get_metrics()
+    db.session.rollback()
+
+    lines = []
+    gauge(lines, 'foosbam_matches', 'Matches per season and result status.',
+          [({'season': season, 'status': status}, count) for season, status, count in matches])
+    gauge(lines, 'foosbam_ratings', 'Ratings of matches per season.', [({'season': season}, count) for season, count in ratings])
+    gauge(lines, 'foosbam_rating_queue_depth', 'Queued rating jobs.', [({}, queue.depth)])
+    gauge(lines, 'foosbam_rating_queue_oldest_age_seconds', 'Age of the oldest queued rating job.', [({}, queue.oldest_age)])
+    gauge(lines, 'foosbam_rating_workers', 'Rating workers that were seen recently.', [({}, queue.workers)])
+    gauge(lines, 'foosbam_rating_job_latency_seconds', f'Time from queued to rated of the jobs of the last {queue.window} seconds.',
+          [({'quantile': '0.5'}, queue.latency_p50), ({'quantile': '0.95'}, queue.latency_p95), ({'quantile': '1'}, queue.latency_max)])
+    return lines
+
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    lines = render_stored(read_directory(_directory)) + render_database()
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+def on_request_started(sender, **extra):
+    g.metrics_started = time.perf_counter()
+
+def observe_request(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        observe('foosbam_http_request_duration_seconds', time.perf_counter() - started,
+                endpoint=request.endpoint or 'none', method=request.method)
+    return response
+
+def configure(app):
+    """Time the pool checkouts, unless another pool class is configured (e.g. for in-memory SQLite). Call before db.init_app."""
+    if not app.config.get('METRICS'):
+        return
+    url = sa.engine.make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('poolclass', TimedQueuePool)
+
+def init_app(app):
+    """Open the values file of this process and add /metrics if METRICS is enabled."""
+    global _values, _directory
+    if not app.config.get('METRICS'):
+        return
+    _directory = app.config['METRICS_DIR']
+    if _values is None or _values.path != os.path.join(_directory, f'{os.getpid()}.db'):
+        _values = MmapValues(_directory)
+
+    request_started.connect(on_request_started, app)
+    app.after_request(observe_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -17,6 +17,10 @@ class User(UserMixin, db.Model):
 
     def __repr__(self):
         return f'<User {self.username}>'
+
+    @property
+    def is_admin(self):
+        return self.username in current_app.config['ADMINS']
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -49,15 +53,36 @@ class Match(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     played_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False, index=True, unique=True)
     season: so.Mapped[int] = so.mapped_column(nullable=False)
-    att_black: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False)
-    att_white: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False)
-    def_black: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False)
-    def_white: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False)
+    att_black: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False, index=True)
+    att_white: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False, index=True)
+    def_black: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False, index=True)
+    def_white: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False, index=True)
+
+class MatchParticipant(db.Model):
+    # One row per player per match, so the matches of a player can be found with a single index lookup
+    __tablename__ = 'match_participants'
+    __table_args__ = (
+        sa.Index('ix_match_participants_user_id_played_at', 'user_id', 'played_at'),
+    )
+    match_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Match.id), primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), primary_key=True)
+    role: so.Mapped[str] = so.mapped_column(sa.String(16), nullable=False)    # 'att' or 'def'
+    team: so.Mapped[str] = so.mapped_column(sa.String(16), nullable=False)    # 'black' or 'white'
+    played_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=False)
+
+    @staticmethod
+    def from_match(match):
+        return [
+            MatchParticipant(match_id=match.id, user_id=match.att_black, role='att', team='black', played_at=match.played_at),
+            MatchParticipant(match_id=match.id, user_id=match.def_black, role='def', team='black', played_at=match.played_at),
+            MatchParticipant(match_id=match.id, user_id=match.att_white, role='att', team='white', played_at=match.played_at),
+            MatchParticipant(match_id=match.id, user_id=match.def_white, role='def', team='white', played_at=match.played_at),
+        ]
 
 class Result(db.Model):
     __tablename__ = 'results'
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
-    match_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Match.id), nullable=False)
+    match_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Match.id), nullable=False, index=True)
     created_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False, index=True)
     created_by: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False)
     checked_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=True)
@@ -74,6 +99,12 @@ class Result(db.Model):
 
 class Rating(db.Model):
     __tablename__ = 'ratings'
+    __table_args__ = (
+        # Covers the rating history of a player (see history.py), so the history is read from the index only
+        sa.Index('ix_ratings_user_id_since_history', 'user_id', 'since', 'season', 'match_id', 'rating', 'rating_season'),
+        sa.Index('ix_ratings_user_id_season_since', 'user_id', 'season', 'since'),
+        sa.Index('ix_ratings_user_id_match_id', 'user_id', 'match_id'),
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), nullable=False)
     match_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Match.id), nullable=True) # nulls allowed for initial ratings
@@ -83,3 +114,40 @@ class Rating(db.Model):
     rating: so.Mapped[int] = so.mapped_column(nullable=False)
     previous_rating_season: so.Mapped[int] = so.mapped_column(nullable=True) # nulls allowed for initial ratings (at start of each season)
     rating_season: so.Mapped[int] = so.mapped_column(nullable=True) # nulls allowed for initial ratings
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    name: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    version: so.Mapped[int] = so.mapped_column(nullable=False, default=0)
+    updated_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=True)   # UTC, for Last-Modified headers
+
+class PlayerStanding(db.Model):
+    __tablename__ = 'player_standings'
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), primary_key=True)
+    rating: so.Mapped[int] = so.mapped_column(nullable=False, index=True)
+    rating_since: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=False)
+    match_count: so.Mapped[int] = so.mapped_column(nullable=False, default=0)
+
+class SeasonStanding(db.Model):
+    __tablename__ = 'season_standings'
+    season: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), primary_key=True)
+    rating: so.Mapped[int] = so.mapped_column(nullable=False)
+    match_count: so.Mapped[int] = so.mapped_column(nullable=False, default=0)
+    last_played: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=False)
+
+class RatingJob(db.Model):
+    # A result that has to be rated, see core/rating_jobs.py. Jobs are queued while finished_at is null.
+    __tablename__ = 'rating_jobs'
+    id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
+    match_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Match.id), nullable=False, index=True)
+    created_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=False)    # UTC
+    finished_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=True, index=True)    # UTC
+    processed_by: so.Mapped[str] = so.mapped_column(sa.String(16), nullable=True)    # 'worker' or 'inline'
+
+class RatingWorker(db.Model):
+    # A running `flask rating-worker` process, which updates seen_at while it runs
+    __tablename__ = 'rating_workers'
+    name: so.Mapped[str] = so.mapped_column(sa.String(128), primary_key=True)    # hostname:pid
+    started_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=False)    # UTC
+    seen_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), nullable=False)    # UTC
@@ -0,0 +1,30 @@
+"""seed data versions
+
+Revision ID: a7c2e9f4d1b6
+Revises: f1a6d4e9b2c8
+Create Date: 2026-10-18 16:24:09.318517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c2e9f4d1b6'
+down_revision = 'f1a6d4e9b2c8'
+branch_labels = None
+depends_on = None
+
+# All names of foosbam/core/versions.py, so the rows can be locked before the first write of a data set
+NAMES = ['matches', 'ratings', 'rerates', 'users']
+
+
+def upgrade():
+    data_versions = sa.table('data_versions', sa.column('name', sa.String), sa.column('version', sa.Integer))
+    existing = set(op.get_bind().scalars(sa.select(data_versions.c.name)))
+    op.bulk_insert(data_versions, [{'name': name, 'version': 0} for name in NAMES if name not in existing])
+
+
+def downgrade():
+    # The rows are also created when a data set is first changed, so they are kept
+    pass
@@ -0,0 +1,28 @@
+"""confirmed results
+
+Revision ID: f1a6d4e9b2c8
+Revises: e5b8c3d1f7a2
+Create Date: 2026-10-18 13:02:41.775104
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a6d4e9b2c8'
+down_revision = 'e5b8c3d1f7a2'
+branch_labels = None
+depends_on = None
+
+results = sa.table('results', sa.column('status', sa.String))
+
+
+def upgrade():
+    # Only confirmed results are rated now. Results that were added before were all rated, so they count as confirmed.
+    op.execute(results.update().where(results.c.status == 'Pending').values(status='Confirmed'))
+
+
+def downgrade():
+    # Before, every result was rated, whatever its status
+    op.execute(results.update().where(results.c.status == 'Confirmed').values(status='Pending'))